@@ -0,0 +1,129 @@
+"""
+Statistics of the test results per (resource, client, operation, size): median, percentiles,
+bootstrap confidence intervals of the median and coefficient of variation. The first iterations
+of a run can be dropped as warm-up, outliers are flagged with the interquartile range.
+
+    data = plotting.readData(files)
+    data['real time Gbit/s'] = data['size GB']*8/data['real time']
+    summary = summarize(data, 'real time Gbit/s', warmup=1)
+    exportSummary(summary, 'summary.csv')
+"""
+
+import numpy
+import pandas as pd
+
+GROUP_COLUMNS = ['iresource', 'client', 'iget/iput', 'size']
+
+def addIteration(data, groups=GROUP_COLUMNS):
+    """
+    Returns the iteration of every row. Result files without the column 'iteration' count the rows
+    per group (and per file, if the column 'source' is given) in the order of their date.
+    """
+    if 'iteration' in data.columns and data['iteration'].notnull().all():
+        return data['iteration']
+    keys = list(groups) + (['source'] if 'source' in data.columns else [])
+    order = numpy.argsort(data['date'].astype(str).values, kind='mergesort')
+    counted = numpy.empty(len(data))
+    counted[order] = data.iloc[order].groupby(keys, observed=True, sort=False).cumcount().values + 1
+    counted = pd.Series(counted, index=data.index)
+    if 'iteration' in data.columns:
+        return pd.to_numeric(data['iteration'], errors='coerce').fillna(counted)
+    return counted
+
+def markOutliers(data, column, groups=GROUP_COLUMNS, k=1.5):
+    """
+    Flags the values outside [q1 - k*IQR, q3 + k*IQR] of their group.
+    Returns a boolean column.
+    """
+    grouped = data.groupby(list(groups), observed=True)[column]
+    q1 = grouped.transform(lambda x: x.quantile(0.25))
+    q3 = grouped.transform(lambda x: x.quantile(0.75))
+    return (data[column] < q1 - k * (q3 - q1)) | (data[column] > q3 + k * (q3 - q1))
+
+def bootstrapCI(values, statistic=numpy.median, n=1000, level=0.95, rng=None):
+    """
+    Percentile bootstrap confidence interval of a statistic.
+    values:     sample
+    statistic:  function of an array and the keyword axis, e.g. numpy.median
+    n:          number of resamples
+    level:      confidence level
+    rng:        numpy.random.RandomState for reproducible intervals
+
+    Returns (low, high), (nan, nan) for an empty sample.
+    """
+    values = numpy.asarray(values, dtype=float)
+    values = values[~numpy.isnan(values)]
+    if len(values) == 0:
+        return numpy.nan, numpy.nan
+    if rng is None:
+        rng = numpy.random.RandomState()
+    resampled = statistic(values[rng.randint(0, len(values), (n, len(values)))], axis=1)
+    return (numpy.percentile(resampled, 100 * (1 - level) / 2.),
+        numpy.percentile(resampled, 100 * (1 + level) / 2.))
+
+def summarize(data, column, groups=GROUP_COLUMNS, warmup=0, dropOutliers=False, n=1000, level=0.95, seed=0):
+    """
+    Computes the statistics of a column per group.
+    data:           data frame of results, see plotting.readData
+    column:         measured value, e.g. 'real time' or 'real time Gbit/s'
+    groups:         columns identifying a group
+    warmup:         number of first iterations of every run that are dropped
+    dropOutliers:   drop the values flagged by markOutliers before computing the statistics
+    n, level:       resamples and confidence level of the bootstrap interval of the median
+    seed:           seed of the bootstrap
+
+    Returns a data frame with one row per group and the columns
+        count, outliers, mean, median, ci low, ci high, p5, p95, p99, cv
+    """
+    groups = list(groups)
+    data = data[data[column].notnull()].copy()
+    if warmup > 0:
+        data = data[addIteration(data, groups) > warmup]
+    data['outlier'] = markOutliers(data, column, groups)
+
+    rng = numpy.random.RandomState(seed)
+    rows = []
+    for key, group in data.groupby(groups, observed=True):
+        outliers = int(group['outlier'].sum())
+        if dropOutliers:
+            group = group[~group['outlier']]
+        values = group[column].values.astype(float)
+        low, high = bootstrapCI(values, numpy.median, n, level, rng)
+        mean = values.mean() if len(values) > 0 else numpy.nan
+        row = dict(zip(groups, key if isinstance(key, tuple) else (key,)))
+        row.update({
+            'count':    len(values),
+            'outliers': outliers,
+            'mean':     mean,
+            'median':   numpy.median(values) if len(values) > 0 else numpy.nan,
+            'ci low':   low,
+            'ci high':  high,
+            'p5':       numpy.percentile(values, 5) if len(values) > 0 else numpy.nan,
+            'p95':      numpy.percentile(values, 95) if len(values) > 0 else numpy.nan,
+            'p99':      numpy.percentile(values, 99) if len(values) > 0 else numpy.nan,
+            'cv':       values.std(ddof=1) / mean if len(values) > 1 and mean != 0 else numpy.nan,
+        })
+        rows.append(row)
+
+    return pd.DataFrame(rows, columns=groups + ['count', 'outliers', 'mean', 'median', 'ci low', 'ci high',
+        'p5', 'p95', 'p99', 'cv'])
+
+def errorBars(summary, index='size', columns='client'):
+    """
+    Pivots a summary for DataFrame.plot.bar: medians with the confidence interval as error bars.
+    Returns (medians, yerr), yerr has the shape (columns, 2, rows) matplotlib expects for asymmetric errors.
+    """
+    median = summary.pivot(index=index, columns=columns, values='median')
+    low = median - summary.pivot(index=index, columns=columns, values='ci low')
+    high = summary.pivot(index=index, columns=columns, values='ci high') - median
+    yerr = numpy.array([[low[c].values, high[c].values] for c in median.columns])
+    return median, yerr
+
+def exportSummary(summary, path):
+    """
+    Writes a summary as csv, or as html table if path ends with .html.
+    """
+    if path.endswith('.html'):
+        summary.to_html(path, index=False, float_format=lambda x: '%.4g' %x)
+    else:
+        summary.to_csv(path, index=False)
@@ -0,0 +1,726 @@
+"""
+Transfer backends of the test functions. A backend implements the iRODS operations the tests need:
+    mkdir(collection)                           like imkdir
+    put(iresource, source, destination)         like iput -r -b -K -f -R
+    get(iresource, source, destination)         like iget -r -b -K -f -R
+    stream(iresource, source, sink)             like iget -f -R <data object> -, sink.update(chunk) receives the data
+    checksum(path)                              like ichksum -r
+    snapshot(path)                              catalog.CatalogIndex of a collection or data object
+    remove(path, force=False)                   like irm -r, force=True bypasses the trash (irm -rf)
+    emptyTrash()                                like irmtrash
+Every operation returns an icommands.CommandResult, failures have an err starting with "ERROR".
+
+put and get take the transfer settings as keyword arguments:
+    threads:    parallel transfer threads (-N), None uses the setting of the backend
+    bulk:       bulk upload (-b), default True
+    checksum:   compute and verify checksums during the transfer (-K), default True
+    monitors:   started with the pid of the transfer process and stopped at its end, see icommands.run
+
+IcommandsBackend    forks one icommand per operation (connection and authentication per call)
+PRCBackend          python-irodsclient in the same process, sessions and their connections are reused
+SimulatedBackend    a zone simulated on the local file system with configurable bandwidth, latency and failures
+"""
+
+import os
+import time
+import json
+import random
+import shutil
+import sqlite3
+import resource
+import posixpath
+import threading
+
+import icommands
+from icommands import CommandResult, monotonic
+from catalog import CatalogIndex, Replica, snapshotCatalog
+from checksums import newHash, formatChecksum, CHUNKSIZE
+
+try:
+    from irods.session import iRODSSession
+    from irods.models import Collection, DataObject
+    from irods.column import Criterion
+    import irods.keywords as kw
+except ImportError:
+    iRODSSession = None
+
+def timedCall(argv, operation, *args, **kwargs):
+    """
+    Runs an in-process operation and measures it like icommands.run, user and system
+    time are those of the test process. maxrss is left empty: the peak memory of the test 
+    process only grows and is not comparable with that of a single icommand.
+    argv:       command line the operation corresponds to, for the CommandResult
+    operation:  function, called with args; an exception is reported like an icommands error
+    kwargs:     monitors, see icommands.run, they are started with the pid of the test process
+    """
+    monitors = kwargs.get("monitors", ())
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = monotonic()
+    started = []
+    try:
+        for monitor in monitors:
+            monitor.start(os.getpid())
+            started.append(monitor)
+        operation(*args)
+        returncode, err = 0, ""
+    except Exception, e:
+        returncode, err = 1, "ERROR: %s: %s\n" %(type(e).__name__, e)
+    finally:
+        real = monotonic() - start
+        icommands.stopMonitors(started)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    return CommandResult(argv, returncode, "", err, real, after.ru_utime - usage.ru_utime,
+        after.ru_stime - usage.ru_stime, "")
+
+class Backend(object):
+    """
+    Interface of the transfer backends.
+    local:  True if the backend needs no iRODS environment
+    """
+    name = None
+    local = False
+
+    def mkdir(self, collection):
+        raise NotImplementedError
+
+    def put(self, iresource, source, destination, threads=None, bulk=True, checksum=True, monitors=()):
+        raise NotImplementedError
+
+    def get(self, iresource, source, destination, threads=None, bulk=True, checksum=True, monitors=()):
+        raise NotImplementedError
+
+    def stream(self, iresource, source, sink, monitors=()):
+        raise NotImplementedError
+
+    def checksum(self, path):
+        raise NotImplementedError
+
+    def snapshot(self, path):
+        raise NotImplementedError
+
+    def remove(self, path, force=False):
+        raise NotImplementedError
+
+    def emptyTrash(self):
+        raise NotImplementedError
+
+class IcommandsBackend(Backend):
+    """
+    Runs the icommands, see icommands.Runner.
+    threads:    number of parallel transfer threads (iput/iget -N), None uses the server default
+    timeouts:   {icommand: seconds} after which a command is killed, e.g. {"iget": 3600, "ils": 60},
+                commands without timeout run until they end
+    limit:      number of icommands running at the same time, None for no limit
+    """
+    name = "icommands"
+
+    def __init__(self, threads=None, timeouts=None, limit=None):
+        self.threads = threads
+        self.timeouts = timeouts or {}
+        if limit is not None:
+            icommands.RUNNER.setLimit(limit)
+
+    def _run(self, argv, monitors=(), consume=None):
+        return icommands.run(argv, monitors, consume, self.timeouts.get(argv[0]))
+
+    def _flags(self, threads=None, bulk=True, checksum=True, monitors=()):
+        flags = ["-r"]
+        if bulk:
+            flags.append("-b")
+        if checksum:
+            flags.append("-K")
+        flags.append("-f")
+        if threads is None:
+            threads = self.threads
+        if threads is not None:
+            flags.extend(["-N", str(threads)])
+        return flags
+
+    def mkdir(self, collection):
+        return self._run(["imkdir", collection])
+
+    def put(self, iresource, source, destination, threads=None, bulk=True, checksum=True, monitors=()):
+        return self._run(["iput"] + self._flags(threads, bulk, checksum) + ["-R", iresource, source, destination],
+            monitors)
+
+    def get(self, iresource, source, destination, threads=None, bulk=True, checksum=True, monitors=()):
+        return self._run(["iget"] + self._flags(threads, bulk, checksum) + ["-R", iresource, source, destination],
+            monitors)
+
+    def stream(self, iresource, source, sink, monitors=()):
+        def consume(pipe):
+            for chunk in iter(lambda: pipe.read(CHUNKSIZE), b""):
+                sink.update(chunk)
+        # to standard output iget transfers with a single stream
+        return self._run(["iget", "-f", "-R", iresource, source, "-"], monitors, consume)
+
+    def checksum(self, path):
+        return self._run(["ichksum", "-r", path])
+
+    def snapshot(self, path):
+        return snapshotCatalog(path, timeout=self.timeouts.get("ils"))
+
+    def remove(self, path, force=False):
+        return self._run(["irm", "-rf" if force else "-r", path])
+
+    def emptyTrash(self):
+        return self._run(["irmtrash"])
+
+# Sessions shared by all PRCBackend instances, one per environment file.
+# A session keeps a pool of authenticated connections.
+_sessions = {}
+
+def prcSession(envFile):
+    """
+    Returns the pooled python-irodsclient session of an irods_environment.json.
+    """
+    if iRODSSession is None:
+        raise ImportError("The backend prc needs python-irodsclient: pip install python-irodsclient")
+    if envFile not in _sessions:
+        _sessions[envFile] = iRODSSession(irods_env_file=envFile)
+    return _sessions[envFile]
+
+class PRCBackend(Backend):
+    """
+    Transfers with python-irodsclient within the test process.
+    envFile:    irods_environment.json, default ~/.irods/irods_environment.json
+    threads:    number of parallel transfer threads, None uses the client default
+    bufferSize: bytes per read/write, if given data is streamed through a single connection
+                with this buffer size instead of the parallel transfer
+    """
+    name = "prc"
+
+    def __init__(self, envFile=None, threads=None, bufferSize=None):
+        if envFile is None:
+            envFile = os.path.expanduser("~")+"/.irods/irods_environment.json"
+        self.envFile = envFile
+        self.threads = threads
+        self.bufferSize = bufferSize
+        self._home = None
+
+    @property
+    def session(self):
+        # Opened on first use, the tests write the environment file only when they start
+        return prcSession(self.envFile)
+
+    @property
+    def home(self):
+        if self._home is None:
+            with open(self.envFile) as f:
+                env = json.load(f)
+            self._home = env.get("irods_home", "/"+env["irods_zone_name"]+"/home/"+env["irods_user_name"])
+        return self._home
+
+    def _path(self, path):
+        if path.startswith("/"):
+            return path.rstrip("/")
+        return (self.home+"/"+path).rstrip("/")
+
+    def _options(self, threads=None, **options):
+        if threads is None:
+            threads = self.threads
+        if threads is not None:
+            options["num_threads"] = threads
+        return options
+
+    def _putFile(self, iresource, source, destination, threads=None, checksum=True):
+        options = {kw.DEST_RESC_NAME_KW: iresource, kw.FORCE_FLAG_KW: ""}
+        if checksum:
+            options[kw.REG_CHKSUM_KW] = ""
+        if self.bufferSize is None:
+            self.session.data_objects.put(source, destination, **self._options(threads, **options))
+        else:
+            if not self.session.data_objects.exists(destination):
+                self.session.data_objects.create(destination, resource=iresource)
+            with open(source, "rb") as src:
+                with self.session.data_objects.open(destination, "w", **options) as dst:
+                    shutil.copyfileobj(src, dst, self.bufferSize)
+            if checksum:
+                self.session.data_objects.get(destination).chksum()
+
+    def _getFile(self, iresource, source, destination, threads=None, checksum=True):
+        options = {kw.FORCE_FLAG_KW: ""}
+        if checksum:
+            options[kw.VERIFY_CHKSUM_KW] = ""
+        if self.bufferSize is None:
+            self.session.data_objects.get(source, destination, **self._options(threads, **options))
+        else:
+            with self.session.data_objects.open(source, "r") as src:
+                with open(destination, "wb") as dst:
+                    shutil.copyfileobj(src, dst, self.bufferSize)
+
+    def _put(self, iresource, source, destination, threads=None, checksum=True):
+        if os.path.isfile(source):
+            return self._putFile(iresource, source, destination, threads, checksum)
+        # iput -r: the folder becomes the destination collection
+        for root, _, files in os.walk(source):
+            coll = destination+("/"+os.path.relpath(root, source) if root != source else "")
+            self.session.collections.create(coll)
+            for f in files:
+                self._putFile(iresource, os.path.join(root, f), coll+"/"+f, threads, checksum)
+
+    def _get(self, iresource, source, destination, threads=None, checksum=True):
+        if self.session.data_objects.exists(source):
+            return self._getFile(iresource, source, destination, threads, checksum)
+        # iget -r: the collection becomes the destination folder
+        for coll, _, objs in self.session.collections.get(source).walk():
+            local = os.path.join(destination, os.path.relpath(coll.path, source))
+            if not os.path.isdir(local):
+                os.makedirs(local)
+            for obj in objs:
+                self._getFile(iresource, obj.path, os.path.join(local, obj.name), threads, checksum)
+
+    def _stream(self, source, sink):
+        with self.session.data_objects.open(source, "r") as src:
+            for chunk in iter(lambda: src.read(self.bufferSize or CHUNKSIZE), b""):
+                sink.update(chunk)
+
+    def _checksum(self, path):
+        if self.session.data_objects.exists(path):
+            self.session.data_objects.get(path).chksum()
+            return
+        for _, _, objs in self.session.collections.get(path).walk():
+            for obj in objs:
+                obj.chksum()
+
+    def _mkdir(self, collection):
+        # imkdir fails on existing collections, collections.create does not
+        if self.session.collections.exists(collection):
+            raise Exception("collection exists: "+collection)
+        self.session.collections.create(collection)
+
+    def mkdir(self, collection):
+        return timedCall(["imkdir", collection], self._mkdir, self._path(collection))
+
+    def put(self, iresource, source, destination, threads=None, bulk=True, checksum=True, monitors=()):
+        # python-irodsclient has no bulk upload, bulk is ignored
+        return timedCall(["iput", source, destination], self._put, iresource, source, self._path(destination),
+            threads, checksum, monitors=monitors)
+
+    def get(self, iresource, source, destination, threads=None, bulk=True, checksum=True, monitors=()):
+        return timedCall(["iget", source, destination], self._get, iresource, self._path(source), destination,
+            threads, checksum, monitors=monitors)
+
+    def stream(self, iresource, source, sink, monitors=()):
+        return timedCall(["iget", source, "-"], self._stream, self._path(source), sink, monitors=monitors)
+
+    def checksum(self, path):
+        return timedCall(["ichksum", "-r", path], self._checksum, self._path(path))
+
+    def snapshot(self, path):
+        root = self._path(path)
+        index = CatalogIndex(path, root)
+        query = self.session.query(Collection.name, DataObject.name, DataObject.replica_number, DataObject.size,
+            DataObject.checksum, DataObject.resource_name, DataObject.replica_status, DataObject.path)
+        if self.session.data_objects.exists(root):
+            coll, name = root.rsplit("/", 1)
+            rows = query.filter(Collection.name == coll).filter(DataObject.name == name)
+        else:
+            rows = [row for row in query.filter(Criterion("like", Collection.name, root+"%"))
+                if row[Collection.name] == root or row[Collection.name].startswith(root+"/")]
+            # like ils -r, collections without data objects are listed too
+            for row in self.session.query(Collection.name).filter(Criterion("like", Collection.name, root+"%")):
+                if row[Collection.name] == root or row[Collection.name].startswith(root+"/"):
+                    index.collections.add(row[Collection.name])
+        for row in rows:
+            index.collections.add(row[Collection.name])
+            index.add(Replica(row[Collection.name]+"/"+row[DataObject.name], int(row[DataObject.replica_number]),
+                row[DataObject.resource_name], int(row[DataObject.size]), row[DataObject.checksum] or "",
+                str(row[DataObject.replica_status]) == "1", row[DataObject.path]))
+        return index
+
+    def _remove(self, path, force=False):
+        if self.session.data_objects.exists(path):
+            self.session.data_objects.unlink(path, force=force)
+        else:
+            self.session.collections.remove(path, recurse=True, force=force)
+
+    def remove(self, path, force=False):
+        return timedCall(["irm", "-rf" if force else "-r", path], self._remove, self._path(path), force)
+
+    def emptyTrash(self):
+        # The trash of the user lives in /<zone>/trash/home/<user>
+        trash = "/"+self.home.split("/")[1]+"/trash"+self.home[len("/"+self.home.split("/")[1]):]
+        def _empty():
+            if self.session.collections.exists(trash):
+                for coll in self.session.collections.get(trash).subcollections:
+                    self.session.collections.remove(coll.path, recurse=True, force=True)
+                for obj in self.session.collections.get(trash).data_objects:
+                    self.session.data_objects.unlink(obj.path, force=True)
+        return timedCall(["irmtrash"], _empty)
+
+class SimulatedFailure(Exception):
+    pass
+
+class _Throttle(object):
+    """
+    Caps the throughput of a simulated resource. All streams of the process share the bandwidth,
+    every chunk reserves the next free time slot of the resource.
+    bandwidth:  bytes per second, None for no limit
+    """
+
+    def __init__(self, bandwidth):
+        self.bandwidth = bandwidth
+        self.free = 0.0
+        self.lock = threading.Lock()
+
+    def consume(self, nbytes):
+        if not self.bandwidth:
+            return
+        with self.lock:
+            now = monotonic()
+            self.free = max(now, self.free) + nbytes / float(self.bandwidth)
+            wait = self.free - now
+        time.sleep(wait)
+
+class SimulatedBackend(Backend):
+    """
+    Simulates an iRODS zone on the local file system, to run and develop the tests without a server
+    and to measure the overhead of the test harness itself.
+    Transfers are not parallelised, the settings threads and bulk of put and get have no effect.
+    The catalog (collections and replicas with size, checksum and resource) is a sqlite database, 
+    the data of each resource is stored in its own vault folder:
+        <root>/catalog.sqlite
+        <root>/<resource>/<zone>/home/<user>/...
+    Removed data is moved to /<zone>/trash/home/<user> until emptyTrash is called.
+
+    root:       folder of the zone, default $TMPDIR/simzone (or $HOME/simzone)
+    resources:  {name: settings}, settings of a resource (all optional):
+                    bandwidth:  bytes per second shared by all streams, None for no limit
+                    latency:    seconds added to each operation and to each file of a transfer
+                    failure:    probability that an operation on the resource fails
+                    corruption: probability that a stored replica does not match its checksum
+                    replicas:   resources that automatically get a replica, like a compound resource
+                Resources that are not configured are created with the default settings.
+    zone, user: home collection /<zone>/home/<user>, relative paths start there
+    checksum:   checksum scheme of the zone: "md5" or "sha2"
+    latency:    default latency per operation in seconds
+    seed:       seed of the failure and corruption injection
+    """
+    name = "sim"
+    local = True
+
+    def __init__(self, root=None, resources=None, zone="simZone", user="rods", checksum="md5",
+            latency=0.0, seed=None):
+        if root is None:
+            root = os.environ.get("TMPDIR", os.path.expanduser("~"))+"/simzone"
+        self.root = root
+        self.resources = resources or {}
+        self.zone = zone
+        self.home = "/"+zone+"/home/"+user
+        self.trash = "/"+zone+"/trash/home/"+user
+        self.scheme = checksum
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.throttles = {}
+
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS collections (path TEXT PRIMARY KEY)")
+            conn.execute("CREATE TABLE IF NOT EXISTS replicas (path TEXT, replica INTEGER, resource TEXT, "
+                "size INTEGER, checksum TEXT, good INTEGER, physical TEXT, PRIMARY KEY (path, replica))")
+            for path in ["/"+zone, "/"+zone+"/home", self.home, "/"+zone+"/trash", "/"+zone+"/trash/home",
+                    self.trash]:
+                conn.execute("INSERT OR IGNORE INTO collections VALUES (?)", (path,))
+
+    def _connect(self):
+        # One connection per operation, sqlite connections must not be shared between threads
+        return sqlite3.connect(self.root+"/catalog.sqlite", timeout=600)
+
+    def _path(self, path):
+        if not path.startswith("/"):
+            path = self.home+"/"+path
+        return posixpath.normpath(path)
+
+    def _settings(self, iresource):
+        settings = {"bandwidth": None, "latency": self.latency, "failure": 0.0, "corruption": 0.0, 
+            "replicas": []}
+        settings.update(self.resources.get(iresource, {}))
+        return settings
+
+    def _throttle(self, iresource):
+        with self.lock:
+            if iresource not in self.throttles:
+                self.throttles[iresource] = _Throttle(self._settings(iresource)["bandwidth"])
+            return self.throttles[iresource]
+
+    def _chance(self, probability):
+        with self.lock:
+            return self.random.random() < probability
+
+    def _operation(self, iresource):
+        """
+        Simulates the costs and failures of one operation on a resource.
+        """
+        settings = self._settings(iresource)
+        time.sleep(settings["latency"])
+        if self._chance(settings["failure"]):
+            raise SimulatedFailure("SYS_SOCK_READ_ERR, simulated failure on resource "+iresource)
+
+    def _isCollection(self, conn, path):
+        return conn.execute("SELECT 1 FROM collections WHERE path = ?", (path,)).fetchone() is not None
+
+    def _isDataObject(self, conn, path):
+        return conn.execute("SELECT 1 FROM replicas WHERE path = ?", (path,)).fetchone() is not None
+
+    def _below(self, table, path, columns):
+        # substr instead of LIKE, paths contain the LIKE wildcard _
+        return "SELECT %s FROM %s WHERE path = ? OR substr(path, 1, ?) = ?" %(columns, table), \
+            (path, len(path) + 1, path+"/")
+
+    def _copy(self, iresource, source, destination, corrupt=False):
+        """
+        Copies a file with the bandwidth of the resource, returns (size, checksum of the source).
+        """
+        throttle = self._throttle(iresource)
+        h = newHash(self.scheme)
+        size = 0
+        if not os.path.isdir(os.path.dirname(destination)):
+            os.makedirs(os.path.dirname(destination))
+        with open(source, "rb") as src:
+            with open(destination, "wb") as dst:
+                for chunk in iter(lambda: src.read(CHUNKSIZE), b""):
+                    throttle.consume(len(chunk))
+                    h.update(chunk)
+                    dst.write(chunk)
+                    size = size + len(chunk)
+                if corrupt:
+                    dst.seek(size // 2)
+                    dst.write(b"\0" if size > 0 else b"")
+        return size, formatChecksum(h, self.scheme)
+
+    def _putFile(self, iresource, source, destination, checksum=True):
+        self._operation(iresource)
+        settings = self._settings(iresource)
+        with self._connect() as conn:
+            if not self._isCollection(conn, posixpath.dirname(destination)):
+                raise SimulatedFailure("CAT_UNKNOWN_COLLECTION "+posixpath.dirname(destination))
+            if self._isCollection(conn, destination):
+                raise SimulatedFailure("CAT_NAME_EXISTS_AS_COLLECTION "+destination)
+        replicas = []
+        for k, resc in enumerate([iresource] + settings["replicas"]):
+            physical = self.root+"/"+resc+destination
+            size, digest = self._copy(resc, source, physical, self._chance(self._settings(resc)["corruption"]))
+            # without iput -K the catalog has no checksum
+            replicas.append((destination, k, resc, size, digest if checksum else "", 1, physical))
+        with self._connect() as conn:
+            # iput -f overwrites the data object
+            conn.execute("DELETE FROM replicas WHERE path = ?", (destination,))
+            conn.executemany("INSERT INTO replicas VALUES (?, ?, ?, ?, ?, ?, ?)", replicas)
+
+    def _put(self, iresource, source, destination, checksum=True):
+        with self._connect() as conn:
+            if self._isCollection(conn, destination):
+                destination = destination+"/"+os.path.basename(source.rstrip("/"))
+        if os.path.isfile(source):
+            return self._putFile(iresource, source, destination, checksum)
+        if not os.path.isdir(source):
+            raise SimulatedFailure("USER_INPUT_PATH_ERR "+source)
+        # iput -r: the folder becomes the destination collection
+        for root, _, files in os.walk(source):
+            coll = destination+("/"+os.path.relpath(root, source) if root != source else "")
+            self._mkdir(coll, parents=True)
+            for f in sorted(files):
+                self._putFile(iresource, os.path.join(root, f), coll+"/"+f, checksum)
+
+    def _replica(self, iresource, source):
+        """
+        Returns (resource, checksum, physical file) of the replica an iget reads.
+        """
+        with self._connect() as conn:
+            replicas = conn.execute("SELECT resource, checksum, physical FROM replicas WHERE path = ? "
+                "ORDER BY resource != ?, good DESC, replica", (source, iresource)).fetchall()
+        if len(replicas) == 0:
+            raise SimulatedFailure("CAT_NO_ROWS_FOUND "+source)
+        return replicas[0]
+
+    def _getFile(self, iresource, source, destination, checksum=True):
+        self._operation(iresource)
+        resc, stored, physical = self._replica(iresource, source)
+        _, actual = self._copy(resc, physical, destination)
+        # iget -K verifies the checksum of the received data
+        if checksum and stored and actual != stored:
+            raise SimulatedFailure("USER_CHKSUM_MISMATCH "+source)
+
+    def _stream(self, iresource, source, sink):
+        self._operation(iresource)
+        resc, _, physical = self._replica(iresource, source)
+        throttle = self._throttle(resc)
+        with open(physical, "rb") as src:
+            for chunk in iter(lambda: src.read(CHUNKSIZE), b""):
+                throttle.consume(len(chunk))
+                sink.update(chunk)
+
+    def _get(self, iresource, source, destination, checksum=True):
+        if os.path.isdir(destination):
+            destination = os.path.join(destination, posixpath.basename(source))
+        with self._connect() as conn:
+            if self._isDataObject(conn, source):
+                return self._getFile(iresource, source, destination, checksum)
+            if not self._isCollection(conn, source):
+                raise SimulatedFailure("USER_INPUT_PATH_ERR "+source)
+            query, args = self._below("replicas", source, "DISTINCT path")
+            objects = [row[0] for row in conn.execute(query, args).fetchall()]
+        # iget -r: the collection becomes the destination folder
+        if not os.path.isdir(destination):
+            os.makedirs(destination)
+        for path in sorted(objects):
+            self._getFile(iresource, path, os.path.join(destination, path[len(source)+1:]), checksum)
+
+    def _mkdir(self, collection, parents=False):
+        with self._connect() as conn:
+            exists = self._isCollection(conn, collection)
+            parentExists = self._isCollection(conn, posixpath.dirname(collection))
+        if exists and parents:
+            return
+        if exists:
+            raise SimulatedFailure("CATALOG_ALREADY_HAS_ITEM_BY_THAT_NAME "+collection)
+        if not parentExists and not parents:
+            raise SimulatedFailure("CAT_UNKNOWN_COLLECTION "+posixpath.dirname(collection))
+        if not parentExists:
+            self._mkdir(posixpath.dirname(collection), parents=True)
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO collections VALUES (?)", (collection,))
+
+    def _move(self, conn, source, destination):
+        """
+        Renames a collection or data object and everything below it in the catalog.
+        """
+        for table in ["collections", "replicas"]:
+            query, args = self._below(table, source, "DISTINCT path")
+            for (path,) in conn.execute(query, args).fetchall():
+                conn.execute("UPDATE %s SET path = ? WHERE path = ?" %table, (destination+path[len(source):], path))
+
+    def _delete(self, conn, path):
+        """
+        Deletes a collection or data object including the physical files.
+        """
+        query, args = self._below("replicas", path, "physical")
+        for (physical,) in conn.execute(query, args).fetchall():
+            if os.path.isfile(physical):
+                os.remove(physical)
+        for table in ["collections", "replicas"]:
+            query, args = self._below(table, path, "path")
+            conn.execute(query.replace("SELECT path", "DELETE"), args)
+
+    def _remove(self, path, force=False):
+        time.sleep(self.latency)
+        with self._connect() as conn:
+            if not self._isCollection(conn, path) and not self._isDataObject(conn, path):
+                raise SimulatedFailure("USER_INPUT_PATH_ERR "+path)
+            if force:
+                self._delete(conn, path)
+                return
+            # irm moves data to the trash, keeping the path below the home collection
+            target = self.trash+path[len(self.home):] if path.startswith(self.home+"/") else \
+                self.trash+"/"+posixpath.basename(path)
+            self._delete(conn, target)
+            self._move(conn, path, target)
+            parent = posixpath.dirname(target)
+            while parent != self.trash and parent.startswith(self.trash):
+                conn.execute("INSERT OR IGNORE INTO collections VALUES (?)", (parent,))
+                parent = posixpath.dirname(parent)
+
+    def _emptyTrash(self):
+        time.sleep(self.latency)
+        with self._connect() as conn:
+            for (path,) in conn.execute("SELECT path FROM collections WHERE substr(path, 1, ?) = ?",
+                    (len(self.trash) + 1, self.trash+"/")).fetchall():
+                self._delete(conn, path)
+            for (path,) in conn.execute("SELECT DISTINCT path FROM replicas WHERE substr(path, 1, ?) = ?",
+                    (len(self.trash) + 1, self.trash+"/")).fetchall():
+                self._delete(conn, path)
+
+    def _replicate(self, path, iresource):
+        self._operation(iresource)
+        with self._connect() as conn:
+            rows = conn.execute("SELECT replica, resource, size, checksum, physical FROM replicas "
+                "WHERE path = ? ORDER BY replica", (path,)).fetchall()
+        if len(rows) == 0:
+            raise SimulatedFailure("CAT_NO_ROWS_FOUND "+path)
+        if iresource in [row[1] for row in rows]:
+            return
+        physical = self.root+"/"+iresource+path
+        self._copy(iresource, rows[0][4], physical, self._chance(self._settings(iresource)["corruption"]))
+        with self._connect() as conn:
+            conn.execute("INSERT INTO replicas VALUES (?, ?, ?, ?, ?, ?, ?)", 
+                (path, rows[-1][0] + 1, iresource, rows[0][2], rows[0][3], 1, physical))
+
+    def _checksum(self, path):
+        """
+        Computes the missing checksums of the replicas below path from their physical files.
+        """
+        time.sleep(self.latency)
+        with self._connect() as conn:
+            if not self._isCollection(conn, path) and not self._isDataObject(conn, path):
+                raise SimulatedFailure("USER_INPUT_PATH_ERR "+path)
+            query, args = self._below("replicas", path, "path, replica, physical, checksum")
+            rows = [row[:3] for row in conn.execute(query, args).fetchall() if not row[3]]
+        for objPath, replica, physical in rows:
+            h = newHash(self.scheme)
+            with open(physical, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNKSIZE), b""):
+                    h.update(chunk)
+            with self._connect() as conn:
+                conn.execute("UPDATE replicas SET checksum = ? WHERE path = ? AND replica = ?",
+                    (formatChecksum(h, self.scheme), objPath, replica))
+
+    def _mkdirOperation(self, collection):
+        time.sleep(self.latency)
+        self._mkdir(collection)
+
+    def mkdir(self, collection):
+        return timedCall(["imkdir", collection], self._mkdirOperation, self._path(collection))
+
+    def put(self, iresource, source, destination, threads=None, bulk=True, checksum=True, monitors=()):
+        return timedCall(["iput", "-R", iresource, source, destination], self._put, iresource, source, 
+            self._path(destination), checksum, monitors=monitors)
+
+    def get(self, iresource, source, destination, threads=None, bulk=True, checksum=True, monitors=()):
+        return timedCall(["iget", "-R", iresource, source, destination], self._get, iresource, 
+            self._path(source), destination, checksum, monitors=monitors)
+
+    def stream(self, iresource, source, sink, monitors=()):
+        return timedCall(["iget", "-R", iresource, source, "-"], self._stream, iresource, self._path(source), sink,
+            monitors=monitors)
+
+    def checksum(self, path):
+        return timedCall(["ichksum", "-r", path], self._checksum, self._path(path))
+
+    def replicate(self, path, iresource):
+        """
+        Like irepl -R iresource path.
+        """
+        return timedCall(["irepl", "-R", iresource, path], self._replicate, self._path(path), iresource)
+
+    def snapshot(self, path):
+        time.sleep(self.latency)
+        root = self._path(path)
+        index = CatalogIndex(path, root)
+        with self._connect() as conn:
+            query, args = self._below("collections", root, "path")
+            index.collections.update([row[0] for row in conn.execute(query, args).fetchall()])
+            query, args = self._below("replicas", root, "path, replica, resource, size, checksum, good, physical")
+            for row in conn.execute(query, args).fetchall():
+                index.collections.add(posixpath.dirname(row[0]))
+                index.add(Replica(row[0], row[1], row[2], row[3], row[4], row[5] == 1, row[6]))
+        return index
+
+    def remove(self, path, force=False):
+        return timedCall(["irm", "-rf" if force else "-r", path], self._remove, self._path(path), force)
+
+    def emptyTrash(self):
+        return timedCall(["irmtrash"], self._emptyTrash)
+
+BACKENDS = {"icommands": IcommandsBackend, "prc": PRCBackend, "sim": SimulatedBackend}
+
+def createBackend(name, **options):
+    """
+    Creates a backend by name, see BACKENDS.
+    options:    keyword arguments of the backend class
+    """
+    if name not in BACKENDS:
+        raise ValueError("Unknown backend: %s, choose from %s" %(name, ", ".join(sorted(BACKENDS))))
+    return BACKENDS[name](**options)
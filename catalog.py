@@ -0,0 +1,200 @@
+"""
+Snapshots of the iRODS catalog. One query (ils -rL or iquest) lists size, checksum, replica number
+and resource of all data objects below a collection. The result is kept in an in-memory index
+that verification code can look up by path, instead of starting one ils per data object.
+"""
+
+import re
+from collections import namedtuple
+
+import icommands
+
+Replica = namedtuple("Replica", ["path", "replica", "resource", "size", "checksum", "good", "physical"])
+
+# First line of a replica in ils -L:
+#   <owner> <replica> <resource hierarchy> <size> <yyyy-mm-dd.hh:mm> <status> <name>
+# the status is '&' for a good replica and ' ' for a stale one, the name may contain spaces.
+ILS_REPLICA = re.compile(r"^  (\S+)\s+(\d+)\s+(\S+)\s+(\d+)\s+(\d{4}-\d\d-\d\d\.\d\d:\d\d) (.) (.*)$")
+# Second line: 4 spaces, checksum, data type and physical path separated by 4 spaces,
+# checksum and data type may be empty.
+ILS_DETAILS = re.compile(r"^    (\S*)    (\S*)    (.*)$")
+
+# Separator of the iquest columns, must not occur in collection or data object names
+IQUEST_SEP = "\x1f"
+IQUEST_COLUMNS = ["COLL_NAME", "DATA_NAME", "DATA_REPL_NUM", "DATA_SIZE", "DATA_CHECKSUM",
+    "DATA_RESC_HIER", "DATA_REPL_STATUS", "DATA_PATH"]
+
+class CatalogIndex(object):
+    """
+    In-memory index of the replicas of data objects.
+    Paths are stored as printed by iRODS. Relative paths are resolved with the
+    collection the snapshot was taken of.
+    """
+
+    def __init__(self, query=None, root=None):
+        self.query = query      # collection or data object as passed to the query
+        self.root = root        # absolute path of query, if known
+        self.objects = {}       # path --> [Replica]
+        self.collections = set()
+        self.error = None       # stderr of a failed query, the index is incomplete then
+
+    def add(self, replica):
+        self.objects.setdefault(replica.path, []).append(replica)
+
+    def _resolve(self, path):
+        path = path.rstrip("/")
+        if path in self.objects or path.startswith("/") or self.root is None:
+            return path
+        if path == self.query:
+            return self.root
+        if path.startswith(self.query+"/"):
+            return self.root+path[len(self.query):]
+        return path
+
+    def __contains__(self, path):
+        return self._resolve(path) in self.objects
+
+    def __len__(self):
+        return len(self.objects)
+
+    def paths(self):
+        """
+        Returns the paths of all data objects.
+        """
+        return sorted(self.objects.keys())
+
+    def replicas(self, path):
+        """
+        Returns the list of replicas of a data object, an empty list if the object is unknown.
+        """
+        return self.objects.get(self._resolve(path), [])
+
+    def _best(self, path):
+        # Prefer good replicas with checksum
+        replicas = sorted(self.replicas(path), key=lambda r: (not r.good, r.checksum == "", r.replica))
+        if len(replicas) == 0:
+            return None
+        return replicas[0]
+
+    def size(self, path):
+        replica = self._best(path)
+        if replica is None:
+            return None
+        return replica.size
+
+    def checksum(self, path):
+        """
+        Returns the checksum of a data object or None if unknown or not computed.
+        """
+        replica = self._best(path)
+        if replica is None or replica.checksum == "":
+            return None
+        return replica.checksum
+
+    def relativePaths(self, collection):
+        """
+        Returns {path relative to collection: absolute path} for all data objects below collection.
+        """
+        collection = self._resolve(collection)
+        return dict([(path[len(collection)+1:], path) for path in self.objects
+            if path.startswith(collection+"/")])
+
+    def totalSize(self):
+        """
+        Returns the number of bytes of all replicas.
+        """
+        return sum([r.size for replicas in self.objects.values() for r in replicas])
+
+def parseIlsLong(out, query=None):
+    """
+    Parses the output of ils -L or ils -rL.
+    out:    stdout of ils
+    query:  path ils was called with. Data objects listed without collection header
+            (ils -L <data object>) are stored relative to its parent collection.
+
+    Returns a CatalogIndex
+    """
+    index = CatalogIndex(query)
+    collection = None
+    if query is not None and "/" in query.rstrip("/"):
+        collection = query.rstrip("/").rsplit("/", 1)[0]
+    elif query is not None:
+        collection = "."
+
+    pending = None
+    for line in out.split("\n"):
+        if line.startswith("/") and line.endswith(":"):
+            collection = line[:-1]
+            index.collections.add(collection)
+            if index.root is None:
+                index.root = collection
+            continue
+        if line.startswith("  C- "):
+            index.collections.add(line[5:])
+            continue
+        m = ILS_REPLICA.match(line)
+        if m is not None:
+            owner, replica, resource, size, date, status, name = m.groups()
+            if collection == ".":
+                path = name
+            else:
+                path = collection+"/"+name
+            pending = Replica(path, int(replica), resource, int(size), "", status == "&", "")
+            index.add(pending)
+            continue
+        m = ILS_DETAILS.match(line)
+        if m is not None and pending is not None:
+            replicas = index.objects[pending.path]
+            replicas[-1] = pending._replace(checksum=m.group(1), physical=m.group(3))
+            pending = None
+
+    return index
+
+def parseIquest(out, query=None, root=None):
+    """
+    Parses the output of iquest with the format IQUEST_SEP.join(["%s"]*len(IQUEST_COLUMNS)).
+
+    Returns a CatalogIndex
+    """
+    index = CatalogIndex(query, root)
+    for line in out.split("\n"):
+        fields = line.split(IQUEST_SEP)
+        if len(fields) != len(IQUEST_COLUMNS):
+            continue
+        coll, name, replica, size, checksum, resource, status, physical = fields
+        index.collections.add(coll)
+        index.add(Replica(coll+"/"+name, int(replica), resource, int(size), checksum,
+            status == "1", physical))
+    return index
+
+def _absoluteCollection(collection, timeout=None):
+    if collection.startswith("/"):
+        return collection.rstrip("/")
+    return (icommands.run(["ipwd"], timeout=timeout).out.strip()+"/"+collection).rstrip("/")
+
+def snapshotCatalog(path, method="ils", timeout=None):
+    """
+    Lists all replicas below a collection, or of a single data object, with a single query.
+    path:   iRODS collection or data object, absolut or relative
+    method: "ils"       ils -rL <path>
+            "iquest"    general query on the catalog, only for collections, returns
+                        full resource hierarchies which ils truncates to 20 characters
+    timeout:    seconds after which the query is killed, the index is empty then
+
+    Returns a CatalogIndex, its error is set if the query failed
+    """
+    if method == "ils":
+        res = icommands.run(["ils", "-rL", path], timeout=timeout)
+        index = parseIlsLong(res.out, path)
+    elif method == "iquest":
+        root = _absoluteCollection(path, timeout)
+        condition = "COLL_NAME = '%s' || like '%s/%%'" %(root, root)
+        res = icommands.run(["iquest", "--no-page", IQUEST_SEP.join(["%s"] * len(IQUEST_COLUMNS)),
+            "select "+", ".join(IQUEST_COLUMNS)+" where "+condition], timeout=timeout)
+        index = parseIquest(res.out, path, root)
+    else:
+        raise ValueError("Unknown method: "+str(method))
+    # iquest fails if nothing matches
+    if res.returncode != 0 and "CAT_NO_ROWS_FOUND" not in res.out+res.err:
+        index.error = res.err or "%s exited with %d" %(res.argv[0], res.returncode)
+    return index
@@ -0,0 +1,226 @@
+"""
+Checksums of local files in the formats iRODS stores in the catalog:
+    md5:    hex digest, e.g. 9e107d9d372bb6826bd81d3542a419d6
+    sha2:   "sha2:" + base64 encoded SHA-256 digest (server setting default_hash_scheme SHA256)
+
+Files are hashed in chunks, so memory use does not depend on the file size. Many files
+are hashed in parallel on a process pool and results are cached on disc by
+(path, size, mtime, algorithm), so an unchanged file is never hashed twice.
+"""
+
+import os
+import json
+import time
+import atexit
+import base64
+import hashlib
+import socket
+import threading
+import multiprocessing
+
+CHUNKSIZE = 1024 * 1024 * 4
+# The home directory is often shared between nodes while $TMPDIR paths are not unique,
+# hence one cache per host.
+CACHEFILE = os.path.expanduser("~")+"/.irods/checksums_"+socket.gethostname()+".json"
+# Seconds the cache may go unsaved after localChecksum, every save rewrites the whole cache
+SAVE_INTERVAL = 60
+
+def checksumAlgorithm(irodsChecksum):
+    """
+    Returns the algorithm ("md5" or "sha2") of a checksum as printed by ils -L.
+    """
+    if irodsChecksum.startswith("sha2:"):
+        return "sha2"
+    return "md5"
+
+def newHash(algorithm):
+    """
+    Returns a hashlib object for "md5" or "sha2", to checksum a stream chunk by chunk.
+    """
+    if algorithm == "md5":
+        return hashlib.md5()
+    elif algorithm == "sha2":
+        return hashlib.sha256()
+    raise ValueError("Unknown checksum algorithm: "+str(algorithm))
+
+def formatChecksum(h, algorithm):
+    """
+    Formats the digest of a hashlib object like iRODS.
+    """
+    if algorithm == "sha2":
+        return "sha2:"+base64.b64encode(h.digest())
+    return h.hexdigest()
+
+class StreamChecksum(object):
+    """
+    Null sink of a download: hashes and counts the received bytes and keeps nothing.
+    algorithm:  "md5" or "sha2"
+    """
+
+    def __init__(self, algorithm="md5"):
+        self.algorithm = algorithm
+        self.hash = newHash(algorithm)
+        self.bytes = 0
+
+    def update(self, chunk):
+        self.hash.update(chunk)
+        self.bytes = self.bytes + len(chunk)
+
+    def checksum(self):
+        return formatChecksum(self.hash, self.algorithm)
+
+def fileChecksum(path, algorithm="md5", chunksize=CHUNKSIZE):
+    """
+    Computes the checksum of a local file in the iRODS format.
+    path:       local file
+    algorithm:  "md5" or "sha2"
+    chunksize:  bytes read at once
+    """
+    h = newHash(algorithm)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunksize), b""):
+            h.update(chunk)
+    return formatChecksum(h, algorithm)
+
+def _checksumTask(task):
+    """
+    Worker of checksumFiles.
+    task:   tuple (path, algorithm, chunksize)
+    """
+    path, algorithm, chunksize = task
+    return fileChecksum(path, algorithm, chunksize)
+
+class ChecksumCache(object):
+    """
+    Persistent cache of local checksums. An entry is only valid as long as size and
+    modification time of the file did not change.
+    path:   json file, default CACHEFILE
+    """
+
+    def __init__(self, path=CACHEFILE):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.changed = False
+        self.saved = time.time()
+        if os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                # Broken cache file, e.g. after a killed job. Start over.
+                self.entries = {}
+
+    def _key(self, path, algorithm):
+        return algorithm+":"+os.path.abspath(path)
+
+    def get(self, path, algorithm, stat=None):
+        """
+        Returns the cached checksum or None.
+        """
+        if stat is None:
+            stat = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(self._key(path, algorithm))
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+            return entry[2]
+        return None
+
+    def put(self, path, algorithm, checksum, stat=None):
+        """
+        Stores a checksum. stat should be taken before hashing the file.
+        """
+        if stat is None:
+            stat = os.stat(path)
+        with self.lock:
+            self.entries[self._key(path, algorithm)] = [stat.st_size, stat.st_mtime, checksum]
+            self.changed = True
+
+    def save(self, interval=0):
+        """
+        Writes the cache to disc if it changed, drops entries of deleted files.
+        interval:   seconds since the last write during which the write is postponed
+        """
+        with self.lock:
+            if not self.changed or time.time() - self.saved < interval:
+                return
+            self.entries = dict([(key, entry) for key, entry in self.entries.items()
+                if os.path.exists(key.split(":", 1)[1])])
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            # one temporary file per process, several test processes on a node share the cache
+            tmp = "%s.%d.tmp" %(self.path, os.getpid())
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f)
+            os.rename(tmp, self.path)
+            self.changed = False
+            self.saved = time.time()
+
+_cache = None
+
+def defaultCache():
+    """
+    Returns the cache shared by all functions in this module, postponed changes are saved
+    when the process exits.
+    """
+    global _cache
+    if _cache is None:
+        _cache = ChecksumCache()
+        atexit.register(_cache.save)
+    return _cache
+
+def checksumFiles(paths, algorithm="md5", processes=None, cache=None, chunksize=CHUNKSIZE, interval=0):
+    """
+    Computes checksums of many local files, files missing in the cache are hashed
+    in parallel by a pool of <processes> worker processes (default: number of cores).
+    paths:      list of local files
+    algorithm:  "md5" or "sha2"
+    cache:      ChecksumCache, default defaultCache()
+    interval:   seconds the cache may go unsaved, see ChecksumCache.save
+
+    Returns a dictionary {path: checksum}
+    """
+    if cache is None:
+        cache = defaultCache()
+
+    result = {}
+    missing = []
+    for path in paths:
+        stat = os.stat(path)
+        checksum = cache.get(path, algorithm, stat)
+        if checksum is None:
+            missing.append((path, stat))
+        else:
+            result[path] = checksum
+
+    if len(missing) == 0:
+        return result
+
+    tasks = [(path, algorithm, chunksize) for path, _ in missing]
+    if len(missing) == 1 or processes == 1:
+        checksums = [_checksumTask(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(missing)))
+        try:
+            checksums = pool.map(_checksumTask, tasks)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    for (path, stat), checksum in zip(missing, checksums):
+        cache.put(path, algorithm, checksum, stat)
+        result[path] = checksum
+    cache.save(interval)
+
+    return result
+
+def localChecksum(path, algorithm="md5", cache=None):
+    """
+    Checksum of a single local file, taken from the cache if the file did not change.
+    The cache is saved at most every SAVE_INTERVAL seconds, the small file tests check
+    thousands of files one by one.
+    """
+    return checksumFiles([path], algorithm, processes=1, cache=cache, interval=SAVE_INTERVAL)[path]
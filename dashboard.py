@@ -0,0 +1,135 @@
+"""
+Writes all plots and statistics of the results into one self-contained html file: a section per
+resource with the throughput per client and operation (median with the 95% confidence interval as
+error bars) and the summary table, and sections for the concurrent, small file and profiled runs.
+The figures are drawn by a pool of processes and embedded as png, one by one as they are drawn.
+
+    python dashboard.py [--warmup <n>] [--processes <n>] [--out dashboard.html] <result file> ...
+    python dashboard.py --db <sqlite file> [--since <date>] [--until <date>] [...]
+"""
+
+import sys
+import base64
+import getopt
+from xml.sax.saxutils import escape
+from analysis import summarize, GROUP_COLUMNS
+from plotting import readData, readStore, renderFigures, throughputFigures, concurrencyFigures, \
+    smallFilesFigures, bottleneckFigures
+
+STYLE = """
+body { font-family: sans-serif; margin: 2em; }
+img { width: 32em; margin: 0.5em; }
+table { border-collapse: collapse; font-size: small; margin: 1em 0; }
+th, td { border: 1px solid #ccc; padding: 0.2em 0.5em; text-align: right; }
+"""
+
+def sections(dataFrame, warmup=0):
+    """
+    Returns the sections of the dashboard: list of (title, figures, table).
+    dataFrame:  results, see plotting.readData
+    warmup:     number of first iterations of every run that are left out, see analysis.summarize
+    """
+    dataFrame = dataFrame.copy()
+    dataFrame['real time Gbit/s'] = dataFrame['size GB']*8/dataFrame['real time']
+    single = dataFrame
+    if 'stream' in dataFrame.columns:
+        single = dataFrame[dataFrame['stream'].isnull()]
+
+    result = []
+    summary = summarize(single, 'real time Gbit/s', warmup=warmup)
+    for resc, group in summary.groupby('iresource'):
+        table = group.copy()
+        table['size'] = table['size'].str.replace('\n', ' ')
+        result.append((resc, throughputFigures(group, paths=False), table))
+    if 'stream' in dataFrame.columns and 'concurrency' in dataFrame.columns:
+        figures = concurrencyFigures(dataFrame, paths=False)
+        if len(figures) > 0:
+            result.append(('concurrent transfers', figures, None))
+    if 'stream' in dataFrame.columns and 'files' in dataFrame.columns:
+        figures = smallFilesFigures(dataFrame, paths=False)
+        if len(figures) > 0:
+            result.append(('small files', figures, None))
+    if 'bottleneck' in single.columns and single['bottleneck'].notnull().any():
+        table = summarize(single[single['bottleneck'].notnull()], 'real time Gbit/s',
+            GROUP_COLUMNS + ['bottleneck'], warmup=warmup)
+        table['size'] = table['size'].str.replace('\n', ' ')
+        result.append(('bottlenecks', bottleneckFigures(single, paths=False), table))
+    return result
+
+def dashboard(dataFrame, path='dashboard.html', warmup=0, processes=None, title='iRODS performance'):
+    """
+    Writes the dashboard of a data frame of results.
+    path:       html file
+    warmup:     number of first iterations of every run that are left out
+    processes:  number of processes drawing the figures, see plotting.renderFigures
+    """
+    parts = sections(dataFrame, warmup)
+    figures = [spec for _, specs, _ in parts for spec in specs]
+    pngs = renderFigures(figures, processes)
+    try:
+        _write(path, title, parts, pngs)
+    finally:
+        # stops the workers if writing failed
+        pngs.close()
+    print("Dashboard of %d results with %d figures: %s" %(len(dataFrame), len(figures), path))
+
+def _write(path, title, parts, pngs):
+    with open(path, 'w') as f:
+        f.write('<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>%s</title>\n<style>%s</style>\n'
+            '</head>\n<body>\n<h1>%s</h1>\n<ul>\n' %(escape(title), STYLE, escape(title)))
+        for k, (name, _, _) in enumerate(parts):
+            f.write('<li><a href="#section%d">%s</a></li>\n' %(k, escape(name)))
+        f.write('</ul>\n')
+        for k, (name, specs, table) in enumerate(parts):
+            f.write('<h2 id="section%d">%s</h2>\n' %(k, escape(name)))
+            for spec in specs:
+                png = next(pngs)
+                f.write('<img alt="%s" src="data:image/png;base64,%s">\n' %(escape(spec['title'], {'"': '&quot;'}),
+                    base64.b64encode(png).decode('ascii')))
+            if table is not None:
+                f.write(table.to_html(index=False, float_format=lambda x: '%.4g' %x))
+                f.write('\n')
+        f.write('</body>\n</html>\n')
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "db=", "since=", "until=", "warmup=",
+            "processes=", "out="])
+    except getopt.error as msg:
+        print(msg)
+        print("for help use --help")
+        sys.exit(2)
+
+    database = None
+    since = until = None
+    warmup = 0
+    processes = None
+    out = 'dashboard.html'
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print(__doc__)
+            sys.exit(0)
+        elif o == "--db":
+            database = a
+        elif o == "--since":
+            since = a
+        elif o == "--until":
+            until = a
+        elif o == "--warmup":
+            warmup = int(a)
+        elif o == "--processes":
+            processes = int(a)
+        elif o == "--out":
+            out = a
+    if database is None and len(args) == 0:
+        print(__doc__)
+        sys.exit(2)
+
+    if database is None:
+        dataFrame = readData(args)
+    else:
+        dataFrame = readStore(database, since=since, until=until)
+    dashboard(dataFrame, out, warmup, processes)
+
+if __name__ == "__main__":
+    main()
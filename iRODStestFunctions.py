@@ -7,13 +7,30 @@ Python functions to test the connectivity and performance of the iRODS icommands
 """
 
 import os
+import re
 import json
-import subprocess
 import time
 from timeit import default_timer as timer
 import hashlib
+import random
+import binascii
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import threading
+import Queue
 from tqdm import tqdm
 import shutil
+import ctypes
+import resource
+import itertools
+from checksums import localChecksum, checksumFiles, checksumAlgorithm, StreamChecksum
+import icommands
+from icommands import monotonic
+from backends import IcommandsBackend
+from results import RESULT_HEADER
+from scheduler import AdaptiveScheduler
+from sampler import ThroughputSampler, SampleLog
+from profiling import ClientProfiler
 
 
 RED     = "\033[31m"
@@ -21,17 +38,304 @@ GREEN   = "\033[92m"
 BLUE    = "\033[34m"
 DEFAULT = "\033[0m"
 
-def createTestData():
+# Backend of all iRODS operations, see backends.py
+BACKEND = IcommandsBackend()
+
+# Time series of the transfers, see setSampling
+SAMPLES         = None
+SAMPLE_INTERVAL = 0.1
+# Interval of the client profiles of the transfers, None for no profiles, see setMonitoring
+PROFILE_INTERVAL = None
+LINK_SPEED      = None
+_transferred    = threading.local()
+
+def setBackend(backend):
+    """
+    Selects the backend of iRODScreateColl, iRODSput, iRODSget, checkIntegrity, verifyCollection and cleanUp.
+    backend:    instance of backends.Backend, e.g. backends.createBackend("prc", threads=4)
+    """
+    global BACKEND
+    BACKEND = backend
+
+def setSampling(path, interval=0.1):
+    """
+    Samples the progress of every iRODSput and iRODSget, see sampler.py.
+    path:       json lines file the time series are appended to, None switches the sampling off
+    interval:   seconds between two samples
+    """
+    global SAMPLES, SAMPLE_INTERVAL
+    SAMPLES = None if path is None else SampleLog(path)
+    SAMPLE_INTERVAL = interval
+
+def setMonitoring(interval=0.5, speed=None):
+    """
+    Profiles the client during every iRODSput and iRODSget: CPU, disk and network utilisation 
+    and the bottleneck of the transfer, see profiling.py.
+    interval:   seconds between two samples of the counters, None switches the profiles off
+    speed:      link speed in bytes per second, for network interfaces that do not report it
+    """
+    global PROFILE_INTERVAL, LINK_SPEED
+    PROFILE_INTERVAL = interval
+    LINK_SPEED = speed
+
+def transferColumns():
+    """
+    Returns the columns of the sampler (ramp up, steady bandwidth in bytes/s, tail time) and of the
+    client profile (cpu/disk/network utilization, disk/network bytes, bottleneck) of the last transfer
+    in the calling thread, for resultRow. Empty without sampling and profiles.
+    """
+    columns = getattr(_transferred, "columns", {})
+    _transferred.columns = {}
+    return columns
+
+def _monitoredTransfer(transfer, operation, iresource, source, destination, settings):
+    """
+    Runs BACKEND.put or BACKEND.get, sampled if setSampling is on and profiled if setMonitoring is on.
+    """
+    if SAMPLES is None and PROFILE_INTERVAL is None:
+        return transfer(iresource, source, destination, **settings)
+    monitors = []
+    if SAMPLES is not None:
+        # iget: growth of the local destination, iput and stream: bytes written by the process
+        sampler = ThroughputSampler(SAMPLE_INTERVAL, destination if operation == "iget" else None)
+        monitors.append(sampler)
+    if PROFILE_INTERVAL is not None:
+        profiler = ClientProfiler(getTestDataDir(), PROFILE_INTERVAL, speed=LINK_SPEED)
+        monitors.append(profiler)
+    date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    res = transfer(iresource, source, destination, monitors=monitors, **settings)
+
+    columns = {}
+    if SAMPLES is not None:
+        SAMPLES.write(sampler, date=date, iresource=iresource, operation=operation, source=source, 
+            destination=destination if operation != "stream" else "-", returncode=res.returncode, real=res.real)
+        summary = sampler.summary()
+        columns.update({"ramp_up": summary["ramp up"], "steady_bandwidth": summary["steady bandwidth"],
+            "tail_time": summary["tail time"]})
+    if PROFILE_INTERVAL is not None:
+        columns.update(profiler.columns(res.real, res.user, res.sys))
+    _transferred.columns = columns
+    return res
+
+def resultRow(date, iresource, operation, size, real, user, sys, **columns):
+    """
+    Creates a result row, columns not given are left empty.
+    operation:  "iput" or "iget"
+    size:       size label of the test data, e.g. 100M or 10MB
+    real, user, sys:    times of the transfer in seconds
+    columns:    further columns of RESULT_HEADER, spaces replaced by "_"
+    """
+    row = dict.fromkeys(RESULT_HEADER, "")
+    row.update({"date": date, "iresource": iresource, "client": os.uname()[1], "iget/iput": operation,
+        "size": size, "real time": real, "user time": user, "system time": sys, "backend": BACKEND.name})
+    for key, value in columns.items():
+        row[key.replace("_", " ")] = value
+    return row
+
+def _record(result, row, sink=None):
+    """
+    Appends a result row to the results of a test and writes it to the sink at once.
+    sink:   results.ResultSink or None
+    """
+    result.append(row)
+    if sink is not None:
+        sink.append(row)
+
+def _done(checkpoint, *step):
+    """
+    True if the step is recorded in the checkpoint (results.Checkpoint or None).
+    """
+    return checkpoint is not None and checkpoint.done(*step)
+
+def _mark(checkpoint, *step):
+    if checkpoint is not None:
+        checkpoint.mark(*step)
+
+# Size matrix of the default test data set:
+#   files:      one file per size label, stored as sample<size>.txt_0
+#   folders:    <count> files of <size>, stored as Coll<size>_0/sample<size>_<i>.txt,
+#               spread over <subfolders> sub folders (0 means all files in the top folder)
+TESTDATA_MATRIX = {
+    "files":    ["100M", "1G", "2G", "5G"],
+    "folders":  [{"size": "10MB", "count": 100, "subfolders": 0}],
+}
+
+CHUNKSIZE   = 1024 * 1024 * 4    # bytes written or read per chunk
+RANGESIZE   = 16                 # chunks per work package of the process pool
+
+def dataSize(path):
+    """
+    Returns the number of bytes of a local file or of all files below a local folder.
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum([os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files])
+
+try:
+    from os import posix_fadvise, POSIX_FADV_DONTNEED
+except ImportError:
+    # python 2
+    POSIX_FADV_DONTNEED = 4
+    _libc = ctypes.CDLL("libc.so.6", use_errno=True)
+    _libc.posix_fadvise.argtypes = [ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_int]
+
+    def posix_fadvise(fd, offset, length, advice):
+        error = _libc.posix_fadvise(fd, offset, length, advice)
+        if error != 0:
+            raise OSError(error, os.strerror(error))
+
+def dropCache(path):
+    """
+    Removes a file from the page cache, the next read comes from the disk. The file must be synced.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        posix_fadvise(fd, 0, 0, POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def warmCache(path):
+    """
+    Reads a file or all files below a folder once, so they are in the page cache.
+    """
+    paths = [path] if os.path.isfile(path) else [os.path.join(root, f) for root, _, files in os.walk(path) 
+        for f in files]
+    for p in paths:
+        with open(p, "rb") as f:
+            while f.read(CHUNKSIZE):
+                pass
+
+STAGING = "/dev/shm"    # memory backed staging folder of performanceNetwork
+
+def stageData(data, staging=STAGING):
+    """
+    Copies test data to a memory backed folder if it has room for twice its size, otherwise 
+    reads it once into the page cache.
+    Returns (path to transfer, "shm" or "page cache")
+    """
+    nbytes = dataSize(data)
+    if staging is not None and os.path.isdir(staging):
+        stat = os.statvfs(staging)
+        if stat.f_bavail * stat.f_frsize > 2 * nbytes:
+            folder = staging+"/irodsperf-"+str(os.getpid())
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            target = folder+"/"+os.path.basename(data)
+            if os.path.isfile(data):
+                shutil.copyfile(data, target)
+            else:
+                shutil.copytree(data, target)
+            return target, "shm"
+    warmCache(data)
+    return data, "page cache"
+
+def percentile(values, q):
+    """
+    Returns the q-th percentile (0 <= q <= 100) of a list of numbers, interpolating linearly.
+    """
+    values = sorted(values)
+    if len(values) == 0:
+        return None
+    pos = (len(values) - 1) * q / 100.
+    lower = int(pos)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (pos - lower)
+
+def getTestDataDir():
+    """
+    Returns the test data folder: /home/<usr>/testdata or /<TMPDIR>/testdata ; TMPDIR is a shell variable
+    """
+    if "TMPDIR" not in os.environ:
+        return os.environ["HOME"]+"/testdata"
+    else:
+        return os.environ["TMPDIR"]+"/testdata"
+
+def parseSize(size):
+    """
+    Converts a size label like 512K, 100M, 10MB or 5G to bytes (powers of 1024).
+    """
+    m = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*$", str(size), re.IGNORECASE)
+    if m is None:
+        raise ValueError("Unknown size: "+str(size))
+    return int(float(m.group(1)) * 1024 ** " KMGT".index(m.group(2).upper() or " "))
+
+def testDataLayout(testdata, matrix=TESTDATA_MATRIX):
+    """
+    Translates a size matrix into the list of files to create.
+    testdata:   test data folder
+    matrix:     dictionary with the keys "files" and "folders", see TESTDATA_MATRIX
+
+    Returns a list of tuples: [(path, size in bytes)]
+    """
+    layout = []
+    for label in matrix.get("files", []):
+        layout.append((testdata+"/sample"+label+".txt_0", parseSize(label)))
+
+    for folder in matrix.get("folders", []):
+        size = parseSize(folder["size"])
+        subfolders = folder.get("subfolders", 0)
+        for i in range(folder["count"]):
+            path = testdata+"/Coll"+folder["size"]+"_0"
+            if subfolders > 0:
+                path = path+"/sub"+str(i % subfolders)
+            layout.append((path+"/sample"+folder["size"]+"_"+str(i)+".txt", size))
+
+    return layout
+
+def _randomBytes(seed, name, index, length):
+    """
+    Returns <length> random bytes for chunk <index> of file <name>.
+    Without seed the bytes come from os.urandom, with a seed they only depend on
+    (seed, name, index), i.e. every node and every process produces the same bytes.
+    """
+    if seed is None:
+        return os.urandom(length)
+    if length == 0:
+        return ""
+    rng = random.Random(int(hashlib.md5("%s:%s:%d" %(seed, name, index)).hexdigest(), 16))
+    return binascii.unhexlify("%0*x" %(2 * length, rng.getrandbits(8 * length)))
+
+def _writeRange(task):
+    """
+    Worker of createTestData. Fills the byte range [offset, offset+length) of an
+    already allocated file chunk by chunk, memory use is bounded by the chunk size.
+    task:   tuple (path, name, offset, length, seed, chunksize)
+
+    Returns the number of written bytes.
+    """
+    path, name, offset, length, seed, chunksize = task
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        written = 0
+        while written < length:
+            n = min(chunksize, length - written)
+            f.write(_randomBytes(seed, name, (offset + written) // chunksize, n))
+            written = written + n
+    return length
+
+def createTestData(testdata=None, matrix=TESTDATA_MATRIX, seed=None, processes=None, chunksize=CHUNKSIZE):
     """
     Creates test data. 
     Folder: /home/<usr>/testdata or /<TMPDIR>/testdata ; TMPDIR is a shell variable
+    Files and folders are defined by the size matrix, by default:
     Files:  100MB, 1GB, 2GB, 5GB
     Folders: 100 x 10MB
+
+    The files are written in chunks of <chunksize> bytes by a pool of <processes> 
+    worker processes (default: number of cores), so memory use does not grow with the file size.
+    With a seed the content is reproducible: nodes using the same seed, matrix and chunksize 
+    create identical files and there is no need to copy test data between them.
+
+    testdata:   target folder, default getTestDataDir()
+    matrix:     size matrix, see TESTDATA_MATRIX
+    seed:       seed for reproducible data, None uses os.urandom
+    processes:  size of the process pool
+    chunksize:  bytes per write
+
+    Returns a list of the created files.
     """
-    if "TMPDIR" not in os.environ: 
-        testdata = os.environ["HOME"]+"/testdata"
-    else:
-        testdata = os.environ["TMPDIR"]+"/testdata"
+    if testdata is None:
+        testdata = getTestDataDir()
 
     # Check whether test folder already exists. If not create one
     if os.path.isdir(testdata):
@@ -40,40 +344,43 @@ def createTestData():
         print "Create", testdata
         os.makedirs(testdata)
 
-    # Create data
-    #100MB
-    print "Write sample100M.txt"
-    with open(testdata+"/sample100M.txt_0", "wb") as f:
-        f.write(os.urandom(1024 * 1024 * 100))
-    
-    #1GB
-    print "Write sample1G.txt"
-    with open(testdata+"/sample1G.txt_0", "wb") as f:
-        f.write(os.urandom(1024 * 1024 * 1024)) 
-    
-    #2GB
-    print "Write sample2G.txt"
-    with open(testdata+"/sample2G.txt_0", "wb") as f:
-        f.write(os.urandom(1024 * 1024 * 1024 * 2))
-
-    #5GB
-    print "Write sample5G.txt"
-    with open(testdata+"/sample5G.txt_0", "wb") as f:
-        f.write(os.urandom(1024 * 1024 * 1024 * 5))
-
-    #Folder of 100*10MB files
-    print "Create 10MB*100"
-    os.makedirs(testdata+"/Coll10MB_0")
-    for i in range(100):
-        with open(testdata+"/Coll10MB_0/sample10MB_"+str(i)+".txt", "wb") as f:
-            f.write(os.urandom(1024 * 1024 * 10))
+    # Allocate all files and split them into work packages for the process pool
+    layout = testDataLayout(testdata, matrix)
+    tasks = []
+    for path, size in layout:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.truncate(size)
+        name = os.path.relpath(path, testdata)
+        for offset in range(0, size, chunksize * RANGESIZE):
+            tasks.append((path, name, offset, min(chunksize * RANGESIZE, size - offset), seed, chunksize))
+
+    print "Write", len(layout), "files,", sum([size for _, size in layout]), "bytes"
+    pool = multiprocessing.Pool(processes)
+    try:
+        progress = tqdm(total=sum([size for _, size in layout]), unit="B", unit_scale=True)
+        for written in pool.imap_unordered(_writeRange, tasks):
+            progress.update(written)
+        progress.close()
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
 
     print "%sSUCCESS Test data created.%s" %(GREEN, DEFAULT)
+    return [path for path, _ in layout]
 
 def createEnvJSON(uname, host, zone, auth="PAM", ssl="none"):
     """
     Creates the irods_environment.json
+    Does nothing for backends without iRODS server (simulated zone).
     """
+    if BACKEND.local:
+        print "Backend", BACKEND.name, "needs no iRODS environment"
+        return
 
     # Check whether /home/<user>/.irods exists. If not create.
     irodsdir = os.environ["HOME"]+"/.irods"
@@ -102,102 +409,274 @@ def createEnvJSON(uname, host, zone, auth="PAM", ssl="none"):
 
     # Do an iinit to cache the password
     print "%sCaching password.%s" %(GREEN, DEFAULT) 
-    #subprocess.call(["iinit"], shell=True)
-    subprocess.call(["ienv"], shell=True)
+    #icommands.run(["iinit"])
+    print icommands.run(["ienv"], timeout=60).out
     print "%sSUCCESS iRODS environment setup.%s" %(GREEN, DEFAULT)
 
-def iRODScreateColl(collname):
+def iRODScreateColl(collname, checkpoint=None):
     """
     Creates an iRODS collection. If collection exists it starts 
-    enumerating until new collection is created.
+    enumerating until new collection is created. The collection is recorded for cleanUp.
     collname:   Collection to create in iRODS, accepts absolute and relative collection paths
+    checkpoint: results.Checkpoint of the run using the collection, cleanUp keeps it while the checkpoint exists
     """
 
     count = 0
     while(True):
-        p = subprocess.Popen(["imkdir "+collname+str(count)], shell=True, 
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        out, err = p.communicate()
-        if err.startswith("ERROR"):
-            print RED, err, DEFAULT
+        res = BACKEND.mkdir(collname+str(count))
+        if res.returncode == 127:
+            print RED, res.err, DEFAULT
+            raise Exception("icommands not found")
+        if res.err.startswith("ERROR"):
+            print RED, res.err, DEFAULT
             count = count + 1 
         else:
             break
 
     print GREEN, "SUCCESS iRODS collection created:", DEFAULT, collname+str(count)
+    _recordCollection(collname+str(count), checkpoint)
     return collname+str(count)
 
-def iRODSput(iresource, source, idestination):
+def iRODSput(iresource, source, idestination, **settings):
     """
-    Wrapper for iRODS iput.
+    Wrapper for iRODS iput (iput -r -b -K -f -R with the icommands backend).
     iresource:  iRODS resource name
     source:     path to local file to upload, must be a file, accepts absolut and relative paths
     idestination:   iRODS destination, accepts absolut and relative collection paths
-    """
-    p = subprocess.Popen(["time iput -r -b -K -f -R "+iresource+" "+source+" "+idestination],
-        shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    settings:   transfer settings threads, bulk and checksum, see backends.Backend
 
-    out, err = p.communicate()
-    elapsed = [i.split("\t")[1] for i in err.strip("\n").split("\n")]
-    return (out, err, elapsed[0], elapsed[1], elapsed[2])
+    Returns an icommands.CommandResult of the backend: (argv, returncode, out, err, real, user, sys, maxrss), 
+    times in seconds, maxrss in kilobytes.
+    """
+    return _monitoredTransfer(BACKEND.put, "iput", iresource, source, idestination, settings)
 
-def iRODSget(iresource, isource, destination):
+def iRODSget(iresource, isource, destination, **settings):
     """
-    Wrapper for iRODS iget.
+    Wrapper for iRODS iget (iget -r -b -K -f -R with the icommands backend).
     iresource:  iRODS resource name
     source:     path to local destination file, must be a file, accepts absolut and relative paths
     idestination:   iRODS source, accepts absolut and relative collection paths
+    settings:   transfer settings threads, bulk and checksum, see backends.Backend
+
+    Returns an icommands.CommandResult of the backend: (argv, returncode, out, err, real, user, sys, maxrss), 
+    times in seconds, maxrss in kilobytes.
     """
-    p = subprocess.Popen(["time iget -r -b -K -f -R "+iresource+" "+isource+" "+destination],
-        shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return _monitoredTransfer(BACKEND.get, "iget", iresource, isource, destination, settings)
 
-    out, err = p.communicate()
-    elapsed = [i.split("\t")[1] for i in err.strip("\n").split("\n")]
-    return (out, err, elapsed[0], elapsed[1], elapsed[2])
+def iRODSstream(iresource, isource, sink):
+    """
+    Downloads a data object without writing it to the local file system (iget <object> - with the 
+    icommands backend), the data goes to sink.
+    sink:       object with a method update(chunk), e.g. checksums.StreamChecksum
 
-def checkIntegrity(iRODSfile, localFile):
+    Returns an icommands.CommandResult of the backend, see iRODSget.
     """
-    Compares checksums of local file and iRODS file. Uses md5.
+    return _monitoredTransfer(BACKEND.stream, "stream", iresource, isource, sink, {})
+
+def checkIntegrity(iRODSfile, localFile, index=None):
+    """
+    Compares checksums of local file and iRODS file. Uses md5 or sha2, depending on 
+    the checksum stored in iRODS. The local checksum is computed in chunks and cached,
+    see checksums.py.
     localFile:  absolut path to local file
     iRODSfile:  iRODS absolut or relative path
+    index:      catalog.CatalogIndex containing iRODSfile, by default the catalog is queried
     """
-    p = subprocess.Popen(["ils -L "+iRODSfile],
-        shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = p.communicate()
-    irodschksum = [item for item in out.split(" ") if item !=""][7]
+    if index is None:
+        index = BACKEND.snapshot(iRODSfile)
+    irodschksum = index.checksum(iRODSfile)
+    if irodschksum is None:
+        return False
 
-    checksum = hashlib.md5(open(localFile, "rb").read()).hexdigest()
+    checksum = localChecksum(localFile, checksumAlgorithm(irodschksum))
 
     return irodschksum == checksum
 
-def cleanUp(collections = ["CONNECTIVITY0", "PERFORMANCE0", "PERFORMANCEC0"], 
-        folders = [os.environ["HOME"]+"/testdata"]):
+def verifyCollection(iRODScoll, localDir, index=None, processes=None):
+    """
+    Compares all files below a local folder with the data objects below an iRODS collection.
+    The catalog is read with a single query, local checksums are computed in parallel.
+    iRODScoll:  iRODS absolut or relative collection path
+    localDir:   local folder
+    index:      catalog.CatalogIndex containing iRODScoll, by default the catalog is queried
+    processes:  size of the process pool for the local checksums
+
+    Returns a list of mismatches: [(relative path, reason)], empty if all files match.
+    """
+    if index is None:
+        index = BACKEND.snapshot(iRODScoll)
+    remote = index.relativePaths(iRODScoll)
+    local = {}
+    for root, _, files in os.walk(localDir):
+        for f in files:
+            local[os.path.relpath(os.path.join(root, f), localDir)] = os.path.join(root, f)
+
+    mismatches = [(rel, "missing locally") for rel in sorted(set(remote) - set(local))]
+    mismatches.extend([(rel, "missing in iRODS") for rel in sorted(set(local) - set(remote))])
+
+    # Group files by checksum algorithm of the zone, usually there is only one
+    algorithms = {}
+    for rel in sorted(set(local) & set(remote)):
+        irodschksum = index.checksum(remote[rel])
+        if irodschksum is None:
+            mismatches.append((rel, "no checksum in iRODS"))
+        else:
+            algorithms.setdefault(checksumAlgorithm(irodschksum), []).append(rel)
+
+    for algorithm, rels in algorithms.items():
+        checksums = checksumFiles([local[rel] for rel in rels], algorithm, processes)
+        for rel in rels:
+            if checksums[local[rel]] != index.checksum(remote[rel]):
+                mismatches.append((rel, "checksum mismatch"))
+
+    return mismatches
+
+def integrityStatus(mismatches, total):
+    """
+    Summarises the result of verifyCollection for the result files.
+    """
+    if len(mismatches) == 0:
+        return "ok"
+    return "%d of %d files failed: %s" %(len(mismatches), total,
+        "; ".join(["%s (%s)" %(rel, reason) for rel, reason in mismatches]))
+
+# Collections created by the tests of a node, json lines file in its test data folder, see cleanUp
+CREATED = ".collections"
+
+def _recordCollection(collection, checkpoint=None):
+    testdata = getTestDataDir()
+    if not os.path.isdir(testdata):
+        os.makedirs(testdata)
+    entry = {"collection": collection, "checkpoint": None if checkpoint is None else os.path.abspath(checkpoint.path)}
+    with open(testdata+"/"+CREATED, "a") as f:
+        f.write(json.dumps(entry)+"\n")
+
+def createdCollections(folder):
+    """
+    Returns the collections recorded in a test data folder: [{collection, checkpoint}]
+    """
+    entries = []
+    if os.path.isfile(folder+"/"+CREATED):
+        with open(folder+"/"+CREATED) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # last line of a killed run
+                    continue
+    return entries
+
+def _removeLocal(path):
+    """
+    Removes a local file, returns its size. Folders are removed if they are empty.
     """
-    Removes iRODS collections and replicated testdata.
-    collections:    List of absolut or relative collection names. Default ["CONNECTIVITY", "PERFORMANCE"].
+    if os.path.isdir(path):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+        return 0
+    size = os.path.getsize(path)
+    os.remove(path)
+    return size
+
+def _removeCollection(coll):
+    """
+    Lists a collection and removes it. Returns (catalog.CatalogIndex, CommandResult of the removal).
+    """
+    return BACKEND.snapshot(coll), BACKEND.remove(coll, force=True)
+
+def cleanUp(collections = None, folders = [os.environ["HOME"]+"/testdata"], threads = 8):
+    """
+    Removes iRODS collections and replicated testdata. The collections are removed in parallel 
+    bypassing the trash (irm -rf), the copies of the test data (all but <data>_0) and staged data 
+    left in STAGING file by file in parallel.
+    collections:    List of absolut or relative collection names. Default: the collections the tests
+                    created with the test data folders (see iRODScreateColl), other nodes and users of
+                    the home collection may run tests at the same time. Collections of a run that
+                    can be resumed (its checkpoint exists) are kept.
     folders:        List of local folders. Default [os.environ["HOME"]+"/testdata"]
+    threads:        number of deletions running at the same time
+
+    Returns {collections, objects, bytes, files, local bytes, seconds}, the data reclaimed.
     """
-    if "TMPDIR" not in os.environ:
+    start = timer()
+    folders = list(folders)
+    if "TMPDIR" in os.environ and os.environ["TMPDIR"]+"/testdata" not in folders:
         folders.append(os.environ["TMPDIR"]+"/testdata")
+    pool = ThreadPool(threads)
 
     print "Remove iRODS collections"
-    for coll in collections:
-        p = subprocess.Popen(["irm -r "+coll],
-            shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    p = subprocess.Popen(["irmtrash"], shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    kept = {}       # folder --> entries of CREATED kept for a later clean up
+    origin = {}     # collection --> (folder, entry)
+    if collections is None:
+        collections = []
+        for folder in folders:
+            kept[folder] = []
+            for entry in createdCollections(folder):
+                if entry["checkpoint"] is not None and os.path.isfile(entry["checkpoint"]):
+                    kept[folder].append(entry)
+                elif entry["collection"] not in origin:
+                    collections.append(entry["collection"])
+                    origin[entry["collection"]] = (folder, entry)
+    print collections
+
+    removed = []
+    objects = 0
+    nbytes = 0
+    # a timeout keeps the wait interruptible in python 2
+    for coll, (index, res) in zip(collections, pool.map_async(_removeCollection, collections).get(86400)):
+        if res.returncode != 0 and ("does not exist" in res.err or "USER_INPUT_PATH_ERR" in res.err):
+            continue
+        if res.returncode != 0:
+            print "%sWARNING cannot remove%s" %(RED, DEFAULT), coll, res.err.strip()
+            if coll in origin:
+                kept[origin[coll][0]].append(origin[coll][1])
+            continue
+        removed.append(coll)
+        if index.error is not None:
+            print "%sWARNING cannot list%s" %(RED, DEFAULT), coll, index.error.strip(), "- its data is not counted"
+            continue
+        objects = objects + len(index)
+        nbytes = nbytes + index.totalSize()
+    # data removed by the tests with irm -r
+    BACKEND.emptyTrash()
+
+    for folder, entries in kept.items():
+        if len(entries) > 0:
+            with open(folder+"/"+CREATED, "w") as f:
+                f.write("".join([json.dumps(entry)+"\n" for entry in entries]))
+        elif os.path.isfile(folder+"/"+CREATED):
+            os.remove(folder+"/"+CREATED)
 
     print "Remove duplicate data"
     data = []
     for folder in folders:
+        if not os.path.isdir(folder):
+            continue
         data.extend([folder+"/" + f
-            for f in os.listdir(folder) if not f.endswith("_0")])
-    for d in data:
-        if os.path.isfile(d):
-            os.remove(d)
-        else:
-            shutil.rmtree(d, ignore_errors=True)
+            for f in os.listdir(folder) if not f.endswith("_0") and f != CREATED])
+    if os.path.isdir(STAGING):
+        data.extend([STAGING+"/"+f for f in os.listdir(STAGING) if f.startswith("irodsperf-")])
+    # files first, then the folders bottom up
+    files = [d for d in data if not os.path.isdir(d)]
+    dirs = []
+    for d in [d for d in data if os.path.isdir(d)]:
+        for root, subdirs, fs in os.walk(d, topdown=False):
+            files.extend([os.path.join(root, f) for f in fs])
+            dirs.append(root)
+    localBytes = sum(pool.map_async(_removeLocal, files).get(86400))
+    for d in dirs:
+        _removeLocal(d)
+    pool.close()
+    pool.join()
 
-    print "%sClean up finished. %s" %(GREEN, DEFAULT)
+    summary = {"collections": len(removed), "objects": objects, "bytes": nbytes, "files": len(files), 
+        "local bytes": localBytes, "seconds": timer() - start}
+    print "%sClean up finished:%s %d collections with %d data objects (%.2f GB), %d local files (%.2f GB) in %.1f s" %(
+        GREEN, DEFAULT, summary["collections"], summary["objects"], summary["bytes"] / 1e9, summary["files"],
+        summary["local bytes"] / 1e9, summary["seconds"])
+    return summary
 
 def connectivity(iresource, data=os.environ["HOME"]+"/testdata/sample100M.txt_0"):
     """
@@ -205,7 +684,7 @@ def connectivity(iresource, data=os.environ["HOME"]+"/testdata/sample100M.txt_0"
     iresource:  iRODS resource
     homedir:    directory containing the testdata (home directory by default)    
 
-    Returns a tuple: (date, resource, client, iput/iget, size, time)
+    Returns a result row, see resultRow
     """
     # Make sure you are in /home/<user>
     os.chdir(os.environ["HOME"])
@@ -219,10 +698,10 @@ def connectivity(iresource, data=os.environ["HOME"]+"/testdata/sample100M.txt_0"
 
     print "iput -f -K -R iresource", data, collection+"/sample100M.txt"    
     date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-    err, out, elapsed, _, _ = iRODSput(iresource, data, collection+"/sample100M.txt")
+    res = iRODSput(iresource, data, collection+"/sample100M.txt")
 
-    if err.startswith("ERROR"):
-        print "%s" %(RED), err, "%s" %(DEFAULT)
+    if res.err.startswith("ERROR") or res.returncode != 0:
+        print "%s" %(RED), res.err, "%s" %(DEFAULT)
         raise Exception("iRODS ERROR")
 
     # Test data integrity
@@ -230,11 +709,153 @@ def connectivity(iresource, data=os.environ["HOME"]+"/testdata/sample100M.txt_0"
         print "%sERROR Checksums do not match.%s" %(RED, DEFAULT)
         raise Exception("iRODS Data integrity")
 
-    result = (date, iresource, os.uname()[1], "iput", "100M", elapsed) 
+    result = resultRow(date, iresource, "iput", "100M", res.real, res.user, res.sys, integrity="ok",
+        max_rss=res.maxrss)
     print GREEN, "SUCCESS", result, DEFAULT
-    return (date, iresource, os.uname()[1], "iput", "100M", elapsed)
+    return result
     
-def performanceSingleFiles(iresource, maxTimes = 10):
+def _resumeCollection(prefix, checkpoint=None):
+    """
+    Returns the iRODS collection of the interrupted run recorded in the checkpoint,
+    or creates a new collection <prefix><n> and records it.
+    """
+    if checkpoint is not None and checkpoint.get("collection "+prefix) is not None:
+        collection = checkpoint.get("collection "+prefix)
+        print "Resume in iRODS Collection", collection
+        return collection
+
+    print "Create iRODS Collection", prefix
+    collection = iRODScreateColl(prefix, checkpoint)
+    if checkpoint is not None:
+        checkpoint.set("collection "+prefix, collection)
+    return collection
+
+def _removeCopy(local, obj=None):
+    """
+    Removes a local copy (file or folder) and the data object or collection obj, bypassing the trash.
+    Missing copies are skipped.
+    """
+    if os.path.isfile(local):
+        os.remove(local)
+    elif os.path.isdir(local):
+        shutil.rmtree(local)
+    if obj is None:
+        return
+    res = BACKEND.remove(obj, force=True)
+    if res.returncode != 0 and "USER_INPUT_PATH_ERR" not in res.err and "does not exist" not in res.err:
+        print "%sWARNING cannot remove%s" %(RED, DEFAULT), obj, res.err.strip()
+
+def _trimCopies(data, obj, n):
+    """
+    Removes copy n of a ping-pong: the local copy data_<n> and the data object or collection obj_<n>.
+    The originals data_0 are kept.
+    """
+    if n < 1:
+        return
+    _removeCopy(data+"_"+str(n), obj+"_"+str(n))
+
+def scratchSpace(testdata, dataset, copies):
+    """
+    Warns if the folder of the test data has no room for the copies of a ping-pong.
+    dataset:    local test data, files or folders
+    copies:     copies of each dataset that exist at the same time, besides the original
+    Returns (bytes needed, bytes available)
+    """
+    needed = sum([dataSize(data) for data in dataset]) * copies
+    stat = os.statvfs(testdata)
+    available = stat.f_bavail * stat.f_frsize
+    if needed > available:
+        print "%sWARNING %d copies of the test data need %.1f GB, %s has %.1f GB free.%s" %(
+            RED, copies, needed / 1e9, testdata, available / 1e9, DEFAULT)
+    return needed, available
+
+class VerificationPipeline(object):
+    """
+    Verifies the transfers of a test and records their result rows. A row is recorded and its step
+    marked done once the transfer is verified.
+    Inline, every verification runs right after its transfer and a mismatch stops the test at once.
+    In the background, the verifications run on a worker thread in the order they were submitted 
+    while the next transfer already runs; the timed transfers share the disk and CPU with it. A mismatch
+    is recorded in the column integrity of its row and fails the test at the next check, transfers 
+    already started are verified and recorded first.
+    result:     list of the result rows of the test
+    sink, checkpoint:   see _record and _mark
+    background: verify on a worker thread
+    depth:      verifications that may wait for the worker, submit blocks when the queue is full
+    """
+
+    def __init__(self, result, sink=None, checkpoint=None, background=False, depth=2):
+        self.result = result
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.failures = []
+        self.queue = None
+        if background:
+            self.queue = Queue.Queue(depth)
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            if task is None:
+                return
+            try:
+                self._execute(*task)
+            except Exception, e:
+                # e.g. the catalog query failed, the step stays undone
+                print "%sERROR verification failed:%s" %(RED, DEFAULT), task[1], e
+                self.failures.append((task[3], str(e)))
+
+    def _execute(self, function, args, row, step):
+        if row is None:
+            function(*args)
+            return
+        print "integrity", " ".join(args)
+        if function(*args):
+            print "Integrity done"
+            _record(self.result, row, self.sink)
+            _mark(self.checkpoint, *step)
+            return
+        print "%sERROR Checksums do not match.%s" %(RED, DEFAULT), " ".join(args)
+        if self.queue is None:
+            raise Exception("iRODS Data integrity")
+        row["integrity"] = "checksum mismatch"
+        _record(self.result, row, self.sink)
+        self.failures.append((step, "checksum mismatch"))
+
+    def submit(self, function, args, row=None, step=None):
+        """
+        Runs function(*args). With a row, function verifies a transfer and returns True if it succeeded, 
+        the row is recorded and step (see _mark) marked done afterwards.
+        """
+        if self.queue is None:
+            self._execute(function, args, row, step)
+        else:
+            self.check()
+            self.queue.put((function, args, row, step))
+
+    def join(self):
+        """
+        Waits for all submitted verifications and stops the worker.
+        """
+        if self.queue is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def check(self):
+        """
+        Raises an exception if a verification failed, after the pending verifications are done.
+        """
+        if len(self.failures) > 0:
+            self.join()
+            print "%sERROR %d transfers failed their verification:%s" %(RED, len(self.failures), DEFAULT), \
+                self.failures
+            raise Exception("iRODS Data integrity")
+
+def performanceSingleFiles(iresource, maxTimes = 10, sink = None, checkpoint = None, keep = None, 
+        pipelined = False):
     """
     Tests the performance of iget and iput for single files.
     Test data needs to be stored under $HOME/testdata. The function omits subfolders. 
@@ -244,63 +865,450 @@ def performanceSingleFiles(iresource, maxTimes = 10):
         iput folder/data_1 --> coll/data_2
         iget coll/data_2 --> folder/data_2
         ...
+    With keep, every copy is removed as soon as the next one is verified: after the iput of coll/data_<i>
+    the copies folder/data_<i-keep> and coll/data_<i-keep> are deleted. keep=1 bounds the footprint 
+    to data_0 and one copy on each side, instead of maxTimes - 1 copies of every file.
+    Pipelined, the checksums of a transfer are verified while the next transfer runs, see VerificationPipeline.
 
     iresource:  iRODS resource
     maxTimes:   times how often the file is transferred with iput and iget.
+    sink:       results.ResultSink, every row is written as soon as it is measured
+    checkpoint: results.Checkpoint, steps (file, i, iput/iget) done in an interrupted run are skipped
+    keep:       number of the latest copies kept locally and in iRODS (>= 1), None keeps all copies
+    pipelined:  verify in the background, a mismatch fails the test after the running transfer
 
-    Returns a list of tuples: [(date, resource, client, iput/iget, size, real time, user time, system time)]
+    Returns a list of result rows: [{date, resource, client, iput/iget, size, real time, user time, system time, ...}]
     """
 
+    if keep is not None and keep < 1:
+        # keep=0 would delete coll/data_<i> before its iget
+        raise ValueError("keep must be at least 1: "+str(keep))
+
     # If there is a tmp dir, use that for transferring the data
-    if "TMPDIR" not in os.environ:
-        testdata = os.environ["HOME"]+"/testdata"
-    else:
-        testdata = os.environ["TMPDIR"]+"/testdata"
+    testdata = getTestDataDir()
 
+    # Only the original files, copies data_<i> of earlier runs are skipped
     dataset = [testdata+"/" + f 
-        for f in os.listdir(testdata) if os.path.isfile(testdata+"/" + f)]
+        for f in os.listdir(testdata) if os.path.isfile(testdata+"/" + f) and f.endswith("_0")]
 
     for data in dataset:
         # Verify that data is there.
         if not os.path.isfile(data):
             print RED, "ERROR test data does not exist:", data, DEFAULT
             raise Exception("File not found.")
+    scratchSpace(testdata, dataset, maxTimes - 1 if keep is None else keep)
 
-    print "Create iRODS Collection PERFORMANCE"
-    collection = iRODScreateColl("PERFORMANCE")
+    collection = _resumeCollection("PERFORMANCE", checkpoint)
     # Put and get data from iRODS using 1GB, 2GB and 5GB, store data with new file name "+_str(i)"
     result = []
+    pipeline = VerificationPipeline(result, sink, checkpoint, background=pipelined)
+    try:
+        for data in dataset:
+            nbytes = dataSize(data)
+            data = data.split("_")[0] # ge base name of the file --> no "_str(i)"
+            name = os.path.basename(data)
+            print "Put and get: ", data
+            for i in tqdm(range(1, maxTimes)):
+                pipeline.check()
+                source = data+"_"+str(i-1)
+                if not os.path.isfile(source):
+                    # Resumed on a node without the copies of the interrupted run, data_0 has the same content
+                    source = data+"_0"
+                if not _done(checkpoint, name, i, "iput"):
+                    date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+                    print "iput", source, collection+"/"+name+"_"+str(i)
+                    res = iRODSput(iresource, source, collection+"/"+name+"_"+str(i))
+                    pipeline.submit(checkIntegrity, (collection+"/"+name+"_"+str(i), source),
+                        resultRow(date, iresource, "iput", name.split('.')[0][6:],
+                        res.real, res.user, res.sys, integrity="ok", bytes=nbytes, max_rss=res.maxrss,
+                        iteration=i, **transferColumns()), (name, i, "iput"))
+                if keep is not None:
+                    # queued behind the verification of the copy it removes
+                    pipeline.submit(_trimCopies, (data, collection+"/"+name, i - keep))
+
+                if not _done(checkpoint, name, i, "iget"):
+                    date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+                    print "iget", collection+"/"+name+"_"+str(i), data+"_"+str(i)
+                    res = iRODSget(iresource, collection+"/"+name+"_"+str(i), data+"_"+str(i))
+                    pipeline.submit(checkIntegrity, (collection+"/"+name+"_"+str(i), data+"_"+str(i)),
+                        resultRow(date, iresource, "iget", name.split('.')[0][6:],
+                        res.real, res.user, res.sys, integrity="ok", bytes=nbytes, max_rss=res.maxrss,
+                        iteration=i, **transferColumns()), (name, i, "iget"))
+    finally:
+        # rows of transfers that already ran are recorded, also if the test fails
+        pipeline.join()
+    pipeline.check()
+
+    return result
+
+def performanceAdaptive(iresource, minTimes = 3, maxTimes = 30, precision = 0.05, budget = None, 
+        sink = None, checkpoint = None):
+    """
+    Tests the performance of iget and iput for single files like performanceSingleFiles, but repeats
+    every (file, iput/iget) until the confidence interval of its throughput is narrower than 
+    precision, see scheduler.AdaptiveScheduler. The transfers still alternate between the local
+    file system and iRODS:
+        iput: the latest local copy folder/data_<k> --> coll/data_<j+1>
+        iget: the latest data object coll/data_<j> --> folder/data_<k+1>
+    Only the latest local copy is kept, data_<k> is removed once data_<k+1> is verified, and the
+    last one at the end of the test. The originals data_0 are kept.
+
+    iresource:  iRODS resource
+    minTimes, maxTimes: minimum and maximum iterations per file and direction
+    precision:  target of the half width of the 95% confidence interval relative to the mean
+    budget:     seconds for the whole test, None for no limit
+    sink:       results.ResultSink, every row is written as soon as it is measured
+    checkpoint: results.Checkpoint, the measurements of an interrupted run are restored
+
+    Returns a list of result rows with the iteration per file and direction.
+    """
+
+    # If there is a tmp dir, use that for transferring the data
+    testdata = getTestDataDir()
+
+    dataset = sorted([testdata+"/" + f
+        for f in os.listdir(testdata) if os.path.isfile(testdata+"/" + f) and f.endswith("_0")])
+
+    collection = _resumeCollection("PERFORMANCEA", checkpoint)
+
+    names = dict([(os.path.basename(data.split("_")[0]), data.split("_")[0]) for data in dataset])
+    nbytes = dict([(os.path.basename(data.split("_")[0]), dataSize(data)) for data in dataset])
+    scheduler = AdaptiveScheduler([(name, operation) for name in sorted(names) for operation in ["iput", "iget"]],
+        minTimes, maxTimes, precision, budget=budget)
+    if checkpoint is not None and checkpoint.get("adaptive") is not None:
+        scheduler.restore(checkpoint.get("adaptive"))
+
+    result = []
+    key = scheduler.next()
+    while key is not None:
+        name, operation = key
+        data = names[name]
+        puts = len(scheduler.samples[(name, "iput")])
+        gets = len(scheduler.samples[(name, "iget")])
+        local = data+"_"+str(gets)
+        if not os.path.isfile(local):
+            # Resumed on a node without the copies of the interrupted run, data_0 has the same content
+            local = data+"_0"
+
+        start = timer()
+        date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        if operation == "iput":
+            obj = collection+"/"+name+"_"+str(puts + 1)
+            print "iput", local, obj
+            res = iRODSput(iresource, local, obj)
+        else:
+            # iget needs an uploaded object, the first round always starts with iput
+            obj = collection+"/"+name+"_"+str(puts)
+            local = data+"_"+str(gets + 1)
+            print "iget", obj, local
+            res = iRODSget(iresource, obj, local)
+        if not checkIntegrity(obj, local):
+            print "%sERROR Checksums do not match.%s" %(RED, DEFAULT), obj, local
+            raise Exception("iRODS Data integrity")
+        if operation == "iget" and gets > 0:
+            _removeCopy(data+"_"+str(gets))
+
+        scheduler.add(key, nbytes[name] / res.real, timer() - start)
+        _record(result, resultRow(date, iresource, operation, name.split('.')[0][6:], res.real, res.user, res.sys,
+            integrity="ok", bytes=nbytes[name], max_rss=res.maxrss, iteration=len(scheduler.samples[key]), **transferColumns()), sink)
+        if checkpoint is not None:
+            checkpoint.set("adaptive", scheduler.state())
+        print "%s %s: %d iterations, +-%.1f%%" %(name, operation, len(scheduler.samples[key]), 
+            100 * scheduler.relativeWidth(key))
+        key = scheduler.next()
+
+    for name, data in names.items():
+        if len(scheduler.samples[(name, "iget")]) > 0:
+            _removeCopy(data+"_"+str(len(scheduler.samples[(name, "iget")])))
+    for line in scheduler.report():
+        print line
+    return result
+
+# Transfer settings of performanceSweep, every combination is tested.
+#   threads:    parallel transfer threads (-N), 0 transfers through the control connection
+#   bulk:       bulk upload (-b)
+#   checksum:   checksums during the transfer (-K)
+SWEEP_GRID = {
+    "threads":  [0, 1, 4, 8, 16],
+    "bulk":     [True, False],
+    "checksum": [True, False],
+}
+
+def sweepSettings(grid=SWEEP_GRID):
+    """
+    Returns the combinations of a grid of transfer settings: [{threads, bulk, checksum}]
+    Settings missing in the grid keep their default, see backends.Backend.
+    """
+    keys = sorted(grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*[grid[key] for key in keys])]
+
+def _flag(value):
+    # settings of result rows: True/False, 1/0 or "1"/"0" from a csv file
+    return str(value) in ("True", "1", "1.0")
+
+def settingsLabel(threads=None, bulk=True, checksum=True):
+    """
+    Returns the icommands flags of transfer settings, e.g. "-N 4 -b -K". 
+    Accepts the values of result rows, threads "" is the default of the backend.
+    """
+    flags = []
+    if threads is not None and threads != "":
+        flags.append("-N %d" %int(float(threads)))
+    if _flag(bulk):
+        flags.append("-b")
+    if _flag(checksum):
+        flags.append("-K")
+    return " ".join(flags)
+
+def performanceSweep(iresource, grid = SWEEP_GRID, maxTimes = 4, sink = None, checkpoint = None):
+    """
+    Tests the performance of iput and iget for every combination of transfer settings in grid, 
+    for the single files and folders of the test data. The settings are recorded in the columns 
+    threads, bulk and checksum of each result row.
+        iput folder/data_0 --> coll/data_<settings>_<i>
+        iget coll/data_<settings>_<i> --> folder/data_sweep
+    Every transfer starts from data_0, the data object and the local copy are removed after their
+    verification. Without checksums during the transfer (-K), the checksum of the data object is
+    computed after the timed iput (ichksum) to verify it.
+
+    iresource:  iRODS resource
+    grid:       {setting: [values]}, see SWEEP_GRID and sweepSettings
+    maxTimes:   times how often the data is transferred with iput and iget per settings
+    sink:       results.ResultSink, every row is written as soon as it is measured
+    checkpoint: results.Checkpoint, steps (data, settings, i, iput/iget) done in an interrupted run are skipped
+
+    Returns a list of result rows, see bestSettings for the best settings per resource and size.
+    """
+
+    # If there is a tmp dir, use that for transferring the data
+    testdata = getTestDataDir()
+
+    dataset = sorted([testdata+"/" + f for f in os.listdir(testdata) if f.endswith("_0")])
+    combinations = sweepSettings(grid)
+
+    collection = _resumeCollection("PERFORMANCEW", checkpoint)
+    result = []
     for data in dataset:
-        data = data.split("_")[0] # ge base name of the file --> no "_str(i)"
-        print "Put and get: ", data
-        for i in tqdm(range(1, maxTimes)):
+        nbytes = dataSize(data)
+        isFile = os.path.isfile(data)
+        name = os.path.basename(data.split("_")[0])
+        size = name.split('.')[0][6:] if isFile else name[4:]
+        local = data.split("_")[0]+"_sweep"
+        nfiles = 1 if isFile else len([f for _, _, fs in os.walk(data) for f in fs])
+        print "Sweep:", data, len(combinations), "settings"
+        for k, settings in enumerate(tqdm(combinations)):
+            label = settingsLabel(**settings)
+            for i in range(1, maxTimes):
+                obj = collection+"/"+name+"_"+str(k)+"_"+str(i)
+                columns = {"integrity": "ok", "bytes": nbytes, "files": nfiles, "iteration": i,
+                    "threads": settings.get("threads"), "bulk": int(settings.get("bulk", True)),
+                    "checksum": int(settings.get("checksum", True))}
+                if not _done(checkpoint, name, label, i, "iput"):
+                    date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+                    print "iput", label, data, obj
+                    res = iRODSput(iresource, data, obj, **settings)
+                    columns.update(transferColumns())
+                    if not settings.get("checksum", True):
+                        BACKEND.checksum(obj)
+                    if isFile and not checkIntegrity(obj, data) or not isFile and verifyCollection(obj, data):
+                        print "%sERROR Checksums do not match.%s" %(RED, DEFAULT), label, obj
+                        raise Exception("iRODS Data integrity")
+                    _record(result, resultRow(date, iresource, "iput", size, res.real, res.user, res.sys,
+                        max_rss=res.maxrss, **columns), sink)
+                    _mark(checkpoint, name, label, i, "iput")
+
+                if not _done(checkpoint, name, label, i, "iget"):
+                    date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+                    print "iget", label, obj, local
+                    res = iRODSget(iresource, obj, local, **settings)
+                    columns.update(transferColumns())
+                    if isFile and not checkIntegrity(obj, local) or not isFile and verifyCollection(obj, local):
+                        print "%sERROR Checksums do not match.%s" %(RED, DEFAULT), label, local
+                        raise Exception("iRODS Data integrity")
+                    _record(result, resultRow(date, iresource, "iget", size, res.real, res.user, res.sys,
+                        max_rss=res.maxrss, **columns), sink)
+                    _mark(checkpoint, name, label, i, "iget")
+                    BACKEND.remove(obj)
+                    if isFile:
+                        os.remove(local)
+                    else:
+                        shutil.rmtree(local)
+        BACKEND.emptyTrash()
+
+    return result
+
+def bestSettings(rows):
+    """
+    Finds the transfer settings with the highest median throughput per resource, size and direction.
+    rows:   result rows of performanceSweep, e.g. read from its csv file with csv.DictReader
+
+    Returns a list of dictionaries sorted by resource, size and direction:
+        {iresource, size, iget/iput, settings, runs, median MB/s, default MB/s}
+    default MB/s is the median throughput of the default settings -b -K, None if not measured.
+    """
+    throughputs = {}    # (iresource, size, operation) --> {settings: [MB/s]}
+    for row in rows:
+        if str(row.get("bulk", "")) == "" or not row.get("real time") or not row.get("bytes"):
+            continue
+        key = (row["iresource"], row["size"], row["iget/iput"])
+        label = settingsLabel(row.get("threads"), row.get("bulk"), row.get("checksum"))
+        throughputs.setdefault(key, {}).setdefault(label, []).append(
+            float(row["bytes"]) / 1024**2 / float(row["real time"]))
+
+    best = []
+    for key in sorted(throughputs, key=lambda key: (key[0], parseSize(key[1]), key[2])):
+        medians = dict([(label, percentile(values, 50)) for label, values in throughputs[key].items()])
+        label = max(medians, key=lambda label: medians[label])
+        best.append({"iresource": key[0], "size": key[1], "iget/iput": key[2], "settings": label,
+            "runs": len(throughputs[key][label]), "median MB/s": medians[label],
+            "default MB/s": medians.get("-b -K")})
+    return best
+
+def performanceNetwork(iresource, maxTimes = 10, staging = STAGING, sink = None, checkpoint = None):
+    """
+    Tests the performance of iput and iget for single files without the local file system:
+    the files are staged in memory (see stageData) and downloads go to a null sink that only 
+    checksums the received data (iget <object> -).
+        iput staging/data_0 --> coll/data_<i>
+        iget coll/data_<i> --> checksum
+    Compare with the rows of diskBaseline to see what the local disk adds to the other tests.
+
+    iresource:  iRODS resource
+    maxTimes:   times how often the file is transferred with iput and iget.
+    staging:    memory backed folder, None only warms the page cache
+    sink:       results.ResultSink, every row is written as soon as it is measured
+    checkpoint: results.Checkpoint, steps (file, i, iput/iget) done in an interrupted run are skipped
+
+    Returns a list of result rows, the column local io tells where the data came from or went to: 
+    shm, page cache or null.
+    """
+
+    # If there is a tmp dir, use that for transferring the data
+    testdata = getTestDataDir()
+
+    dataset = sorted([testdata+"/" + f
+        for f in os.listdir(testdata) if os.path.isfile(testdata+"/" + f) and f.endswith("_0")])
+
+    collection = _resumeCollection("NETWORK", checkpoint)
+    result = []
+    try:
+        for data in dataset:
+            nbytes = dataSize(data)
+            name = os.path.basename(data.split("_")[0])
+            size = name.split('.')[0][6:]
+            puts = [i for i in range(1, maxTimes) if not _done(checkpoint, name, i, "iput")]
+            gets = [i for i in range(1, maxTimes) if not _done(checkpoint, name, i, "iget")]
+            if len(puts) == 0 and len(gets) == 0:
+                continue
+            # the downloads of a resumed run do not read the local file
+            source, localIO = stageData(data, staging) if len(puts) > 0 else (data, "page cache")
+            try:
+                print "Put and get: ", data, "from", localIO
+                for i in tqdm(range(1, maxTimes)):
+                    obj = collection+"/"+name+"_"+str(i)
+                    if i in puts:
+                        if localIO == "page cache":
+                            # evicted by the downloads in the meantime?
+                            warmCache(source)
+                        date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+                        res = iRODSput(iresource, source, obj)
+                        if not checkIntegrity(obj, source):
+                            print "%sERROR Checksums do not match.%s" %(RED, DEFAULT), obj
+                            raise Exception("iRODS Data integrity")
+                        _record(result, resultRow(date, iresource, "iput", size, res.real, res.user, res.sys,
+                            integrity="ok", bytes=nbytes, max_rss=res.maxrss, iteration=i, local_io=localIO,
+                            **transferColumns()), sink)
+                        _mark(checkpoint, name, i, "iput")
+
+                    if i in gets:
+                        irodschksum = BACKEND.snapshot(obj).checksum(obj)
+                        if irodschksum is None:
+                            print "%sERROR no checksum in iRODS.%s" %(RED, DEFAULT), obj
+                            raise Exception("iRODS Data integrity")
+                        received = StreamChecksum(checksumAlgorithm(irodschksum))
+                        date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+                        res = iRODSstream(iresource, obj, received)
+                        if received.checksum() != irodschksum or received.bytes != nbytes:
+                            print "%sERROR Checksums do not match.%s" %(RED, DEFAULT), obj, res.err
+                            raise Exception("iRODS Data integrity")
+                        _record(result, resultRow(date, iresource, "iget", size, res.real, res.user, res.sys,
+                            integrity="ok", bytes=nbytes, max_rss=res.maxrss, iteration=i, local_io="null",
+                            **transferColumns()), sink)
+                        _mark(checkpoint, name, i, "iget")
+            finally:
+                # free the memory before the next file is staged
+                if localIO == "shm":
+                    os.remove(source)
+    finally:
+        if os.path.isdir(str(staging)+"/irodsperf-"+str(os.getpid())):
+            os.rmdir(staging+"/irodsperf-"+str(os.getpid()))
+
+    return result
+
+def diskBaseline(maxTimes = 4, sink = None, checkpoint = None):
+    """
+    Measures what the local disk of the test data folder can do with files of the test data sizes:
+        disk write:     writes data_disk in chunks and syncs it
+        disk read:      reads data_disk after it was dropped from the page cache
+    The rows have the operations "disk write" and "disk read" and the size labels of the transfers,
+    they go to the same result file as the transfers to compare with.
+
+    maxTimes:   times how often every file is written and read
+    sink:       results.ResultSink, every row is written as soon as it is measured
+    checkpoint: results.Checkpoint, steps ("disk", file, i, operation) done in an interrupted run are skipped
+
+    Returns a list of result rows.
+    """
+    testdata = getTestDataDir()
+
+    dataset = sorted([testdata+"/" + f
+        for f in os.listdir(testdata) if os.path.isfile(testdata+"/" + f) and f.endswith("_0")])
+
+    chunk = os.urandom(CHUNKSIZE)
+    result = []
+    for data in dataset:
+        nbytes = dataSize(data)
+        name = os.path.basename(data.split("_")[0])
+        size = name.split('.')[0][6:]
+        path = data.split("_")[0]+"_disk"
+        print "Disk baseline:", path
+        for i in range(1, maxTimes):
+            if _done(checkpoint, "disk", name, i, "disk read"):
+                continue
             date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-            print "iput", data+"_"+str(i-1), collection+"/"+os.path.basename(data)+"_"+str(i)
-            out, err, real, user, sys = iRODSput(iresource, data+"_"+str(i-1), 
-                collection+"/"+os.path.basename(data)+"_"+str(i))
-            print "integrity", collection+"/"+os.path.basename(data+"_"+str(i)), data+"_"+str(i-1)
-            if not checkIntegrity(collection+"/"+os.path.basename(data+"_"+str(i)), data+"_"+str(i-1)):
-                print "%sERROR Checksums do not match.%s" %(RED, DEFAULT)
-                raise Exception("iRODS Data integrity")
-            else:
-                print "Integrity done"
-                result.append((date, iresource, os.uname()[1], "iput", os.path.basename(data).split('.')[0][6:], real, user, sys))
-            
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            start = monotonic()
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+            written = 0
+            while written < nbytes:
+                written = written + os.write(fd, chunk[:nbytes - written])
+            os.fsync(fd)
+            os.close(fd)
+            real = monotonic() - start
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            if not _done(checkpoint, "disk", name, i, "disk write"):
+                _record(result, resultRow(date, "local", "disk write", size, real, after.ru_utime - usage.ru_utime,
+                    after.ru_stime - usage.ru_stime, bytes=nbytes, iteration=i, local_io="disk"), sink)
+                _mark(checkpoint, "disk", name, i, "disk write")
+
+            dropCache(path)
             date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-            print "iget", collection+"/"+os.path.basename(data)+"_"+str(i), data+"_"+str(i)
-            out, err, real, user, sys = iRODSget(iresource, collection+"/"+os.path.basename(data+"_"+str(i)), 
-                data+"_"+str(i))
-            print "integrity", collection+"/"+os.path.basename(data+"_"+str(i)), data+"_"+str(i)
-            if not checkIntegrity(collection+"/"+os.path.basename(data)+"_"+str(i), data+"_"+str(i)): 
-                print "%sERROR Checksums do not match.%s" %(RED, DEFAULT)
-                raise Exception("iRODS Data integrity")
-            else:
-                print "Integrity done"
-                result.append((date, iresource, os.uname()[1], "iget", os.path.basename(data).split('.')[0][6:], real, user, sys))
-    
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            start = monotonic()
+            with open(path, "rb") as f:
+                while f.read(CHUNKSIZE):
+                    pass
+            real = monotonic() - start
+            after = resource.getrusage(resource.RUSAGE_SELF)
+            _record(result, resultRow(date, "local", "disk read", size, real, after.ru_utime - usage.ru_utime,
+                after.ru_stime - usage.ru_stime, bytes=nbytes, iteration=i, local_io="disk"), sink)
+            _mark(checkpoint, "disk", name, i, "disk read")
+        if os.path.isfile(path):
+            os.remove(path)
+
     return result
 
-def performanceCollections(iresource, maxTimes = 10):
+def performanceCollections(iresource, maxTimes = 10, processes = None, sink = None, checkpoint = None, keep = None):
     """
     Tests the performance of iget and iput for single files.
     Test data needs to be stored under $HOME/testdata. The function omits subfolders.
@@ -310,48 +1318,367 @@ def performanceCollections(iresource, maxTimes = 10):
         iput folder/data_1/ --> coll/data_2/
         iget coll/data_2/ --> folder/data_2/
         ...
+    After each transfer all files are verified against a single listing of the iRODS collection,
+    mismatches are reported in the column integrity and do not stop the test.
+    With keep, old copies are removed like in performanceSingleFiles.
 
     iresource:  iRODS resource
     maxTimes:   times how often the file is transferred with iput and iget.
+    processes:  size of the process pool for the local checksums
+    sink:       results.ResultSink, every row is written as soon as it is measured
+    checkpoint: results.Checkpoint, steps (folder, i, iput/iget) done in an interrupted run are skipped
+    keep:       number of the latest copies kept locally and in iRODS (>= 1), None keeps all copies
 
-    Returns a list of tuples: [(date, resource, client, iput/iget, size, real time, user time, system time)]
+    Returns a list of result rows: [{date, resource, client, iput/iget, size, real time, user time, system time, integrity}]
     """
 
+    if keep is not None and keep < 1:
+        # keep=0 would delete coll/data_<i> before its iget
+        raise ValueError("keep must be at least 1: "+str(keep))
+
     # If there is a tmp dir, use that for transferring the data
-    if "TMPDIR" not in os.environ:
-        testdata = os.environ["HOME"]+"/testdata"
-    else:
-        testdata = os.environ["TMPDIR"]+"/testdata"
+    testdata = getTestDataDir()
 
     dataset = [testdata+"/" + f
-        for f in os.listdir(testdata) if os.path.isdir(testdata+"/" + f)]
+        for f in os.listdir(testdata) if os.path.isdir(testdata+"/" + f) and f.endswith("_0")]
 
     for data in dataset:
         # Verify that data is not empty and data is there.
-        files = [f for f in os.listdir(data) if os.path.isfile(data+"/" + f)]    
+        files = [f for _, _, fs in os.walk(data) for f in fs]
         if len(files) == 0:
             print RED, "ERROR collection empty:", data, DEFAULT
             raise Exception("No files in data collection.")
+    scratchSpace(testdata, dataset, maxTimes - 1 if keep is None else keep)
 
-    print "Create iRODS Collection PERFORMANCEC"
-    collection = iRODScreateColl("PERFORMANCEC")
+    collection = _resumeCollection("PERFORMANCEC", checkpoint)
 
     result = []
     for data in dataset:
+        nbytes = dataSize(data)
+        nfiles = len([f for _, _, fs in os.walk(data) for f in fs])
         data = data.split("_")[0] # ge base name of the folder --> no "_str(i)"
+        name = os.path.basename(data)
         print "Put and get: ", data
         for i in tqdm(range(1, maxTimes)):
-            date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-            print "iput -r", data+"_"+str(i-1), collection+"/"+os.path.basename(data)+"_"+str(i)
-            out, err, real, user, sys = iRODSput(iresource, data+"_"+str(i-1),
-                collection+"/"+os.path.basename(data)+"_"+str(i))
-            result.append((date, iresource, os.uname()[1], "iput", os.path.basename(data).split('.')[0][4:], real, user, sys))
+            source = data+"_"+str(i-1)
+            if not os.path.isdir(source):
+                # Resumed on a node without the copies of the interrupted run, data_0 has the same content
+                source = data+"_0"
+            index = None
+            if not _done(checkpoint, name, i, "iput"):
+                date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+                print "iput -r", source, collection+"/"+name+"_"+str(i)
+                res = iRODSput(iresource, source, collection+"/"+name+"_"+str(i))
+                print "integrity", collection+"/"+name+"_"+str(i), source
+                index = BACKEND.snapshot(collection+"/"+name+"_"+str(i))
+                mismatches = verifyCollection(collection+"/"+name+"_"+str(i), source, index, processes)
+                if len(mismatches) > 0:
+                    print "%sERROR Checksums do not match:%s" %(RED, DEFAULT), mismatches
+                _record(result, resultRow(date, iresource, "iput", name.split('.')[0][4:],
+                    res.real, res.user, res.sys, integrity=integrityStatus(mismatches, nfiles), bytes=nbytes,
+                    max_rss=res.maxrss, iteration=i, **transferColumns()), sink)
+                _mark(checkpoint, name, i, "iput")
+            if keep is not None:
+                _trimCopies(data, collection+"/"+name, i - keep)
 
-            date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-            print "iget -r", collection+"/"+os.path.basename(data)+"_"+str(i), data+"_"+str(i)
-            out, err, real, user, sys = iRODSget(iresource, collection+"/"+os.path.basename(data+"_"+str(i)),
-                data+"_"+str(i))
-            result.append((date, iresource, os.uname()[1], "iget", os.path.basename(data).split('.')[0][4:], real, user, sys))
+            if not _done(checkpoint, name, i, "iget"):
+                date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+                print "iget -r", collection+"/"+name+"_"+str(i), data+"_"+str(i)
+                res = iRODSget(iresource, collection+"/"+name+"_"+str(i), data+"_"+str(i))
+                # The collection did not change since the iput, reuse its listing
+                print "integrity", collection+"/"+name+"_"+str(i), data+"_"+str(i)
+                mismatches = verifyCollection(collection+"/"+name+"_"+str(i), data+"_"+str(i),
+                    index, processes)
+                if len(mismatches) > 0:
+                    print "%sERROR Checksums do not match:%s" %(RED, DEFAULT), mismatches
+                _record(result, resultRow(date, iresource, "iget", name.split('.')[0][4:],
+                    res.real, res.user, res.sys, integrity=integrityStatus(mismatches, nfiles), bytes=nbytes,
+                    max_rss=res.maxrss, iteration=i, **transferColumns()), sink)
+                _mark(checkpoint, name, i, "iget")
+
+    return result
+
+class Barrier(object):
+    """
+    Lets a fixed number of threads wait for each other (threading.Barrier is not available in python 2).
+    parties:    number of threads
+    """
+
+    def __init__(self, parties):
+        self.parties = parties
+        self.count = 0
+        self.generation = 0
+        self.condition = threading.Condition()
+
+    def wait(self):
+        with self.condition:
+            generation = self.generation
+            self.count = self.count + 1
+            if self.count == self.parties:
+                self.count = 0
+                self.generation = self.generation + 1
+                self.condition.notify_all()
+            else:
+                while generation == self.generation:
+                    self.condition.wait()
+
+def _concurrentWorker(barrier, streams, k, transfer, args):
+    """
+    Thread of performanceConcurrent, waits for all other streams and runs one transfer.
+    Stores (date, start, end, transfer result) in streams[k]. A transfer that raises an exception
+    is stored as failed command with returncode 1, the other streams go on.
+    """
+    barrier.wait()
+    date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+    start = timer()
+    try:
+        res = transfer(*args)
+    except Exception, e:
+        res = icommands.CommandResult([transfer.__name__] + list(args), 1, "", 
+            "ERROR: %s failed: %s\n" %(transfer.__name__, e), timer() - start, 0.0, 0.0, "")
+    streams[k] = (date, start, timer(), res)
+
+def _concurrentTransfers(n, transfer, argsList):
+    """
+    Starts n transfers in n threads at the same time.
+    Returns a list of (date, start, end, transfer result) per stream.
+    """
+    barrier = Barrier(n)
+    streams = [None] * n
+    threads = [threading.Thread(target=_concurrentWorker, args=(barrier, streams, k, transfer, argsList[k]))
+        for k in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return streams
+
+def performanceConcurrent(iresource, levels = [1, 2, 4, 8], maxTimes = 4, sink = None, checkpoint = None):
+    """
+    Tests the aggregate throughput of iput and iget with several clients writing to and 
+    reading from the same resource at once.
+    For every concurrency level n, n threads upload distinct copies of a test file at the same time,
+    the streams wait for each other at a barrier before they start. Afterwards the n uploaded 
+    data objects are downloaded the same way.
+        iput folder/data_s<k> --> coll/data_n<n>_<i>_<k>     k = 0 .. n-1 at once
+        iget coll/data_n<n>_<i>_<k> --> folder/data_n<n>s<k>
+    The downloads and data objects of a repetition are removed once they are verified, the
+    copies data_s<k> once all levels are done. A stream that fails is recorded with integrity
+    "transfer failed".
+
+    iresource:  iRODS resource
+    levels:     list of numbers of concurrent streams
+    maxTimes:   times how often the transfers are repeated per level.
+    sink:       results.ResultSink, every row is written as soon as it is measured
+    checkpoint: results.Checkpoint, steps (file, n, i, iput/iget) done in an interrupted run are skipped
+
+    Returns a list of result rows, one per stream with stream=<k> and one for all streams with 
+    stream="all", real time = time from the first start to the last end and bytes = total bytes.
+    """
+
+    # If there is a tmp dir, use that for transferring the data
+    testdata = getTestDataDir()
+
+    dataset = [testdata+"/" + f
+        for f in os.listdir(testdata) if os.path.isfile(testdata+"/" + f) and f.endswith("_0")]
+
+    collection = _resumeCollection("PERFORMANCEN", checkpoint)
+
+    result = []
+    for data in dataset:
+        nbytes = dataSize(data)
+        size = os.path.basename(data).split('.')[0][6:]
+        data = data.split("_")[0] # ge base name of the file --> no "_str(i)"
+
+        # Distinct source files per stream, the streams must not share the page cache
+        print "Create", max(levels), "copies of", data
+        scratchSpace(testdata, [data+"_0"], 2 * max(levels) - 1)
+        sources = [data+"_0"]
+        for k in range(1, max(levels)):
+            shutil.copyfile(data+"_0", data+"_s"+str(k))
+            sources.append(data+"_s"+str(k))
+
+        for n in levels:
+            print "Put and get: ", data, "with", n, "streams"
+            for i in tqdm(range(1, maxTimes)):
+                objects = [collection+"/"+os.path.basename(data)+"_n"+str(n)+"_"+str(i)+"_"+str(k) 
+                    for k in range(n)]
+                for operation, transfer, argsList in [
+                        ("iput", iRODSput, [(iresource, sources[k], objects[k]) for k in range(n)]),
+                        ("iget", iRODSget, [(iresource, objects[k], data+"_n"+str(n)+"s"+str(k)) 
+                            for k in range(n)])]:
+                    if _done(checkpoint, os.path.basename(data), n, i, operation):
+                        continue
+                    print operation, n, "streams"
+                    streams = _concurrentTransfers(n, transfer, argsList)
+
+                    index = BACKEND.snapshot(collection)
+                    mismatches = []
+                    for k, (date, start, end, res) in enumerate(streams):
+                        local = argsList[k][1] if operation == "iput" else argsList[k][2]
+                        if res.returncode != 0:
+                            print "%sERROR transfer failed:%s" %(RED, DEFAULT), objects[k], res.err.strip()
+                            integrity = "transfer failed"
+                            mismatches.append((os.path.basename(objects[k]), integrity))
+                        elif checkIntegrity(objects[k], local, index):
+                            integrity = "ok"
+                        else:
+                            print "%sERROR Checksums do not match:%s" %(RED, DEFAULT), objects[k], local
+                            integrity = "checksum mismatch"
+                            mismatches.append((os.path.basename(objects[k]), integrity))
+                        _record(result, resultRow(date, iresource, operation, size, res.real, res.user, res.sys,
+                            integrity=integrity, bytes=nbytes, concurrency=n, stream=k, max_rss=res.maxrss,
+                            iteration=i), sink)
+
+                    span = max([end for _, _, end, _ in streams]) - min([start for _, start, _, _ in streams])
+                    print "%s aggregate: %.3f GB/s" %(operation, n * nbytes / span / 1024.**3)
+                    _record(result, resultRow(streams[0][0], iresource, operation, size, span,
+                        sum([res.user for _, _, _, res in streams]), sum([res.sys for _, _, _, res in streams]),
+                        integrity=integrityStatus(mismatches, n), bytes=n * nbytes, concurrency=n, 
+                        stream="all", iteration=i), sink)
+                    _mark(checkpoint, os.path.basename(data), n, i, operation)
+                    if operation == "iget":
+                        for k in range(n):
+                            _removeCopy(argsList[k][2], objects[k])
+
+        for source in sources[1:]:
+            _removeCopy(source)
+
+    return result
+
+def _smallFilesTree(testdata, size, count, seed):
+    """
+    Creates (once) the folder Coll<size>_0 with <count> files of <size>, 1000 files per sub folder.
+    Returns the list of files relative to the folder.
+    """
+    folder = testdata+"/Coll"+size+"_0"
+    files = [os.path.relpath(path, folder) for path, _ in testDataLayout(testdata,
+        {"folders": [{"size": size, "count": count, "subfolders": max(1, count // 1000)}]})]
+    if not all([os.path.isfile(folder+"/"+f) for f in files]):
+        shutil.rmtree(folder, ignore_errors=True)
+        createTestData(testdata, {"folders": [{"size": size, "count": count, "subfolders": max(1, count // 1000)}]}, 
+            seed)
+    return sorted(files)
+
+def performanceSmallFiles(iresource, sizes = ["1K", "64K", "1M"], count = 1000, maxTimes = 2, seed = None,
+        sink = None, checkpoint = None):
+    """
+    Tests the performance of iget and iput for many small files, where the overhead per file
+    (connection, authentication, catalog) dominates the transfer time.
+    Test data is created in $TMPDIR/testdata-small (or $HOME/testdata-small): 
+    one folder with <count> files per size.
+    For every size the files are
+        1) transferred one by one:      iput folder/file --> coll/file, iget coll/file --> folder_i/file
+        2) transferred in bulk:         iput -r -b folder --> coll_bulk, iget -r coll_bulk --> folder_bulk
+    The catalog time per file is estimated from the same transfers with empty files,
+    the data time is the remaining time.
+
+    iresource:  iRODS resource
+    sizes:      list of file sizes
+    count:      number of files per size
+    maxTimes:   times how often the files are transferred with iput and iget.
+    seed:       seed of the test data, see createTestData
+    sink:       results.ResultSink, rows are written as soon as a pass over all files is verified
+    checkpoint: results.Checkpoint, steps (size, i, iput/iget[, bulk]) done in an interrupted run are skipped
+
+    Returns a list of result rows:
+        one per file:           stream=<number of the file>, files=1
+        one per size and round: stream="all", files=<count>, real time = sum of all files
+        bulk transfer:          stream="bulk", files=<count>
+    catalog time is the estimated catalog and connection time of the row. The rows "all" sum up
+    the rows of the files, they have no sampler and profile columns (see transferColumns).
+    """
+    if count < 1:
+        raise ValueError("count must be at least 1: "+str(count))
+
+    testdata = getTestDataDir()+"-small"
+    if not os.path.isdir(testdata):
+        os.makedirs(testdata)
+
+    collection = _resumeCollection("PERFORMANCES", checkpoint)
+
+    result = []
+    catalog = {}    # median time per empty file: {iput/iget: seconds}
+    if checkpoint is not None:
+        catalog = checkpoint.get("catalog time", {})
+    for size in ["0K"] + sizes:
+        files = _smallFilesTree(testdata, size, count, seed)
+        folder = testdata+"/Coll"+size+"_0"
+        nbytes = parseSize(size)
+        # The empty files only measure the catalog time, they are transferred one by one in the first round
+        rounds = range(1, 2) if size == "0K" else range(1, maxTimes)
+
+        for i in rounds:
+            icoll = collection+"/Coll"+size+"_"+str(i)
+            local = testdata+"/Coll"+size+"_"+str(i)
+            BACKEND.mkdir(icoll)
+            for sub in sorted(set([os.path.dirname(f) for f in files])):
+                BACKEND.mkdir(icoll+"/"+sub)
+
+            for operation in ["iput", "iget"]:
+                if _done(checkpoint, size, i, operation):
+                    continue
+                print operation, count, "files of", size, "one by one"
+                latencies = []
+                rows = []
+                for k, f in enumerate(tqdm(files)):
+                    date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+                    if operation == "iput":
+                        res = iRODSput(iresource, folder+"/"+f, icoll+"/"+f)
+                    else:
+                        if not os.path.isdir(os.path.dirname(local+"/"+f)):
+                            os.makedirs(os.path.dirname(local+"/"+f))
+                        res = iRODSget(iresource, icoll+"/"+f, local+"/"+f)
+                    if res.returncode != 0:
+                        print RED, res.err, DEFAULT
+                    latencies.append(res.real)
+                    rows.append(resultRow(date, iresource, operation, size, res.real, res.user, res.sys, 
+                        integrity="failed" if res.returncode != 0 else "", bytes=nbytes, files=1, stream=k, 
+                        max_rss=res.maxrss, iteration=i, **transferColumns()))
+
+                if size == "0K":
+                    catalog[operation] = percentile(latencies, 50)
+                    print "%s catalog time per file: %.4f s" %(operation, catalog[operation])
+                    if checkpoint is not None:
+                        checkpoint.set("catalog time", catalog)
+
+                mismatches = verifyCollection(icoll, folder if operation == "iput" else local)
+                failed = set([rel for rel, _ in mismatches])
+                mismatches.extend([(f, "transfer failed") for f, row in zip(files, rows)
+                    if row["integrity"] == "failed" and f not in failed])
+                for f, row in zip(files, rows):
+                    row["integrity"] = "failed" if f in failed or row["integrity"] == "failed" else "ok"
+                    row["catalog time"] = min(catalog[operation], row["real time"])
+                    _record(result, row, sink)
+                _record(result, resultRow(rows[0]["date"], iresource, operation, size, sum(latencies), 
+                    sum([row["user time"] for row in rows]), sum([row["system time"] for row in rows]),
+                    integrity=integrityStatus(mismatches, count), bytes=nbytes * count, files=count, stream="all",
+                    catalog_time=min(catalog[operation] * count, sum(latencies)), iteration=i), sink)
+                _mark(checkpoint, size, i, operation)
+
+                print "%s %s: %.1f files/s, latency p50 %.4f s, p95 %.4f s, p99 %.4f s, catalog %.0f%%" %(
+                    operation, size, count / sum(latencies), percentile(latencies, 50), percentile(latencies, 95),
+                    percentile(latencies, 99), 100. * min(catalog[operation] * count, sum(latencies)) / sum(latencies))
+
+            if size == "0K":
+                continue
+
+            # The whole folder in one iput -r / iget -r
+            for operation in ["iput", "iget"]:
+                if _done(checkpoint, size, i, operation, "bulk"):
+                    continue
+                print operation, "-r", count, "files of", size
+                date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+                if operation == "iput":
+                    res = iRODSput(iresource, folder, icoll+"_bulk")
+                    mismatches = verifyCollection(icoll+"_bulk", folder)
+                else:
+                    res = iRODSget(iresource, icoll+"_bulk", local+"_bulk")
+                    mismatches = verifyCollection(icoll+"_bulk", local+"_bulk")
+                _record(result, resultRow(date, iresource, operation, size, res.real, res.user, res.sys,
+                    integrity=integrityStatus(mismatches, count), bytes=nbytes * count, files=count, 
+                    stream="bulk", max_rss=res.maxrss, iteration=i, **transferColumns()), sink)
+                _mark(checkpoint, size, i, operation, "bulk")
+                print "%s -r %s: %.1f files/s" %(operation, size, count / res.real)
 
-    #TODO:Integrity checks
     return result
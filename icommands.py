@@ -0,0 +1,301 @@
+"""
+Runs icommands without a shell and measures them.
+The wall clock time is taken from a monotonic clock, user time, system time and the
+peak memory of the child process from its resource usage (os.wait4).
+
+Every command runs in its own process group, a Runner kills the whole group when the command
+exceeds its timeout or is cancelled: SIGTERM first, SIGKILL after a grace period. Killed commands
+return the returncode TIMEOUT or CANCELLED. A Runner limits the number of commands running at 
+the same time, run, runMany and cancel use the shared RUNNER.
+"""
+
+import os
+import sys
+import time
+import errno
+import signal
+import ctypes
+import tempfile
+import threading
+import subprocess
+from collections import namedtuple
+
+# real, user, sys in seconds, maxrss in kilobytes
+CommandResult = namedtuple("CommandResult", ["argv", "returncode", "out", "err", "real", "user", "sys", "maxrss"])
+
+TIMEOUT     = 124   # returncode of a command killed after its timeout, like timeout(1)
+CANCELLED   = 130   # returncode of a cancelled command, 128 + SIGINT like in a shell
+GRACE       = 5     # seconds between SIGTERM and SIGKILL
+
+class _timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+CLOCK_MONOTONIC = 1
+
+def _clockMonotonic():
+    """
+    clock_gettime(CLOCK_MONOTONIC) for python 2, which has no time.monotonic.
+    """
+    t = _timespec()
+    if _librt.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+        raise OSError(ctypes.get_errno(), "clock_gettime failed")
+    return t.tv_sec + t.tv_nsec * 1e-9
+
+try:
+    from time import monotonic
+except ImportError:
+    _librt = ctypes.CDLL("librt.so.1", use_errno=True)
+    monotonic = _clockMonotonic
+
+# waitid(2): idtype, options and the size of siginfo_t
+P_PID       = 1
+WEXITED     = 4
+WNOWAIT     = 0x01000000
+SIGINFO_SIZE = 128
+
+_libc = ctypes.CDLL("libc.so.6", use_errno=True)
+
+def _waitExit(pid):
+    """
+    Waits until a child process ended without reaping it (waitid with WNOWAIT, python 2 has no
+    os.waitid), its /proc/<pid> entries stay readable until _wait.
+    """
+    info = ctypes.create_string_buffer(SIGINFO_SIZE)
+    while _libc.waitid(P_PID, pid, info, WEXITED | WNOWAIT) != 0:
+        code = ctypes.get_errno()
+        if code != errno.EINTR:
+            raise OSError(code, os.strerror(code))
+
+def _wait(pid):
+    """
+    Waits for a child process, returns (exit code, resource usage).
+    """
+    while True:
+        try:
+            _, status, usage = os.wait4(pid, 0)
+            break
+        except OSError, e:
+            if e.errno != errno.EINTR:
+                raise
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status), usage
+    return os.WEXITSTATUS(status), usage
+
+def stopMonitors(monitors):
+    """
+    Stops the started monitors, each once: they are removed from the list.
+    """
+    while len(monitors) > 0:
+        monitors.pop(0).stop()
+
+def _signalGroup(pid, signum):
+    try:
+        os.killpg(pid, signum)
+    except OSError, e:
+        # the group is gone
+        if e.errno != errno.ESRCH:
+            raise
+
+class Runner(object):
+    """
+    Runs commands, at most limit at the same time, and kills them after their timeout or on cancel.
+    limit:  number of commands running at the same time, None for no limit
+    grace:  seconds a command has to exit after SIGTERM before it is killed with SIGKILL
+    """
+
+    def __init__(self, limit=None, grace=GRACE):
+        self.grace = grace
+        self.setLimit(limit)
+        self.lock = threading.Lock()
+        self.running = {}   # pid --> [None while running, "timeout" or "cancelled" once killed, reaped event]
+        self.cancelled = False
+
+    def setLimit(self, limit):
+        """
+        Sets the number of commands running at the same time, before the runner is used.
+        """
+        self.limit = limit
+        self.slots = threading.Semaphore(limit) if limit else None
+
+    def _kill(self, pids, reason):
+        """
+        Sends SIGTERM to the process groups, waits up to grace seconds for them to end and kills
+        the remaining groups with SIGKILL.
+        """
+        reaped = {}
+        with self.lock:
+            for pid in pids:
+                # a reaped process is no longer in running, its pid may be reused
+                if pid in self.running and self.running[pid][0] is None:
+                    self.running[pid][0] = reason
+                    reaped[pid] = self.running[pid][1]
+                    _signalGroup(pid, signal.SIGTERM)
+        deadline = monotonic() + self.grace
+        for pid, event in reaped.items():
+            event.wait(max(0, deadline - monotonic()))
+        with self.lock:
+            for pid in reaped:
+                if pid in self.running:
+                    _signalGroup(pid, signal.SIGKILL)
+
+    def run(self, argv, monitors=(), consume=None, timeout=None):
+        """
+        Runs a command and waits for it.
+        argv:       command as list, e.g. ["iput", "-f", "data", "coll/data"]
+        monitors:   objects with the methods start(pid) and stop(), started after the command
+                    and stopped when it ended, e.g. sampler.ThroughputSampler
+        consume:    function reading the standard output of the command from a pipe while it runs, 
+                    e.g. the data of iget <object> -. out of the result is empty then.
+        timeout:    seconds after which the command is killed, None for no limit
+
+        Returns a CommandResult. If the command cannot be started the returncode is 127, a killed
+        command returns TIMEOUT or CANCELLED; err starts with "ERROR" like the error messages of the 
+        icommands then.
+        """
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            return self._run(argv, monitors, consume, timeout)
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+
+    def _run(self, argv, monitors, consume, timeout):
+        if self.cancelled:
+            return CommandResult(argv, CANCELLED, "", "ERROR: %s cancelled\n" %argv[0], 0.0, 0.0, 0.0, 0)
+        # Temporary files instead of pipes: no deadlock on large outputs and the process
+        # can be reaped with wait4 to get its resource usage.
+        out = tempfile.TemporaryFile()
+        err = tempfile.TemporaryFile()
+        start = monotonic()
+        try:
+            # own process group, a kill reaches the command and all processes it started
+            p = subprocess.Popen(argv, stdout=out if consume is None else subprocess.PIPE, stderr=err, 
+                close_fds=True, preexec_fn=os.setpgrp)
+        except OSError, e:
+            return CommandResult(argv, 127, "", "ERROR: cannot execute %s: %s\n" %(argv[0], e.strerror),
+                monotonic() - start, 0.0, 0.0, 0)
+        with self.lock:
+            self.running[p.pid] = [None, threading.Event()]
+        if self.cancelled:
+            self._kill([p.pid], "cancelled")
+        timer = None
+        if timeout is not None:
+            timer = threading.Timer(timeout, self._kill, ([p.pid], "timeout"))
+            timer.daemon = True
+            timer.start()
+        started = []
+        try:
+            try:
+                for monitor in monitors:
+                    monitor.start(p.pid)
+                    started.append(monitor)
+                if consume is not None:
+                    reader = threading.Thread(target=consume, args=(p.stdout,))
+                    reader.daemon = True
+                    reader.start()
+                if len(started) > 0:
+                    # the monitors read the counters of the process (/proc/<pid>/io), they are gone once it is reaped
+                    _waitExit(p.pid)
+                    stopMonitors(started)
+                returncode, usage = _wait(p.pid)
+            except BaseException:
+                # a failed monitor, KeyboardInterrupt or SystemExit of the test: the command must not outlive it
+                _signalGroup(p.pid, signal.SIGKILL)
+                _wait(p.pid)
+                with self.lock:
+                    self.running.pop(p.pid)[1].set()
+                raise
+            finally:
+                if timer is not None:
+                    timer.cancel()
+        finally:
+            # no sampler or profiler thread outlives a failed command
+            stopMonitors(started)
+        with self.lock:
+            killed, reaped = self.running.pop(p.pid)
+            reaped.set()
+        if timer is not None:
+            # a timer that fired ends with the command
+            timer.join()
+        if consume is not None:
+            reader.join()
+            p.stdout.close()
+        real = monotonic() - start
+        # Popen must not wait for the already reaped process
+        p.returncode = returncode
+
+        out.seek(0)
+        err.seek(0)
+        stderr = err.read()
+        if killed == "timeout":
+            returncode, stderr = TIMEOUT, "ERROR: %s killed after the timeout of %g s\n" %(argv[0], timeout) + stderr
+        elif killed == "cancelled":
+            returncode, stderr = CANCELLED, "ERROR: %s cancelled\n" %argv[0] + stderr
+        result = CommandResult(argv, returncode, out.read(), stderr, real,
+            usage.ru_utime, usage.ru_stime, usage.ru_maxrss)
+        out.close()
+        err.close()
+        return result
+
+    def runMany(self, commands, timeout=None):
+        """
+        Runs commands concurrently, at most limit at the same time.
+        commands:   list of argv
+        Returns the CommandResults in the order of the commands.
+        """
+        results = [None] * len(commands)
+        def _worker(k):
+            results[k] = self.run(commands[k], timeout=timeout)
+        threads = [threading.Thread(target=_worker, args=(k,)) for k in range(len(commands))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        try:
+            for t in threads:
+                # join with a timeout, python 2 delivers no signals during a plain join
+                while t.is_alive():
+                    t.join(1)
+        except BaseException:
+            self.cancel()
+            raise
+        return results
+
+    def cancel(self):
+        """
+        Kills all running commands, commands started afterwards return CANCELLED at once.
+        """
+        self.cancelled = True
+        with self.lock:
+            pids = list(self.running)
+        self._kill(pids, "cancelled")
+
+# Runner of run, runMany and cancel
+RUNNER = Runner()
+
+def run(argv, monitors=(), consume=None, timeout=None):
+    """
+    Runs a command with the shared RUNNER and waits for it, see Runner.run.
+    """
+    return RUNNER.run(argv, monitors, consume, timeout)
+
+def runMany(commands, timeout=None):
+    """
+    Runs commands concurrently with the shared RUNNER, see Runner.runMany.
+    """
+    return RUNNER.runMany(commands, timeout)
+
+def cancel():
+    """
+    Kills all commands of the shared RUNNER, e.g. when the test is terminated.
+    """
+    RUNNER.cancel()
+
+def terminate(signum, frame):
+    """
+    Signal handler that kills the running commands and exits, the icommands run in their own 
+    process groups and would outlive the test otherwise:
+        signal.signal(signal.SIGTERM, icommands.terminate)
+    """
+    cancel()
+    sys.exit(128 + signum)
@@ -0,0 +1,364 @@
+"""
+Runs a performance test on several nodes at the same time, like the production jobs that load a
+resource from many compute nodes at once.
+
+The scenario (json) lists the workers and the test they run:
+    {
+        "runDir":   "/home/<user>/runs/pocCompound-4nodes",
+        "resource": "pocCompound",
+        "test":     "single",
+        "options":  {"maxTimes": 3},
+        "backend":  "icommands",
+        "backendOptions": {},
+        "generate": {"seed": 2017},
+        "delay":    5,
+        "timeout":  600,
+        "workers":  [
+            {"name": "lisa1", "host": "lisa1.nikhef.nl"},
+            {"name": "lisa2", "host": "lisa2.nikhef.nl"},
+            {"name": "local1", "host": "local", "env": {"TMPDIR": "/scratch/local1"}}
+        ]
+    }
+    runDir:     folder shared by all nodes (e.g. in the home directory), it holds the barrier files,
+                the log and result file of every worker and the aggregated results.csv
+    test:       single, collections, concurrent or smallfiles, see TESTS; options are passed to the test
+    backend:    see backends.createBackend
+    generate:   options of iRODStestFunctions.createTestData, every worker creates its test data
+                before the start, omit it if the test data exists
+    delay:      seconds between the last worker being ready and the common start
+    timeout:    seconds to wait for all workers to become ready
+    workers:    host "local" starts a process on this node, other hosts are started with ssh and need
+                this folder at the same path; env sets environment variables of the worker.
+                The clocks of the nodes must be synchronised (ntp).
+                Every worker needs its own test data folder, $TMPDIR/testdata: without TMPDIR in env it
+                is <runDir>/<name>. The same TMPDIR on several hosts must be a node local folder.
+
+Start barrier: every worker writes <runDir>/<name>.ready when its test data is in place and waits for
+<runDir>/go, which the orchestrator writes when all workers are ready. It contains the start time
+(seconds since the epoch), all workers sleep until then and start their transfers together.
+The result rows of the workers are tagged with the columns node and start and collected in
+<runDir>/results.csv.
+
+    python orchestrator.py [--db <sqlite file>] <scenario json>
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import getopt
+import signal
+import icommands
+import subprocess
+from timeit import default_timer as timer
+
+from iRODStestFunctions import performanceSingleFiles, performanceCollections, performanceConcurrent
+from iRODStestFunctions import performanceSmallFiles, createTestData, setBackend
+from backends import createBackend
+from results import ResultSink, ResultStore
+
+RED     = "\033[31m"
+GREEN   = "\033[92m"
+BLUE    = "\033[34m"
+DEFAULT = "\033[0m"
+
+# Tests a worker can run: name --> function(iresource, sink=..., **options)
+TESTS = {
+    "single":       performanceSingleFiles,
+    "collections":  performanceCollections,
+    "concurrent":   performanceConcurrent,
+    "smallfiles":   performanceSmallFiles,
+}
+
+POLL = 0.1     # seconds between two checks of the barrier files
+
+def loadScenario(path):
+    """
+    Reads a scenario and fills in the defaults.
+    """
+    with open(path) as f:
+        scenario = json.load(f)
+    for key in ["runDir", "resource", "workers"]:
+        if key not in scenario:
+            raise ValueError("Scenario without "+key)
+    if scenario.get("test", "single") not in TESTS:
+        raise ValueError("Unknown test: "+str(scenario.get("test")))
+    names = [worker["name"] for worker in scenario["workers"]]
+    if len(set(names)) != len(names):
+        raise ValueError("Worker names are not unique: "+", ".join(names))
+    defaults = {"test": "single", "options": {}, "backend": "icommands", "backendOptions": {},
+        "generate": None, "delay": 5, "timeout": 600}
+    defaults.update(scenario)
+    defaults["runDir"] = os.path.abspath(defaults["runDir"])
+
+    # Workers sharing a test data folder would overwrite each other's files and copies
+    folders = {}
+    for worker in defaults["workers"]:
+        env = worker.setdefault("env", {})
+        env.setdefault("TMPDIR", defaults["runDir"]+"/"+worker["name"])
+        key = (worker.get("host", "local"), env["TMPDIR"])
+        if key in folders:
+            raise ValueError("Workers %s and %s share the test data folder %s on %s" %(folders[key],
+                worker["name"], env["TMPDIR"], key[0]))
+        folders[key] = worker["name"]
+    return defaults
+
+def _writeAtomic(path, text):
+    # the other nodes see the file complete or not at all
+    with open(path+".tmp", "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(path+".tmp", path)
+
+class TaggedSink(object):
+    """
+    Adds constant columns to every row before it is written to a results.ResultSink.
+    """
+
+    def __init__(self, sink, **columns):
+        self.sink = sink
+        self.columns = columns
+
+    def append(self, row):
+        row = dict(row)
+        row.update(self.columns)
+        self.sink.append(row)
+
+def waitForStart(runDir, name):
+    """
+    Start barrier of a worker: reports ready, waits for the go file and sleeps until its start time.
+    Returns the start time, None if the run was aborted.
+    """
+    _writeAtomic(runDir+"/"+name+".ready", str(time.time()))
+    while not os.path.isfile(runDir+"/go"):
+        if os.path.isfile(runDir+"/abort"):
+            return None
+        time.sleep(POLL)
+    with open(runDir+"/go") as f:
+        start = float(f.read())
+    time.sleep(max(0, start - time.time()))
+    return start
+
+def runWorker(scenario, name):
+    """
+    Runs the test of one worker, writes <runDir>/<name>.csv.
+    Returns the exit status of the worker process.
+    """
+    runDir = scenario["runDir"]
+    if not os.path.isdir(os.environ["TMPDIR"]):
+        os.makedirs(os.environ["TMPDIR"])
+    setBackend(createBackend(scenario["backend"], **scenario["backendOptions"]))
+    if scenario["generate"] is not None:
+        createTestData(**scenario["generate"])
+
+    sink = ResultSink(runDir+"/"+name+".csv")
+    start = waitForStart(runDir, name)
+    if start is None:
+        print "%sRun aborted before the start%s" %(RED, DEFAULT)
+        sink.close()
+        return 1
+    print "%sStart%s" %(GREEN, DEFAULT), name, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start))
+    try:
+        TESTS[scenario["test"]](scenario["resource"], sink=TaggedSink(sink, node=name, start=start),
+            **scenario["options"])
+    finally:
+        sink.close()
+    return 0
+
+def _workerCommand(scenarioPath, worker):
+    command = [sys.executable, os.path.abspath(__file__), "--worker", worker["name"],
+        os.path.abspath(scenarioPath)]
+    if worker.get("host", "local") == "local":
+        return command
+    # remote: same paths on a shared file system, python from the PATH of the node
+    env = " ".join(["%s=%s" %(key, value) for key, value in sorted(worker.get("env", {}).items())])
+    return ["ssh", "-o", "BatchMode=yes", worker["host"], "cd %s && %s %s" %(os.path.dirname(command[1]),
+        env, " ".join(["python"] + command[1:]))]
+
+def launchWorkers(scenarioPath, scenario):
+    """
+    Starts all workers, their output goes to <runDir>/<name>.log.
+    Returns {name: subprocess.Popen}
+    """
+    processes = {}
+    for worker in scenario["workers"]:
+        env = dict(os.environ)
+        if worker.get("host", "local") == "local":
+            env.update(dict([(key, str(value)) for key, value in worker.get("env", {}).items()]))
+        log = open(scenario["runDir"]+"/"+worker["name"]+".log", "w")
+        processes[worker["name"]] = subprocess.Popen(_workerCommand(scenarioPath, worker), stdout=log,
+            stderr=subprocess.STDOUT, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+        log.close()
+    return processes
+
+class RunAborted(Exception):
+    """
+    The workers did not start, the message tells why.
+    """
+
+def _abort(runDir, processes, reason):
+    _writeAtomic(runDir+"/abort", reason)
+    for process in processes.values():
+        if process.poll() is None:
+            process.terminate()
+    raise RunAborted(reason)
+
+def startBarrier(scenario, processes):
+    """
+    Waits until all workers are ready and writes the go file with the common start time.
+    Aborts the run if a worker exits or the timeout passes before.
+    Returns the start time.
+    """
+    runDir = scenario["runDir"]
+    deadline = timer() + scenario["timeout"]
+    waiting = set(processes)
+    while len(waiting) > 0:
+        waiting = set([name for name in waiting if not os.path.isfile(runDir+"/"+name+".ready")])
+        failed = [name for name in waiting if processes[name].poll() is not None]
+        if len(failed) > 0:
+            _abort(runDir, processes, "Workers exited before the start: "+", ".join(sorted(failed)))
+        if timer() > deadline:
+            _abort(runDir, processes, "Workers not ready after %d s: %s" %(scenario["timeout"],
+                ", ".join(sorted(waiting))))
+        time.sleep(POLL)
+    start = time.time() + scenario["delay"]
+    _writeAtomic(runDir+"/go", repr(start))
+    return start
+
+def collectResults(scenario, database=None):
+    """
+    Merges the result files of the workers into <runDir>/results.csv (and the database).
+    Returns the list of rows.
+    """
+    rows = []
+    for worker in scenario["workers"]:
+        path = scenario["runDir"]+"/"+worker["name"]+".csv"
+        if not os.path.isfile(path):
+            print "%sNo results of worker%s" %(RED, DEFAULT), worker["name"]
+            continue
+        with open(path) as f:
+            rows.extend(list(csv.DictReader(f)))
+
+    store = None if database is None else ResultStore(database)
+    sink = ResultSink(scenario["runDir"]+"/results.csv", store=store)
+    for row in rows:
+        sink.append(row)
+    sink.close()
+    if store is not None:
+        store.close()
+    return rows
+
+def jainIndex(values):
+    """
+    Jain's fairness index of a list of throughputs: 1 if all are equal, 1/n if one gets everything.
+    """
+    if len(values) == 0 or sum(values) == 0:
+        return None
+    return sum(values) ** 2 / (len(values) * sum([v ** 2 for v in values]))
+
+def aggregate(rows, wall=None):
+    """
+    Computes the throughput per node and direction and the fairness between the nodes.
+    rows:   result rows with the columns node, bytes and real time. Rows for all streams of a
+            concurrent test (stream "all") are skipped, their streams are counted.
+    wall:   seconds from the start to the end of the slowest worker
+    Returns {operation: {"nodes": {node: MB/s}, "total MB/s": sum over the nodes,
+                         "fairness": jainIndex, "bytes": total bytes}}
+            and for wall the key "all" with the bytes of both directions per second of the run.
+    """
+    transferred = {}    # operation --> node --> [bytes, seconds]
+    for row in rows:
+        if str(row.get("stream", "")) == "all" or not row.get("bytes") or not row.get("real time"):
+            continue
+        node = transferred.setdefault(row["iget/iput"], {}).setdefault(row["node"], [0, 0.0])
+        node[0] = node[0] + int(float(row["bytes"]))
+        node[1] = node[1] + float(row["real time"])
+
+    report = {}
+    for operation, nodes in transferred.items():
+        rates = dict([(node, nbytes / 1024. ** 2 / seconds) for node, (nbytes, seconds) in nodes.items()
+            if seconds > 0])
+        report[operation] = {"nodes": rates, "total MB/s": sum(rates.values()),
+            "fairness": jainIndex(list(rates.values())), "bytes": sum([n for n, _ in nodes.values()])}
+    if wall is not None and wall > 0:
+        nbytes = sum([report[operation]["bytes"] for operation in report])
+        report["all"] = {"bytes": nbytes, "total MB/s": nbytes / 1024. ** 2 / wall}
+    return report
+
+def printReport(report):
+    for operation in sorted([op for op in report if op != "all"]):
+        entry = report[operation]
+        print "%s%s%s: %.1f MB/s from %d nodes, fairness %.3f" %(BLUE, operation, DEFAULT,
+            entry["total MB/s"], len(entry["nodes"]), entry["fairness"] or 0)
+        for node in sorted(entry["nodes"]):
+            print "    %s: %.1f MB/s" %(node, entry["nodes"][node])
+    if "all" in report:
+        print "%sall%s: %.1f MB/s over the whole run" %(BLUE, DEFAULT, report["all"]["total MB/s"])
+
+def orchestrate(scenarioPath, database=None):
+    """
+    Runs a scenario: launches the workers, starts them together, waits for them and
+    aggregates their results.
+    Returns (rows, report), see aggregate.
+    """
+    scenario = loadScenario(scenarioPath)
+    runDir = scenario["runDir"]
+    if not os.path.isdir(runDir):
+        os.makedirs(runDir)
+    for f in os.listdir(runDir):
+        if f in ["go", "abort"] or f.endswith(".ready"):
+            os.remove(runDir+"/"+f)
+
+    print "Launching", len(scenario["workers"]), "workers, logs in", runDir
+    processes = launchWorkers(scenarioPath, scenario)
+    start = startBarrier(scenario, processes)
+    print "%sAll workers ready, start at%s" %(GREEN, DEFAULT), time.strftime("%H:%M:%S", time.localtime(start))
+
+    failed = []
+    for name, process in sorted(processes.items()):
+        if process.wait() != 0:
+            failed.append(name)
+    wall = time.time() - start
+    if len(failed) > 0:
+        print "%sWorkers failed:%s" %(RED, DEFAULT), ", ".join(failed), "- see their logs in", runDir
+
+    rows = collectResults(scenario, database)
+    report = aggregate(rows, wall)
+    printReport(report)
+    return rows, report
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "worker=", "db="])
+    except getopt.error, msg:
+        print msg
+        print "for help use --help"
+        sys.exit(2)
+
+    worker = None
+    database = None
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print __doc__
+            sys.exit(0)
+        elif o == "--worker":
+            worker = a
+        elif o == "--db":
+            database = a
+    if len(args) != 1:
+        print __doc__
+        sys.exit(2)
+
+    if worker is not None:
+        signal.signal(signal.SIGTERM, icommands.terminate)
+        sys.exit(runWorker(loadScenario(args[0]), worker))
+    try:
+        orchestrate(args[0], database)
+    except RunAborted, e:
+        print "%sRun aborted:%s" %(RED, DEFAULT), e
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
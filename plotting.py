@@ -5,8 +5,14 @@ Script to convert and plot the data collected  during the iRODS performance test
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.cbook as cbook
+import io
 import os
+import re
+import time
 import numpy
+import multiprocessing
+from results import ResultStore
+from analysis import summarize, errorBars, exportSummary, GROUP_COLUMNS
 
 # Read in a list of outputfiles
 def readData(files):
@@ -14,159 +20,374 @@ def readData(files):
     files:  List of output files, formatted as csv
             Header:     date, resource, client, iput/iget, size, real time, user time, system time
     
-    The columns '* time' are given in the format XmX.Xs. The function converts them to seconds.
+    The columns '* time' are given in seconds, older result files use the format XmX.Xs. 
+    The function converts them to seconds, see prepareData.
     """
 
     #read data in
     dataFrames = []
     for csvFile in files:
-        dataFrames.append(pd.read_csv(csvFile))
+        dataFrame = pd.read_csv(csvFile)
+        dataFrame['source'] = csvFile
+        dataFrames.append(dataFrame)
 
     #stack the dataframes
     data = pd.concat(dataFrames)
     data = data.reset_index(drop=True)
 
-    #reformat the columns real time, user time, system time: XmX.Xs --> X (in seconds)
-    data['real time'] = data['real time'].apply(lambda x: 
-        pd.to_numeric(x.split("m")[0])*60+pd.to_numeric(x.split("m")[1].strip('s')))
-    data['user time'] = data['user time'].apply(lambda x:
-        pd.to_numeric(x.split("m")[0])*60+pd.to_numeric(x.split("m")[1].strip('s')))
-    data['system time'] = data['system time'].apply(lambda x:
-        pd.to_numeric(x.split("m")[0])*60+pd.to_numeric(x.split("m")[1].strip('s')))
+    return prepareData(data)
 
-    #reformat the client column
-    #cartesius workernodes start with 'tcn'
-    for c in data['client'].unique():
-        if c.startswith('tcn'):
-            data = data.replace(c, 'cartesius')
-        elif 'lisa' in c:
-            data = data.replace(c, 'lisa')
-        elif c == 'elitebook':
-            data = data.replace(c, 'workstation')
+def readStore(database, columns=None, since=None, until=None, **filters):
+    """
+    Reads the results matching all filters from a results.ResultStore, e.g.
+        readStore('results.db', iresource='pocCompound', operation='iget')
+    Only the matching rows are read, using the indexes of the database.
+    database:       sqlite file
+    columns, since, until, filters: see results.ResultStore.select
+    """
+    store = ResultStore(database)
+    sql, parameters, headers = store.select(columns, since, until, **filters)
+    data = pd.read_sql_query(sql, store.connection, params=parameters)
+    store.close()
+    data.columns = headers
+
+    return prepareData(data)
+
+# Client classes: (regular expression of the host name, class), the first match wins.
+# Host names without match are kept.
+CLIENT_CLASSES = [
+    (r'^tcn', 'cartesius'),     # cartesius worker nodes
+    (r'lisa', 'lisa'),
+    (r'^elitebook$', 'workstation'),
+]
 
-    #add new column to calculate gigabit/sec
-    data['size GB'] = data['size']
+# Files per folder of result files without the column 'bytes' (folder size label e.g. 10MB)
+LEGACY_FOLDER_FILES = 100
 
-    #reformat
-    data['size GB'].replace(to_replace="[^0-9]+", value=r"", regex=True, inplace=True)
-    data['size GB'] = pd.to_numeric(data['size GB'])
+def toSeconds(column):
+    """
+    Converts a column of times to seconds, times of older result files are given as XmX.Xs.
+    """
+    if pd.api.types.is_numeric_dtype(column):
+        return column.astype(float)
+    seconds = pd.to_numeric(column, errors='coerce')
+    # only the values that are no numbers
+    legacy = column[seconds.isnull() & column.notnull()].astype(str)
+    parts = legacy.str.extract(r'^\s*(\d+)m(\d+(?:\.\d*)?)s\s*$')
+    return seconds.fillna(parts[0].astype(float)*60 + parts[1].astype(float))
+
+def clientClasses(column):
+    """
+    Maps host names to the classes of CLIENT_CLASSES, returns a categorical column.
+    """
+    hosts = pd.Series(column.dropna().unique())
+    classes = hosts.copy()
+    matched = pd.Series(False, index=hosts.index)
+    for pattern, name in CLIENT_CLASSES:
+        idx = ~matched & hosts.str.contains(pattern, regex=True)
+        classes[idx] = name
+        matched = matched | idx
+    return column.map(dict(zip(hosts, classes))).astype('category')
+
+def sizeBytes(data):
+    """
+    Returns the transferred bytes per row: the column 'bytes' if given, otherwise derived from
+    the size label (powers of 1024, folder labels like 10MB stand for LEGACY_FOLDER_FILES files).
+    """
+    # parse the few distinct labels and map them to the rows
+    labels = pd.Series(data['size'].dropna().unique()).astype(str)
+    parts = labels.str.extract(r'^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(B?)\s*$', flags=re.IGNORECASE)
+    power = parts[1].str.upper().map({'': 0, 'K': 1, 'M': 2, 'G': 3, 'T': 4})
+    perLabel = parts[0].astype(float) * 1024.**power.astype(float)
+    perLabel = perLabel.where(parts[2] != 'B', perLabel * LEGACY_FOLDER_FILES)
+    labelBytes = data['size'].astype(str).map(dict(zip(labels, perLabel)))
+    if 'bytes' in data.columns:
+        return pd.to_numeric(data['bytes'], errors='coerce').fillna(labelBytes)
+    return labelBytes
+
+def prepareData(data):
+    """
+    Converts the times to seconds, maps the clients to their classes and adds the columns 
+    'size bytes' and 'size GB'.
+    data:   data frame with the columns of the result files
+    """
+    data = data.copy()
+
+    #reformat the columns real time, user time, system time of older files: XmX.Xs --> X (in seconds)
+    for column in ['real time', 'user time', 'system time']:
+        data[column] = toSeconds(data[column])
+
+    #reformat the client column
+    data['client'] = clientClasses(data['client'])
 
-    idx = data['size GB'] == 10
-    data['size GB'][idx] = 1
-    idx = data['size GB'] == 100
-    data['size GB'][idx] = 0.1
+    #add new columns to calculate gigabit/sec
+    data['size bytes'] = sizeBytes(data)
+    data['size GB'] = data['size bytes']/1024.**3
 
-    data['size'].replace('10MB', '100x\n10MB', inplace=True)
+    data['size'] = data['size'].replace('10MB', '100x\n10MB')
 
     return data
 
-def plotData(dataFrame):
-
-    dfIPUT = dataFrame[dataFrame['iget/iput']=='iput']
-    dfIGET = dataFrame[dataFrame['iget/iput']=='iget']
-
-    # make single plots for resources
-    for resc in dataFrame['iresource'].unique():
-        # make single plots for clients
-        for client in dataFrame['client'].unique():
-            # plot the times as boxplot
-            idx = (dataFrame['iresource']==resc) & (dataFrame['client']==client)
-            data_mean   = dfIPUT[idx].groupby('size').mean()
-            data_mean.plot.bar()
-            plt.xlabel('size')
-            plt.ylabel('Gbit/s')
-            plt.ylim([0, 9])
-            plt.title(resc+' - iput from '+client)
-            plt.savefig(resc+'-iput-'+client+'.png')
-
-            data_mean   = dfIGET[idx].groupby('size').mean()
-            data_mean.plot.bar()
-            plt.xlabel('size')
-            plt.ylabel('Gbit/s')
-            plt.ylim([0, 5])
-            plt.title(resc+' - iget from '+client)
-            plt.savefig(resc+'-iget-'+client+'.png')
-
-def plotDataCompute(dataFrame):
+def benchmarkPrepareData(rows=3000000, seed=0):
+    """
+    Times prepareData on a synthetic frame of <rows> result rows, with old (XmX.Xs) and new times
+    and many host names. 
+        python -c "import plotting; plotting.benchmarkPrepareData()"
+    Returns the time in seconds.
+    """
+    rng = numpy.random.RandomState(seed)
+    real = rng.uniform(0, 600, rows)
+    legacy = rng.rand(rows) < 0.5
+    times = pd.Series(real, dtype=object)
+    times[legacy] = ['%dm%.3fs' %(t // 60, t % 60) for t in real[legacy]]
+    hosts = numpy.array(['tcn%d' %i for i in range(1000)] + ['lisa%d.nikhef.nl' %i for i in range(100)] +
+        ['elitebook', 'laptop'])
+    data = pd.DataFrame({
+        'date':         '2017-03-01 10:00:00',
+        'iresource':    'pocCompound',
+        'client':       hosts[rng.randint(0, len(hosts), rows)],
+        'iget/iput':    numpy.array(['iput', 'iget'])[rng.randint(0, 2, rows)],
+        'size':         numpy.array(['100M', '1G', '2G', '5G', '10MB'])[rng.randint(0, 5, rows)],
+        'real time':    times,
+        'user time':    times,
+        'system time':  times,
+    })
+
+    start = time.time()
+    prepared = prepareData(data)
+    seconds = time.time() - start
+    assert numpy.allclose(prepared['real time'], real, atol=0.001)
+    print('prepareData: %d rows in %.2f s' %(rows, seconds))
+    return seconds
+
+# Upper limit of the throughput axes per operation (Gbit/s), other operations are scaled automatically
+THROUGHPUT_YLIM = {'iput': 9, 'iget': 5}
+
+# Client classes of the compute resources
+COMPUTE_CLIENTS = ['lisa', 'cartesius']
+
+# Figures a worker process draws before it is replaced, keeps the memory of the workers flat
+FIGURES_PER_WORKER = 50
+
+def figure(data, title, path=None, kind='bar', xlabel='size', ylabel='Gbit/s', ylim=None, **options):
+    """
+    Describes a figure for renderFigure, the description is sent to a worker process.
+    data:       data frame, one bar or line per column
+    path:       png file, None to return the png
+    kind:       method of DataFrame.plot, e.g. bar or line
+    options:    arguments of the plot method, e.g. yerr, capsize, legend, stacked
+    """
+    return {'data': data, 'title': title, 'path': path, 'kind': kind, 'xlabel': xlabel, 'ylabel': ylabel,
+        'ylim': ylim, 'options': options}
+
+def renderFigure(spec):
+    """
+    Draws a figure (see figure) and closes it.
+    Returns the path of the png file, or the png as bytes if the figure has no path.
+    """
+    fig, ax = plt.subplots()
+    try:
+        getattr(spec['data'].plot, spec['kind'])(ax=ax, **spec['options'])
+        ax.set_xlabel(spec['xlabel'])
+        ax.set_ylabel(spec['ylabel'])
+        if spec['ylim'] is not None:
+            ax.set_ylim([0, spec['ylim']])
+        ax.set_title(spec['title'])
+        if spec['path'] is not None:
+            fig.savefig(spec['path'])
+            return spec['path']
+        png = io.BytesIO()
+        fig.savefig(png, format='png')
+        return png.getvalue()
+    finally:
+        plt.close(fig)
+
+def _initWorker():
+    # the workers only write files, an interactive backend of the parent is of no use to them
+    plt.switch_backend('Agg')
+
+def renderFigures(specs, processes=None):
+    """
+    Draws figures in parallel by a pool of <processes> worker processes (default: number of cores),
+    every worker is replaced after FIGURES_PER_WORKER figures.
+    specs:  list of figure descriptions, see figure
+
+    Yields the results of renderFigure in the order of specs, as soon as they are drawn.
+    """
+    if len(specs) <= 1 or processes == 1:
+        for spec in specs:
+            yield renderFigure(spec)
+        return
+    pool = multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(specs)),
+        initializer=_initWorker, maxtasksperchild=FIGURES_PER_WORKER)
+    try:
+        for result in pool.imap(renderFigure, specs):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+def throughputFigures(summary, paths=True):
+    """
+    Bar plots of the median throughput per size for every resource, client and operation,
+    the error bars show the 95% confidence interval of the median.
+    summary:    see analysis.summarize
+    paths:      False to return the pngs instead of writing <resource>-<operation>-<client>.png
+    """
+    figures = []
+    for (resc, client, op), group in summary.groupby(['iresource', 'client', 'iget/iput']):
+        median, yerr = errorBars(group)
+        figures.append(figure(median, resc+' - '+op+' from '+client,
+            resc+'-'+op+'-'+client+'.png' if paths else None, ylim=THROUGHPUT_YLIM.get(op), yerr=yerr, capsize=3))
+    return figures
+
+def computeFigures(summary, paths=True):
+    """
+    Grouped bar plots of the compute resources per resource X operation, bars per client.
+    """
+    figures = []
+    summary = summary[summary['client'].isin(COMPUTE_CLIENTS)]
+    for (resc, op), group in summary.groupby(['iresource', 'iget/iput']):
+        median, yerr = errorBars(group)
+        figures.append(figure(median, resc+' - '+op, resc+'-'+op+'-compute.png' if paths else None,
+            ylim=2, yerr=yerr, capsize=3))
+    return figures
+
+def workstationFigures(summary, paths=True):
+    """
+    Bar plots of the workstation results per resource X operation.
+    """
+    figures = []
+    summary = summary[summary['client']=='workstation']
+    for (resc, op), group in summary.groupby(['iresource', 'iget/iput']):
+        median, yerr = errorBars(group)
+        figures.append(figure(median, resc+' - '+op, resc+'-'+op+'-workstation.png' if paths else None,
+            ylim=2, yerr=yerr, capsize=3, legend=False))
+    return figures
+
+def concurrencyFigures(dataFrame, paths=True):
+    """
+    Aggregate throughput against the number of concurrent streams, of the rows with stream 'all'
+    written by performanceConcurrent. One figure per resource X operation, one line per file size.
+    """
+    figures = []
+    dfAll = dataFrame[dataFrame['stream'].astype(str)=='all'].copy()
+    dfAll['GB/s'] = pd.to_numeric(dfAll['bytes'])/1024.**3/dfAll['real time']
+    for (resc, op), group in dfAll.groupby(['iresource', 'iget/iput']):
+        grouped = group.groupby(['concurrency', 'size'])['GB/s'].mean().unstack('size')
+        figures.append(figure(grouped, resc+' - '+op+' aggregate', resc+'-'+op+'-concurrency.png' if paths else None,
+            kind='line', xlabel='concurrent streams', ylabel='GB/s', marker='o'))
+    return figures
+
+def smallFilesFigures(dataFrame, paths=True):
+    """
+    Files per second of the small file tests, for files transferred one by one (stream 'all') and
+    with iput/iget -r (stream 'bulk'). One figure per resource X operation, grouped bars per file size.
+    """
+    figures = []
+    dfSmall = dataFrame[dataFrame['stream'].astype(str).isin(['all', 'bulk']) & dataFrame['files'].notnull()].copy()
+    dfSmall['files/s'] = dfSmall['files']/dfSmall['real time']
+    for (resc, op), group in dfSmall.groupby(['iresource', 'iget/iput']):
+        grouped = group.groupby(['size', 'stream'])['files/s'].mean().unstack('stream')
+        figures.append(figure(grouped, resc+' - '+op+' small files', resc+'-'+op+'-smallfiles.png' if paths else None,
+            ylabel='files/s'))
+    return figures
+
+def bottleneckFigures(dataFrame, paths=True):
+    """
+    How many transfers per size were limited by the disk, the network, the CPU or the server, see the 
+    column 'bottleneck' of profiled runs (profiling.py). One figure per resource X client X operation,
+    stacked bars per size.
+    """
+    figures = []
+    dfProfiled = dataFrame[dataFrame['bottleneck'].notnull()]
+    for (resc, client, op), group in dfProfiled.groupby(['iresource', 'client', 'iget/iput'], observed=True):
+        counts = group.groupby(['size', 'bottleneck']).size().unstack('bottleneck', fill_value=0)
+        figures.append(figure(counts, resc+' - '+op+' from '+client+' bottleneck',
+            resc+'-'+op+'-'+client+'-bottleneck.png' if paths else None, ylabel='transfers', stacked=True))
+    return figures
+
+def plotData(dataFrame, warmup=0, summary=None, processes=None):
+    """
+    Creates bar plots of the median throughput per size for every resource and client, 
+    the error bars show the 95% confidence interval of the median.
+    warmup:     number of first iterations of every run that are left out, see analysis.summarize
+    summary:    summary of the dataFrame if already computed
+    processes:  number of processes drawing the figures, see renderFigures
+    """
+    if summary is None:
+        summary = summarize(dataFrame, 'real time Gbit/s', warmup=warmup)
+    list(renderFigures(throughputFigures(summary), processes))
+
+def plotDataCompute(dataFrame, warmup=0, summary=None, processes=None):
     """
     Creates separate grouped bar plots for the compute resources and the workstation results.
     Creates single figures for resource X [iput, iget].
-    Shown is the mean performance per client.
+    Shown is the median performance per client with the 95% confidence interval as error bars.
     """
-    plt.clf()
+    if summary is None:
+        summary = summarize(dataFrame, 'real time Gbit/s', warmup=warmup)
+    list(renderFigures(computeFigures(summary), processes))
 
-    dfIPUT = dataFrame[dataFrame['iget/iput']=='iput']
-    dfIGET = dataFrame[dataFrame['iget/iput']=='iget']
-    
-    # make single plots for resources
-    for resc in dataFrame['iresource'].unique():
-        idx = (dataFrame['iresource']==resc)
-        grouped = dfIPUT[idx].groupby(['size', 'client']).agg('mean') # calc of mean and store in column 'real time Gbit/s'
-        groupedPUT = grouped.reset_index().pivot(index='size', columns='client', values='real time Gbit/s')
-
-        grouped = dfIGET[idx].groupby(['size', 'client']).agg('mean')
-        groupedGET = grouped.reset_index().pivot(index='size', columns='client', values='real time Gbit/s')
-
-        # make grouped bar plots for lisa and cartesius
-        groupedPUTComp = groupedPUT[['lisa', 'cartesius']]
-        groupedGETComp = groupedGET[['lisa', 'cartesius']]
-        
-        groupedPUTComp.plot.bar()
-        plt.xlabel('size')
-        plt.ylabel('Gbit/s')
-        plt.title(resc+' - iput')
-        plt.ylim([0, 2])        
-        plt.savefig(resc+'-iput-compute.png')
-        
-        groupedGETComp.plot.bar()
-        plt.xlabel('size')
-        plt.ylabel('Gbit/s')
-        plt.title(resc+' - iput')
-        plt.ylim([0, 2])
-        plt.savefig(resc+'-iget-compute.png')
-
-def plotDataWorkstation(dataFrame):
-    plt.clf()
-
-    dfIPUT = dataFrame[dataFrame['iget/iput']=='iput']
-    dfIGET = dataFrame[dataFrame['iget/iput']=='iget']
-
-    # make single plots for resources
-    for resc in dataFrame['iresource'].unique():
-        idx = (dataFrame['iresource']==resc)
-        grouped = dfIPUT[idx].groupby(['size', 'client']).agg('mean') # calc of mean and store in column 'real time Gbit/s'
-        groupedPUT = grouped.reset_index().pivot(index='size', columns='client', values='real time Gbit/s')
-
-        grouped = dfIGET[idx].groupby(['size', 'client']).agg('mean')
-        groupedGET = grouped.reset_index().pivot(index='size', columns='client', values='real time Gbit/s')
-
-        # make barplots for workstation
-        groupedPUTWork = groupedPUT['workstation']
-        groupedGETWork = groupedGET['workstation']
-
-        groupedPUTWork.plot.bar()
-        plt.xlabel('size')
-        plt.ylabel('Gbit/s')
-        plt.title(resc+' - iput')
-        plt.ylim([0, 2])
-        plt.savefig(resc+'-iput-workstation.png')
-
-        groupedGETWork.plot.bar()
-        plt.xlabel('size')
-        plt.ylabel('Gbit/s')
-        plt.title(resc+' - iget')
-        plt.ylim([0, 2])
-        plt.savefig(resc+'-iget-workstation.png')
-
-
-def plot():
-    files = [f for f in os.listdir("../results/") if f.endswith('.csv')]
-    dataFrame = readData(files)
+def plotDataWorkstation(dataFrame, warmup=0, summary=None, processes=None):
+    """
+    Creates bar plots of the workstation results per resource X [iput, iget].
+    Shown is the median performance with the 95% confidence interval as error bars.
+    """
+    if summary is None:
+        summary = summarize(dataFrame, 'real time Gbit/s', warmup=warmup)
+    list(renderFigures(workstationFigures(summary), processes))
+
+def plotConcurrency(dataFrame, processes=None):
+    """
+    Plots the aggregate throughput against the number of concurrent streams, see concurrencyFigures.
+    """
+    list(renderFigures(concurrencyFigures(dataFrame), processes))
+
+def plotSmallFiles(dataFrame, processes=None):
+    """
+    Plots the files per second of the small file tests, see smallFilesFigures.
+    """
+    list(renderFigures(smallFilesFigures(dataFrame), processes))
+
+def plotBottlenecks(dataFrame, processes=None):
+    """
+    Plots the bottlenecks of profiled runs, see bottleneckFigures.
+    """
+    list(renderFigures(bottleneckFigures(dataFrame), processes))
+
+def plot(database=None, warmup=0, summaryFile='summary.csv', processes=None, **filters):
+    """
+    Plots the result files in ../results/ or, with a database, the results matching the filters, see readStore.
+    warmup:         number of first iterations of every run that are left out
+    summaryFile:    the statistics per resource, client, operation and size are exported to this file,
+                    for profiled runs also per bottleneck to <summaryFile>-bottleneck
+    processes:      number of processes drawing the figures, see renderFigures
+    """
+    if database is None:
+        files = ["../results/"+f for f in os.listdir("../results/") if f.endswith('.csv')]
+        dataFrame = readData(files)
+    else:
+        dataFrame = readStore(database, **filters)
 
     dataFrame['real time Gbit/s'] = dataFrame['size GB']*8/dataFrame['real time']
     #dataFrame['user time Gbit/s'] = dataFrame['size GB']*8/dataFrame['user time']
     #dataFrame['system time Gbit/s'] = dataFrame['size GB']*8/dataFrame['system time']
     
-    plotDataCompute(dataFrame)
-    plotDataWorkstation(dataFrame)
-    
+    #the concurrent and small file tests have their own plots
+    if 'stream' in dataFrame.columns:
+        dataFrame = dataFrame[dataFrame['stream'].isnull()]
+
+    summary = summarize(dataFrame, 'real time Gbit/s', warmup=warmup)
+    exportSummary(summary, summaryFile)
+    figures = []
+    if 'bottleneck' in dataFrame.columns and dataFrame['bottleneck'].notnull().any():
+        base, ext = os.path.splitext(summaryFile)
+        exportSummary(summarize(dataFrame[dataFrame['bottleneck'].notnull()], 'real time Gbit/s',
+            GROUP_COLUMNS + ['bottleneck'], warmup=warmup), base+'-bottleneck'+ext)
+        figures = figures + bottleneckFigures(dataFrame)
+    figures = figures + computeFigures(summary) + workstationFigures(summary)
+    list(renderFigures(figures, processes))
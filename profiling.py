@@ -0,0 +1,213 @@
+"""
+Client side resource usage during a transfer, to tell whether a slow transfer was limited by the
+local disk, the network, the CPU (e.g. checksums) or none of them (the server).
+
+ClientProfiler is a monitor of icommands.run and backends.timedCall (see sampler.py). It reads
+the counters of the node before, during (every interval) and after the transfer:
+    CPU:        /proc/stat, busy time of all cores, and the CPU time of the transfer process
+    disk:       /proc/diskstats of the device behind the test data folder, bytes and busy time
+    network:    /proc/net/dev of the interface with the default route, bytes received and sent
+and classify() labels the transfer with its bottleneck: disk, network, cpu, server or unknown.
+Virtual interfaces do not report their link speed, it can be configured (ClientProfiler speed).
+
+    profiler = ClientProfiler(os.environ["TMPDIR"])
+    res = BACKEND.put(iresource, source, obj, monitors=[profiler])
+    columns = profiler.columns(res.real, res.user, res.sys)
+"""
+
+import os
+import threading
+from icommands import monotonic
+
+SECTOR = 512    # bytes per sector of /proc/diskstats
+
+# Utilisation from which a resource counts as saturated
+THRESHOLDS = {"disk": 0.8, "network": 0.8, "cpu": 0.9}
+
+def readCpu():
+    """
+    Returns (busy, total) jiffies of all cores, from the first line of /proc/stat.
+    """
+    with open("/proc/stat") as f:
+        values = [int(v) for v in f.readline().split()[1:]]
+    # idle and iowait
+    idle = values[3] + (values[4] if len(values) > 4 else 0)
+    return sum(values[:8]) - idle, sum(values[:8])
+
+def deviceOf(path):
+    """
+    Returns the name of the block device (as in /proc/diskstats) a path is stored on,
+    None for file systems without block device, e.g. tmpfs or network file systems.
+    """
+    dev = os.stat(path).st_dev
+    link = "/sys/dev/block/%d:%d" %(os.major(dev), os.minor(dev))
+    if not os.path.exists(link):
+        return None
+    return os.path.basename(os.path.realpath(link))
+
+def readDisk(device):
+    """
+    Returns (bytes read, bytes written, milliseconds busy) of a block device, None if not listed.
+    """
+    with open("/proc/diskstats") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) > 12 and fields[2] == device:
+                return int(fields[5]) * SECTOR, int(fields[9]) * SECTOR, int(fields[12])
+    return None
+
+def activeInterface():
+    """
+    Returns the network interface of the default route, else the one with the most traffic.
+    """
+    try:
+        with open("/proc/net/route") as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if len(fields) > 1 and fields[1] == "00000000":
+                    return fields[0]
+    except IOError:
+        pass
+    counters = readNetAll()
+    counters.pop("lo", None)
+    if len(counters) == 0:
+        return None
+    return max(counters, key=lambda name: sum(counters[name]))
+
+def readNetAll():
+    """
+    Returns {interface: (bytes received, bytes sent)} of /proc/net/dev.
+    """
+    counters = {}
+    with open("/proc/net/dev") as f:
+        for line in f.readlines()[2:]:
+            name, values = line.split(":", 1)
+            values = values.split()
+            counters[name.strip()] = (int(values[0]), int(values[8]))
+    return counters
+
+def linkSpeed(interface):
+    """
+    Returns the speed of a network interface in bytes per second, None if unknown (e.g. virtual interfaces).
+    """
+    try:
+        with open("/sys/class/net/%s/speed" %interface) as f:
+            speed = int(f.read())
+    except (IOError, ValueError):
+        return None
+    if speed <= 0:
+        return None
+    return speed * 1000000 / 8.
+
+class ClientProfiler(object):
+    """
+    Records the counters of the node during a transfer.
+    path:       local folder of the transfer (test data), its block device is monitored
+    interval:   seconds between two samples, the peaks of disk and network use are taken from them
+    interface:  network interface, default the one with the default route
+    speed:      link speed in bytes per second if the interface does not report it, None for unknown
+    """
+
+    def __init__(self, path, interval=0.5, interface=None, speed=None):
+        self.interval = interval
+        self.device = deviceOf(path)
+        self.interface = interface or activeInterface()
+        self.speed = linkSpeed(self.interface) if self.interface is not None else None
+        if self.speed is None:
+            self.speed = speed
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read(self):
+        disk = readDisk(self.device) if self.device is not None else None
+        net = readNetAll().get(self.interface) if self.interface is not None else None
+        return monotonic(), readCpu(), disk, net
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.samples.append(self._read())
+
+    def start(self, pid):
+        self.samples = [self._read()]
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.samples.append(self._read())
+
+    def _usage(self, first, last):
+        """
+        Utilisation between two samples: (cpu, disk, disk bytes, network, network bytes),
+        utilisations as fractions, None where the counter is not available.
+        """
+        seconds = last[0] - first[0]
+        cpu = disk = diskBytes = net = netBytes = None
+        if last[1][1] > first[1][1]:
+            cpu = float(last[1][0] - first[1][0]) / (last[1][1] - first[1][1])
+        if first[2] is not None and last[2] is not None and seconds > 0:
+            diskBytes = last[2][0] - first[2][0] + last[2][1] - first[2][1]
+            disk = min(1.0, (last[2][2] - first[2][2]) / 1000. / seconds)
+        if first[3] is not None and last[3] is not None:
+            netBytes = last[3][0] - first[3][0] + last[3][1] - first[3][1]
+            if self.speed is not None and seconds > 0:
+                # full duplex: the busier direction counts
+                net = max(last[3][0] - first[3][0], last[3][1] - first[3][1]) / seconds / self.speed
+        return cpu, disk, diskBytes, net, netBytes
+
+    def profile(self):
+        """
+        Returns the utilisation over the whole transfer and the peak of the sampled intervals:
+            {cpu, disk, disk bytes, network, network bytes, peak cpu, peak disk, peak network}
+        """
+        cpu, disk, diskBytes, net, netBytes = self._usage(self.samples[0], self.samples[-1])
+        intervals = [self._usage(a, b) for a, b in zip(self.samples[:-1], self.samples[1:])]
+
+        def peak(k):
+            values = [usage[k] for usage in intervals if usage[k] is not None]
+            return max(values) if len(values) > 0 else None
+        return {"cpu": cpu, "disk": disk, "disk bytes": diskBytes, "network": net, "network bytes": netBytes,
+            "peak cpu": peak(0), "peak disk": peak(1), "peak network": peak(3)}
+
+    def columns(self, real, user, sys):
+        """
+        Returns the result columns of the transfer (keys with "_" for resultRow).
+        real, user, sys:    times of the transfer process
+        """
+        profile = self.profile()
+        return {"cpu_utilization": profile["cpu"], "disk_utilization": profile["disk"],
+            "disk_bytes": profile["disk bytes"], "network_utilization": profile["network"],
+            "network_bytes": profile["network bytes"], "bottleneck": classify(profile, real, user, sys)}
+
+def classify(profile, real, user, sys, thresholds=THRESHOLDS):
+    """
+    Labels the bottleneck of a transfer: the most utilised of disk, network and cpu if it is above
+    its threshold, otherwise server (the client waited), or unknown if the network utilisation is
+    unknown (no link speed).
+    A resource counts with its peak of the sampled intervals if that is higher than its utilisation
+    over the whole transfer, which includes the ramp up and the tail of the transfer.
+    CPU counts as saturated if the node was busy or the transfer process used one core the whole time,
+    checksums and the single threaded icommands are limited by one core.
+    profile:    see ClientProfiler.profile
+    """
+    def used(name):
+        values = [v for v in [profile.get(name), profile.get("peak "+name)] if v is not None]
+        return max(values) if len(values) > 0 else None
+
+    cpu = used("cpu") or 0
+    if real > 0:
+        cpu = max(cpu, (user + sys) / real)
+    utilisation = {
+        "cpu":      cpu,
+        "disk":     used("disk") or 0,
+        "network":  used("network") or 0,
+    }
+    saturated = [(value / thresholds[name], name) for name, value in utilisation.items()
+        if value >= thresholds[name]]
+    if len(saturated) == 0:
+        return "unknown" if used("network") is None else "server"
+    return max(saturated)[1]
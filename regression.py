@@ -0,0 +1,205 @@
+"""
+Compares the throughput of a new run with a baseline per (resource, client, operation, size), e.g.
+before and after a server upgrade. The throughputs of both are compared with a two-sided Mann-Whitney U
+test, the effect size is Cliff's delta: the probability that a new transfer is faster than a baseline
+transfer minus the probability that it is slower (-1 all slower ... 1 all faster).
+
+A group is a regression if the difference is significant (p < alpha) and its median throughput dropped
+by more than the threshold, an improvement if it rose by more than the threshold. The script exits with 1
+if there is a regression, so it can gate an upgrade:
+
+    python regression.py [--threshold 0.1] [--alpha 0.05] [--warmup 1] [--out <csv or html>] <baseline> <new>
+        baseline, new:  result files, separated by commas
+    python regression.py --db <sqlite file> [...] <baseline> <new>
+        baseline, new:  a date range <since>..<until> (either may be empty) of the results in the database,
+                        or result files imported into it (see results.py)
+
+The test uses the normal approximation of U, with 5 or more transfers per group on each side a p-value
+below 0.05 is possible.
+"""
+
+import os
+import sys
+import math
+import getopt
+import numpy
+import pandas as pd
+from collections import Counter
+from analysis import addIteration, exportSummary, GROUP_COLUMNS
+from plotting import readData, readStore
+
+# Transfer settings that are compared separately if they are recorded, e.g. by the sweep
+SETTING_COLUMNS = ['threads', 'bulk', 'checksum', 'local io']
+
+def ranks(values):
+    """
+    Returns the ranks (starting at 1) of a list of numbers, tied values get the mean of their ranks.
+    """
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    result = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j = j + 1
+        for k in range(i, j + 1):
+            result[order[k]] = (i + j) / 2. + 1
+        i = j + 1
+    return result
+
+def mannWhitneyU(x, y):
+    """
+    Two-sided Mann-Whitney U test, normal approximation with tie and continuity correction.
+    Returns (U of x, p-value): U counts the pairs in which x is larger than y, ties count one half.
+    """
+    x, y = list(x), list(y)
+    n1, n2 = len(x), len(y)
+    r = ranks(x + y)
+    u = sum(r[:n1]) - n1 * (n1 + 1) / 2.
+    n = n1 + n2
+    ties = sum([t**3 - t for t in Counter(x + y).values()])
+    variance = n1 * n2 / 12. * ((n + 1) - ties / float(n * (n - 1)))
+    if variance <= 0:
+        # all values equal
+        return u, 1.0
+    z = max(0, abs(u - n1 * n2 / 2.) - 0.5) / math.sqrt(variance)
+    return u, math.erfc(z / math.sqrt(2))
+
+def cliffsDelta(u, n1, n2):
+    """
+    Effect size of a Mann-Whitney U of the first of two samples with n1 and n2 values.
+    """
+    return 2. * u / (n1 * n2) - 1
+
+def compare(baseline, new, column='real time Gbit/s', groups=None, threshold=0.1, alpha=0.05, warmup=0):
+    """
+    Compares a column of two data frames of results per group.
+    baseline, new:  data frames of results, see plotting.readData
+    column:         throughput, higher is better
+    groups:         columns identifying a group, default GROUP_COLUMNS and the transfer settings
+                    recorded in both data frames
+    threshold:      relative change of the median from which a significant change counts
+    alpha:          significance level
+    warmup:         number of first iterations of every run that are dropped
+
+    Returns a data frame with one row per group, regressions first, and the columns
+        baseline n, new n, baseline median, new median, change, p, delta, status
+    status is regression, improvement, unchanged, missing (no new results) or new (no baseline).
+    """
+    if groups is None:
+        groups = GROUP_COLUMNS + [c for c in SETTING_COLUMNS if c in baseline.columns and c in new.columns
+            and (baseline[c].notnull().any() or new[c].notnull().any())]
+    groups = list(groups)
+    frames = []
+    for data in [baseline, new]:
+        data = data[data[column].notnull()].copy()
+        if warmup > 0:
+            data = data[addIteration(data, groups) > warmup]
+        if 'integrity' in data.columns:
+            # failed transfers do not count
+            data = data[data['integrity'].isnull() | (data['integrity'] == 'ok')]
+        # missing settings, e.g. of older result files, form their own group
+        for c in groups:
+            data[c] = data[c].fillna('').astype(str)
+        frames.append(dict([(key if isinstance(key, tuple) else (key,), group[column].values.astype(float))
+            for key, group in data.groupby(groups)]))
+
+    rows = []
+    for key in sorted(set(frames[0]) | set(frames[1])):
+        before = frames[0].get(key, numpy.array([]))
+        after = frames[1].get(key, numpy.array([]))
+        row = dict(zip(groups, key))
+        row.update({'baseline n': len(before), 'new n': len(after),
+            'baseline median': numpy.median(before) if len(before) > 0 else numpy.nan,
+            'new median': numpy.median(after) if len(after) > 0 else numpy.nan,
+            'change': numpy.nan, 'p': numpy.nan, 'delta': numpy.nan})
+        if len(before) == 0:
+            row['status'] = 'new'
+        elif len(after) == 0:
+            row['status'] = 'missing'
+        else:
+            u, p = mannWhitneyU(after, before)
+            row['p'] = p
+            row['delta'] = cliffsDelta(u, len(after), len(before))
+            row['change'] = row['new median'] / row['baseline median'] - 1
+            if p < alpha and row['change'] <= -threshold:
+                row['status'] = 'regression'
+            elif p < alpha and row['change'] >= threshold:
+                row['status'] = 'improvement'
+            else:
+                row['status'] = 'unchanged'
+        rows.append(row)
+
+    order = {'regression': 0, 'improvement': 1, 'unchanged': 2, 'missing': 3, 'new': 4}
+    rows.sort(key=lambda row: order[row['status']])
+    return pd.DataFrame(rows, columns=groups + ['baseline n', 'new n', 'baseline median', 'new median',
+        'change', 'p', 'delta', 'status'])
+
+def readRun(spec, database=None):
+    """
+    Reads the results of a run.
+    spec:       result files separated by commas, or with a database a date range <since>..<until>
+                or result files imported into it
+    database:   sqlite file, see results.ResultStore
+    """
+    if database is None:
+        return readData(spec.split(','))
+    if '..' in spec:
+        since, until = spec.split('..', 1)
+        return readStore(database, since=since or None, until=until or None)
+    return readStore(database, source=[os.path.abspath(f) for f in spec.split(',')])
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "h", ["help", "db=", "threshold=", "alpha=", "warmup=", "out="])
+    except getopt.error as msg:
+        print(msg)
+        print("for help use --help")
+        sys.exit(2)
+
+    database = None
+    threshold = 0.1
+    alpha = 0.05
+    warmup = 0
+    out = None
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            print(__doc__)
+            sys.exit(0)
+        elif o == "--db":
+            database = a
+        elif o == "--threshold":
+            threshold = float(a)
+        elif o == "--alpha":
+            alpha = float(a)
+        elif o == "--warmup":
+            warmup = int(a)
+        elif o == "--out":
+            out = a
+    if len(args) != 2:
+        print(__doc__)
+        sys.exit(2)
+
+    runs = []
+    for spec in args:
+        data = readRun(spec, database)
+        data['real time Gbit/s'] = data['size GB']*8/data['real time']
+        #the concurrent streams are compared by the concurrent test itself
+        if 'stream' in data.columns:
+            data = data[data['stream'].isnull()]
+        runs.append(data)
+    result = compare(runs[0], runs[1], threshold=threshold, alpha=alpha, warmup=warmup)
+    if out is not None:
+        exportSummary(result, out)
+
+    table = result.copy()
+    table['size'] = table['size'].str.replace('\n', ' ')
+    table['change'] = table['change'].map(lambda x: '' if numpy.isnan(x) else '%+.1f%%' %(100 * x))
+    print(table.to_string(index=False, float_format=lambda x: '%.4g' %x))
+    regressions = (result['status'] == 'regression').sum()
+    print("%d regressions, %d improvements, %d unchanged (threshold %g%%, alpha %g)" %(regressions,
+        (result['status'] == 'improvement').sum(), (result['status'] == 'unchanged').sum(), 100 * threshold, alpha))
+    sys.exit(1 if regressions > 0 else 0)
+
+if __name__ == "__main__":
+    main()
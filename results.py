@@ -0,0 +1,420 @@
+"""
+Storage of the test results.
+ResultSink  appends every result row to a csv and a json lines file the moment it is measured
+Checkpoint  remembers the completed steps of a run, so a restarted run continues where it stopped
+ResultStore SQLite database of all results with typed and indexed columns, queried by the plots
+
+Importing existing csv files into a database:
+    python results.py <database> <csv file> [<csv file> ...]
+"""
+
+import os
+import re
+import sys
+import csv
+import json
+import sqlite3
+import threading
+
+# Columns of the result files, result rows are dictionaries with these keys
+RESULT_HEADER = ["date", "iresource", "client", "iget/iput", "size", "real time", "user time", "system time",
+    "integrity", "bytes", "concurrency", "stream", "max rss", "backend", "files", "catalog time", "iteration",
+    "threads", "bulk", "checksum", "node", "start",
+    "ramp up", "steady bandwidth", "tail time", "cpu utilization", "disk utilization", "disk bytes",
+    "network utilization", "network bytes", "bottleneck", "local io"]
+
+# SQL types of the numeric columns, all other columns are stored as TEXT
+COLUMN_TYPES = {
+    "real time":    "REAL",
+    "user time":    "REAL",
+    "system time":  "REAL",
+    "catalog time": "REAL",
+    "bytes":        "INTEGER",
+    "concurrency":  "INTEGER",
+    "max rss":      "INTEGER",
+    "files":        "INTEGER",
+    "iteration":    "INTEGER",
+    "threads":      "INTEGER",
+    "bulk":         "INTEGER",
+    "checksum":     "INTEGER",
+    "start":        "REAL",
+    "ramp up":      "REAL",
+    "steady bandwidth": "REAL",
+    "tail time":    "REAL",
+    "cpu utilization":  "REAL",
+    "disk utilization": "REAL",
+    "disk bytes":   "INTEGER",
+    "network utilization": "REAL",
+    "network bytes": "INTEGER",
+}
+
+# Columns with an index in the database
+INDEXED_COLUMNS = ["iresource", "client", "iget/iput", "size", "date"]
+
+def columnName(header):
+    """
+    Returns the name of a result column in the database, e.g. "real time" --> real_time, "iget/iput" --> operation
+    """
+    if header == "iget/iput":
+        return "operation"
+    return re.sub(r"[^0-9a-z]+", "_", header.lower()).strip("_")
+
+def toSeconds(value):
+    """
+    Converts a time in seconds or in the format of bash time (XmX.Xs, older result files) to seconds.
+    Returns None for empty values.
+    """
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        minutes, seconds = str(value).split("m")
+        return float(minutes) * 60 + float(seconds.strip("s"))
+
+def _openCsv(path, mode):
+    if sys.version_info[0] < 3:
+        return open(path, mode+"b")
+    return open(path, mode, newline="")
+
+class ResultSink(object):
+    """
+    Writes result rows to <path> (csv) and <path without .csv>.jsonl, flushed after every row.
+    The json lines file keeps all keys of a row, the csv file the columns of its header.
+    path:   csv file
+    fresh:  True truncates existing files, False appends to them (resumed run)
+    sync:   fsync after every row, the rows survive a crash of the node
+    store:  ResultStore, receives every row as well
+    position:   position() after the last completed step of the resumed run, the rows written
+                after it (a step that was interrupted) are removed, the step runs again
+    """
+
+    def __init__(self, path, fresh=True, sync=True, header=RESULT_HEADER, store=None, position=None):
+        self.path = path
+        self.jsonPath = os.path.splitext(path)[0]+".jsonl"
+        self.sync = sync
+        self.store = store
+        self.lock = threading.Lock()
+
+        if not fresh and position is not None:
+            self._truncate(position)
+
+        if not fresh and os.path.isfile(path) and os.path.getsize(path) > 0:
+            # Keep the columns of the existing file
+            with _openCsv(path, "r") as f:
+                header = next(csv.reader(f))
+            self.csvFile = _openCsv(path, "a")
+            self.writer = csv.DictWriter(self.csvFile, header, extrasaction="ignore")
+        else:
+            self.csvFile = _openCsv(path, "w")
+            self.writer = csv.DictWriter(self.csvFile, header, extrasaction="ignore")
+            self.writer.writeheader()
+        self.jsonFile = open(self.jsonPath, "a" if not fresh else "w")
+        self._flush()
+
+    def _truncate(self, position):
+        csvSize, jsonSize, lastId = position
+        for path, size in [(self.path, csvSize), (self.jsonPath, jsonSize)]:
+            if os.path.isfile(path) and os.path.getsize(path) > size:
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        if self.store is not None:
+            self.store.removeAfter(lastId, os.path.abspath(self.path))
+
+    def position(self):
+        """
+        Returns the sizes of the result files and the last row id of the store, see Checkpoint.attach.
+        """
+        with self.lock:
+            return [os.fstat(self.csvFile.fileno()).st_size, os.fstat(self.jsonFile.fileno()).st_size,
+                self.store.lastId() if self.store is not None else None]
+
+    def _flush(self):
+        for f in [self.csvFile, self.jsonFile]:
+            f.flush()
+            if self.sync:
+                os.fsync(f.fileno())
+
+    def append(self, row):
+        """
+        Writes one result row.
+        """
+        with self.lock:
+            self.writer.writerow(row)
+            self.jsonFile.write(json.dumps(row, sort_keys=True)+"\n")
+            self._flush()
+            if self.store is not None:
+                self.store.append(row, os.path.abspath(self.path))
+
+    def close(self):
+        self.csvFile.close()
+        self.jsonFile.close()
+
+class Checkpoint(object):
+    """
+    Json lines file with the completed steps of a run, e.g. (dataset, iteration, direction),
+    and values the run needs to continue, e.g. the name of its iRODS collection.
+    path:   checkpoint file, it is created with the first entry
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = set()
+        self.values = {}
+        self.position = None    # of the result sink after the last completed step
+        self.sink = None
+        self.lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line of a killed run
+                        continue
+                    if "position" in entry:
+                        self.position = entry["position"]
+                    if "step" in entry:
+                        self.steps.add(tuple(entry["step"]))
+                    elif "key" in entry:
+                        self.values[entry["key"]] = entry["value"]
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def attach(self, sink):
+        """
+        Records the position of the result sink with every completed step. A resumed run passes
+        the position to its ResultSink, so the rows of an interrupted step are not written twice.
+        """
+        self.sink = sink
+        if not self.exists():
+            self.position = sink.position()
+            self._write({"position": self.position})
+
+    def _write(self, entry):
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry)+"\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def done(self, *step):
+        """
+        True if the step was completed.
+        """
+        return tuple(step) in self.steps
+
+    def mark(self, *step):
+        """
+        Records a completed step.
+        """
+        entry = {"step": list(step)}
+        if self.sink is not None:
+            entry["position"] = self.position = self.sink.position()
+        self._write(entry)
+        self.steps.add(tuple(step))
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        self._write({"key": key, "value": value})
+        self.values[key] = value
+
+    def remove(self):
+        """
+        Deletes the checkpoint after a completed run.
+        """
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+class ResultStore(object):
+    """
+    SQLite database of result rows. Every column of RESULT_HEADER is a typed column (see COLUMN_TYPES),
+    columns of newer result rows are added when they first occur. The columns INDEXED_COLUMNS are
+    indexed, so a query for e.g. one resource and iget does not read the whole history.
+    Each row remembers its source, the csv file it was written to or imported from.
+    path:       database file. SQLite locking is unreliable on some network file systems,
+                keep the database on a local disc or import the csv files after the runs.
+    timeout:    seconds to wait for a lock held by another process
+    """
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, source TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS columns (name TEXT PRIMARY KEY, header TEXT, type TEXT)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS imports (path TEXT PRIMARY KEY, size INTEGER, "
+                "mtime REAL, rows INTEGER)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_source ON results (source)")
+        self._loadColumns()
+        self._addColumns(RESULT_HEADER)
+
+    def _loadColumns(self):
+        self.columns = {}   # header --> (name, type)
+        for name, header, sqlType in self.connection.execute("SELECT name, header, type FROM columns"):
+            self.columns[header] = (name, sqlType)
+
+    def _addColumns(self, headers):
+        for header in headers:
+            if header in self.columns:
+                continue
+            name = columnName(header)
+            sqlType = COLUMN_TYPES.get(header, "TEXT")
+            try:
+                with self.connection:
+                    self.connection.execute('ALTER TABLE results ADD COLUMN "%s" %s' %(name, sqlType))
+                    self.connection.execute("INSERT INTO columns VALUES (?, ?, ?)", (name, header, sqlType))
+                    if header in INDEXED_COLUMNS:
+                        self.connection.execute('CREATE INDEX IF NOT EXISTS "results_%s" ON results ("%s")'
+                            %(name, name))
+            except sqlite3.OperationalError:
+                # Added by another process in the meantime
+                self._loadColumns()
+                if header not in self.columns:
+                    raise
+            self.columns[header] = (name, sqlType)
+
+    def _value(self, header, value):
+        if value is None or value == "":
+            return None
+        sqlType = self.columns[header][1]
+        if sqlType == "REAL":
+            return toSeconds(value)
+        elif sqlType == "INTEGER":
+            return int(float(value))
+        if isinstance(value, (int, float)):
+            return str(value)
+        return value
+
+    def _insert(self, rows, source):
+        # The columns must exist, see _addColumns
+        headers = sorted(set([header for row in rows for header in row]))
+        names = ", ".join(['"%s"' %self.columns[header][0] for header in headers])
+        sql = "INSERT INTO results (source, %s) VALUES (?, %s)" %(names, ", ".join(["?"] * len(headers)))
+        self.connection.executemany(sql, [[source] + [self._value(header, row.get(header)) for header in headers]
+            for row in rows])
+
+    def append(self, row, source=None):
+        """
+        Stores one result row.
+        """
+        self.appendMany([row], source)
+
+    def appendMany(self, rows, source=None):
+        """
+        Stores a list of result rows in one transaction.
+        """
+        if len(rows) == 0:
+            return
+        with self.lock:
+            self._addColumns(set([header for row in rows for header in row]))
+            with self.connection:
+                self._insert(rows, source)
+
+    def select(self, columns=None, since=None, until=None, **filters):
+        """
+        Builds the query of the result rows matching all filters.
+        columns:        list of headers to return, default all
+        since, until:   date range, e.g. "2017-03-01"
+        filters:        header (or its column name, e.g. operation for iget/iput) = value or list of values
+        The column 'source' returns the csv file of a row, it can be filtered as well.
+
+        Returns (sql, parameters, headers of the returned columns)
+        """
+        names = dict([(name, header) for header, (name, _) in self.columns.items()])
+        if columns is None:
+            columns = sorted(self.columns.keys(), key=lambda h: (h not in RESULT_HEADER,
+                RESULT_HEADER.index(h) if h in RESULT_HEADER else h)) + ["source"]
+        columnNames = dict([(header, name) for header, (name, _) in self.columns.items()])
+        columnNames["source"] = "source"
+        conditions = []
+        parameters = []
+        for key, value in sorted(filters.items()):
+            header = names.get(key, key)
+            if header != "source" and header not in self.columns:
+                raise KeyError("Unknown result column: "+str(key))
+            value = list(value) if isinstance(value, (list, tuple, set)) else [value]
+            if header == "source":
+                parameters.extend(value)
+            else:
+                parameters.extend([self._value(header, v) for v in value])
+            conditions.append('"%s" IN (%s)' %(columnNames[header], ", ".join(["?"] * len(value))))
+        if since is not None:
+            conditions.append("date >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("date < ?")
+            parameters.append(until)
+
+        sql = "SELECT %s FROM results" %", ".join(['"%s"' %columnNames[header] for header in columns])
+        if len(conditions) > 0:
+            sql = sql + " WHERE " + " AND ".join(conditions)
+        return sql + " ORDER BY id", parameters, columns
+
+    def lastId(self):
+        """
+        Returns the id of the last stored row, 0 for an empty store.
+        """
+        with self.lock:
+            return self.connection.execute("SELECT MAX(id) FROM results").fetchone()[0] or 0
+
+    def removeAfter(self, lastId, source):
+        """
+        Deletes the rows of a source stored after the row lastId (see lastId).
+        """
+        with self.lock:
+            with self.connection:
+                self.connection.execute("DELETE FROM results WHERE source = ? AND id > ?", (source, lastId))
+
+    def query(self, columns=None, since=None, until=None, **filters):
+        """
+        Returns the result rows matching all filters as dictionaries, see select.
+        """
+        sql, parameters, headers = self.select(columns, since, until, **filters)
+        with self.lock:
+            return [dict(zip(headers, values)) for values in self.connection.execute(sql, parameters)]
+
+    def importCsv(self, path, force=False):
+        """
+        Imports a result file. A file that did not change since its last import is skipped,
+        a changed file (e.g. a resumed run) replaces its earlier rows.
+        Returns the number of imported rows.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            imported = self.connection.execute("SELECT size, mtime FROM imports WHERE path = ?", (path,)).fetchone()
+        if not force and imported is not None and tuple(imported) == (stat.st_size, stat.st_mtime):
+            return 0
+
+        with _openCsv(path, "r") as f:
+            rows = [dict([(key, value) for key, value in row.items() if key is not None]) for row in csv.DictReader(f)]
+        with self.lock:
+            self._addColumns(set([header for row in rows for header in row]))
+            with self.connection:
+                self.connection.execute("DELETE FROM results WHERE source = ?", (path,))
+                self._insert(rows, path)
+                self.connection.execute("INSERT OR REPLACE INTO imports VALUES (?, ?, ?, ?)",
+                    (path, stat.st_size, stat.st_mtime, len(rows)))
+        return len(rows)
+
+    def close(self):
+        self.connection.close()
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(2)
+
+    store = ResultStore(sys.argv[1])
+    for path in sys.argv[2:]:
+        n = store.importCsv(path)
+        print("%s: %d rows" %(path, n) if n > 0 else "%s: unchanged" %path)
+    store.close()
+
+if __name__ == "__main__":
+    main()
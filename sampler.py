@@ -0,0 +1,176 @@
+"""
+Samples the progress of a transfer while it runs, the time series shows slow starts, stalls and the
+time after the data is moved (checksums, catalog registration) that the total time hides.
+
+The bytes moved are read every interval:
+    iget:   size of the destination file (or of all files below the destination folder)
+    iput:   bytes the process has written to files and sockets, wchar of /proc/<pid>/io
+An iget to an existing destination (iget -f) is sampled like an iput, the size of a file that is
+overwritten says nothing about the progress.
+
+A sampler is a monitor of icommands.run and backends.timedCall: it is started with the pid of the
+transfer process (the test process for in-process backends) and stopped when the transfer ends.
+
+    sampler = ThroughputSampler(interval=0.1, path=localFile)
+    res = BACKEND.get(iresource, obj, localFile, monitors=[sampler])
+    print sampler.summary()
+"""
+
+import os
+import json
+import threading
+from icommands import monotonic
+
+def processBytes(pid):
+    """
+    Returns the bytes written by a process (wchar of /proc/<pid>/io), None if not readable.
+    """
+    try:
+        with open("/proc/%d/io" %pid) as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return None
+
+def pathBytes(path):
+    """
+    Returns the size of a file or of all files below a folder, 0 if it does not exist (yet).
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total = total + os.path.getsize(os.path.join(root, f))
+            except OSError:
+                # removed or renamed while the transfer runs
+                pass
+    return total
+
+class ThroughputSampler(object):
+    """
+    Records (seconds since the start, bytes moved) every interval in a background thread.
+    interval:   seconds between two samples
+    path:       local destination of an iget, whose growth is sampled.
+                None samples the bytes written by the process (iput).
+    """
+
+    def __init__(self, interval=0.1, path=None):
+        self.interval = interval
+        self.path = path
+        self.samples = []
+        self.duration = None
+        self.mode = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _read(self):
+        if self.mode == "path":
+            return pathBytes(self.path)
+        value = processBytes(self.pid)
+        if value is None:
+            return None
+        return value - self.offset
+
+    def _sample(self):
+        value = self._read()
+        if value is not None:
+            self.samples.append((monotonic() - self.t0, value))
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self, pid):
+        """
+        Starts sampling the transfer of process pid.
+        """
+        self.pid = pid
+        self.t0 = monotonic()
+        self.mode = "path" if self.path is not None and pathBytes(self.path) == 0 else "wchar"
+        # wchar counts from the start of the process, in-process transfers start at any value. A command
+        # may have written everything before it is first read, its offset is 0.
+        self.offset = (processBytes(pid) or 0) if self.mode == "wchar" and pid == os.getpid() else 0
+        self.samples = [(0.0, self._read() or 0)]
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops sampling at the end of the transfer. icommands.run stops its monitors before the process
+        is reaped, the last sample has all bytes it wrote. Otherwise the last readable value counts.
+        """
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+        self.duration = monotonic() - self.t0
+
+    def summary(self, ramp=0.8):
+        """
+        Characterises the transfer:
+            bytes:              bytes moved
+            steady bandwidth:   bytes per second between 10% and 90% of the bytes
+            ramp up:            seconds until an interval first reaches ramp x steady bandwidth
+            tail time:          seconds from the last byte to the end of the transfer
+        Returns a dictionary, the values are None if the transfer moved no bytes.
+        """
+        summary = {"bytes": 0, "steady bandwidth": None, "ramp up": None, "tail time": None}
+        if len(self.samples) == 0:
+            return summary
+        total = max([b for _, b in self.samples])
+        summary["bytes"] = total
+        if total <= 0:
+            return summary
+
+        def reached(fraction):
+            return [t for t, b in self.samples if b >= fraction * total][0]
+        t10, t90, tEnd = reached(0.1), reached(0.9), reached(1.0)
+        if t90 > t10:
+            summary["steady bandwidth"] = 0.8 * total / (t90 - t10)
+        else:
+            # shorter than two samples
+            summary["steady bandwidth"] = total / max(tEnd, self.interval)
+
+        summary["ramp up"] = tEnd
+        for (t0, b0), (t1, b1) in zip(self.samples[:-1], self.samples[1:]):
+            if t1 > t0 and (b1 - b0) / (t1 - t0) >= ramp * summary["steady bandwidth"]:
+                summary["ramp up"] = t0
+                break
+        summary["tail time"] = max(0.0, (self.duration or self.samples[-1][0]) - tEnd)
+        return summary
+
+class SampleLog(object):
+    """
+    Json lines file with the time series of the sampled transfers, one line per transfer.
+    path:   file, samples of later runs are appended
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, sampler, **info):
+        """
+        Appends the samples and summary of a transfer.
+        info:   identifies the transfer, e.g. date, operation, source and destination
+        """
+        entry = dict(info)
+        entry.update(sampler.summary())
+        entry["interval"] = sampler.interval
+        entry["sampled"] = sampler.mode
+        entry["samples"] = [[round(t, 4), b] for t, b in sampler.samples]
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, sort_keys=True)+"\n")
+
+def readSamples(path):
+    """
+    Reads a SampleLog, returns a list of dictionaries.
+    """
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,175 @@
+"""
+Adaptive repetition of measurements. Instead of a fixed number of iterations, every configuration
+(e.g. (file, iput)) is repeated until the confidence interval of its mean throughput is narrower than
+a target, within a minimum and maximum number of iterations and a total time budget.
+Time saved on stable configurations goes to the noisy ones.
+
+    scheduler = AdaptiveScheduler([("sample1G", "iput"), ("sample1G", "iget")], budget=3600)
+    key = scheduler.next()
+    while key is not None:
+        ... measure key ...
+        scheduler.add(key, bytes / seconds, seconds)
+        key = scheduler.next()
+"""
+
+import math
+from timeit import default_timer as timer
+
+# Two-sided critical values of Student's t distribution for 1 .. 30 degrees of freedom
+T_TABLE = {
+    0.90: [6.314, 2.920, 2.353, 2.132, 2.015, 1.943, 1.895, 1.860, 1.833, 1.812,
+           1.796, 1.782, 1.771, 1.761, 1.753, 1.746, 1.740, 1.734, 1.729, 1.725,
+           1.721, 1.717, 1.714, 1.711, 1.708, 1.706, 1.703, 1.701, 1.699, 1.697],
+    0.95: [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+           2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+           2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042],
+    0.99: [63.657, 9.925, 5.841, 4.604, 4.032, 3.707, 3.499, 3.355, 3.250, 3.169,
+           3.106, 3.055, 3.012, 2.977, 2.947, 2.921, 2.898, 2.878, 2.861, 2.845,
+           2.831, 2.819, 2.807, 2.797, 2.787, 2.779, 2.771, 2.763, 2.756, 2.750],
+}
+Z_TABLE = {0.90: 1.645, 0.95: 1.960, 0.99: 2.576}
+
+def tCritical(level, df):
+    """
+    Returns the two-sided critical value of Student's t distribution.
+    level:  confidence level, 0.90, 0.95 or 0.99
+    df:     degrees of freedom, above 30 the value is approximated
+    """
+    if level not in T_TABLE:
+        raise ValueError("Unsupported confidence level: "+str(level))
+    if df < 1:
+        return float("inf")
+    if df <= len(T_TABLE[level]):
+        return T_TABLE[level][df - 1]
+    z = Z_TABLE[level]
+    return z + (z ** 3 + z) / (4. * df)
+
+def meanInterval(values, level=0.95):
+    """
+    Returns (mean, half width of the confidence interval of the mean).
+    """
+    n = len(values)
+    mean = sum(values) / float(n)
+    if n < 2:
+        return mean, float("inf")
+    std = math.sqrt(sum([(v - mean) ** 2 for v in values]) / (n - 1))
+    return mean, tCritical(level, n - 1) * std / math.sqrt(n)
+
+class AdaptiveScheduler(object):
+    """
+    Chooses the configuration to measure next.
+    keys:       configurations, in the order of the first rounds
+    minTimes:   iterations every configuration gets at least
+    maxTimes:   iterations no configuration gets more of
+    precision:  target of the half width of the confidence interval relative to the mean, 0.05 = +-5%
+    level:      confidence level
+    budget:     seconds for all measurements, None for no limit. A measurement is only started
+                if its expected duration fits into the remaining time.
+    """
+
+    def __init__(self, keys, minTimes=3, maxTimes=30, precision=0.05, level=0.95, budget=None):
+        self.keys = list(keys)
+        self.minTimes = minTimes
+        self.maxTimes = maxTimes
+        self.precision = precision
+        self.level = level
+        self.budget = budget
+        self.start = timer()
+        self.elapsed = 0.0      # time of earlier sessions (resumed runs)
+        self.samples = dict([(key, []) for key in self.keys])    # key --> [value]
+        self.durations = dict([(key, []) for key in self.keys])  # key --> [seconds]
+
+    def add(self, key, value, seconds):
+        """
+        Records a measurement of a configuration.
+        value:      measured throughput
+        seconds:    duration of the measurement including its verification
+        """
+        self.samples[key].append(value)
+        self.durations[key].append(seconds)
+
+    def relativeWidth(self, key):
+        """
+        Returns the half width of the confidence interval relative to the mean.
+        """
+        values = self.samples[key]
+        if len(values) < 2:
+            return float("inf")
+        mean, width = meanInterval(values, self.level)
+        if mean == 0:
+            return float("inf")
+        return width / abs(mean)
+
+    def converged(self, key):
+        n = len(self.samples[key])
+        return n >= self.maxTimes or (n >= self.minTimes and self.relativeWidth(key) <= self.precision)
+
+    def remaining(self):
+        """
+        Returns the remaining seconds of the budget, None without budget.
+        """
+        if self.budget is None:
+            return None
+        return self.budget - self.elapsed - (timer() - self.start)
+
+    def expected(self, key):
+        """
+        Returns the expected duration of the next measurement of a configuration.
+        """
+        durations = self.durations[key]
+        if len(durations) == 0:
+            return 0.0
+        return sum(durations) / len(durations)
+
+    def next(self):
+        """
+        Returns the configuration to measure next, None when all converged or the budget is spent.
+        Configurations below minTimes come first, in the order of keys, then the one with the widest
+        relative confidence interval.
+        """
+        remaining = self.remaining()
+        candidates = [key for key in self.keys if not self.converged(key) and
+            (remaining is None or self.expected(key) <= remaining)]
+        if len(candidates) == 0:
+            return None
+        rounds = min([len(self.samples[key]) for key in candidates])
+        if rounds < self.minTimes:
+            return [key for key in candidates if len(self.samples[key]) == rounds][0]
+        return max(candidates, key=lambda key: self.relativeWidth(key))
+
+    def state(self):
+        """
+        Returns the measurements as a json serialisable dictionary, see restore.
+        """
+        return {"elapsed": self.elapsed + timer() - self.start,
+            "samples": [[list(key), self.samples[key], self.durations[key]] for key in self.keys]}
+
+    def restore(self, state):
+        """
+        Continues with the measurements of an interrupted run.
+        """
+        self.elapsed = state["elapsed"]
+        self.start = timer()
+        for key, samples, durations in state["samples"]:
+            key = tuple(key)
+            if key in self.samples:
+                self.samples[key] = list(samples)
+                self.durations[key] = list(durations)
+
+    def report(self):
+        """
+        Returns a line per configuration: iterations, mean and relative confidence interval.
+        """
+        lines = []
+        for key in self.keys:
+            values = self.samples[key]
+            if len(values) == 0:
+                lines.append("%s: no measurement" %" ".join(key))
+                continue
+            mean, _ = meanInterval(values, self.level)
+            status = ""
+            if self.relativeWidth(key) > self.precision:
+                status = " (max iterations)" if len(values) >= self.maxTimes else " (not converged)"
+            lines.append("%s: %d iterations, mean %.4g, +-%.1f%%%s" %(" ".join(key), len(values), mean,
+                100 * self.relativeWidth(key), status))
+        return lines
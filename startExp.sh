@@ -4,24 +4,26 @@ module load icommands
 
 cd iRODS_tests
 
-#test datai
-echo "Copying testdata: cp -r /home/christin/testdata $TMPDIR"
-cp -r /home/christin/testdata $TMPDIR
+#test data, the fixed seed creates the same files on every node
+echo "Creating testdata: python testIRODS.py -g --seed 2017"
+python testIRODS.py -g --seed 2017
 
-for i in {1..5}; do
-echo "python testIRODS.py -p -r pocCompound -s /home/christin/astron/lisa_poci_pocCompound_files${i}.csv"
-python testIRODS.py -p -r pocCompound -s /home/christin/astron/lisa_poci_pocCompound_files${i}.csv
-python testIRODS.py -c
-
-echo "python testIRODS.py -p -r pocCompound -s /home/christin/astron/lisa_poci_pocCompound_files${i}.csv"
-python testIRODS.py -p -r pocCompound2 -s /home/christin/astron/lisa_poci_pocCompound2_files${i}.csv
-python testIRODS.py -c
+#runs a test unless its result file is complete, an interrupted test (checkpoint left) continues where it stopped
+#the collections are only cleaned after a completed test, a resumed test needs them
+runTest() {
+    out=$1
+    shift
+    if [ -f "$out" ] && [ ! -f "$out.checkpoint" ]; then
+        echo "Skipping completed test: $out"
+        return
+    fi
+    echo "python testIRODS.py $@ -s $out"
+    python testIRODS.py "$@" -s "$out" && python testIRODS.py -c
+}
 
-echo "python testIRODS.py -p -r pocCompound -s /home/christin/astron/lisa_poci_pocCompound_files${i}.csv"
-python testIRODS.py -p -d -r pocCompound -s /home/christin/astron/lisa_poci_pocCompound_coll${i}.csv
-python testIRODS.py -c
-
-echo "python testIRODS.py -p -r pocCompound -s /home/christin/astron/lisa_poci_pocCompound_files${i}.csv"
-python testIRODS.py -p -d -r pocCompound2 -s /home/christin/astron/lisa_poci_pocCompound2_coll${i}.csv
-python testIRODS.py -c
+for i in {1..5}; do
+runTest /home/christin/astron/lisa_poci_pocCompound_files${i}.csv -p -r pocCompound
+runTest /home/christin/astron/lisa_poci_pocCompound2_files${i}.csv -p -r pocCompound2
+runTest /home/christin/astron/lisa_poci_pocCompound_coll${i}.csv -p -d -r pocCompound
+runTest /home/christin/astron/lisa_poci_pocCompound2_coll${i}.csv -p -d -r pocCompound2
 done
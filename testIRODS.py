@@ -1,6 +1,10 @@
 """
     Usage:
     1) Cleaning testdata and folders
+        Removes the test collections (PERFORMANCE<n>, PERFORMANCEC<n>, ..., NETWORK<n>) this node created
+        (listed in <test data folder>/.collections) without trash, and the copies of the test data, in parallel.
+        Collections of an interrupted run that can be resumed are kept. Prints the data objects, files and
+        bytes removed.
                 python testIRODS.py -c
     2) Testing the connection to the iRODS server via port 1247 and all data pp
 orts
@@ -9,16 +13,78 @@ orts
     3) Performnace testing (takes a long time --> use screen or tmux)
         Uses by default the iRODS defaultResc as destination resource
         Writes results to /home/<user>/results.csv
-                python testIRODS.py -p [-r <irods resource>] [-s <csv file>]
+                python testIRODS.py -p [-r <irods resource>] [-s <csv file>] [--keep <n>] [--pipeline]
+        Every iteration leaves a local copy and a data object of each file, --keep 1 removes them as soon
+        as the next copy is verified: the test needs room for one copy of the test data instead of nine.
+        --pipeline verifies the checksums of a transfer while the next transfer runs, a mismatch is 
+        recorded in the column integrity and stops the test after the running transfer.
     4) Performance testing trasnfers of a folder with 100x10MB files
-        python testIRODS.py -p -d -r <irods resource> [-s <csv file>]
+        python testIRODS.py -p -d -r <irods resource> [-s <csv file>] [--keep <n>]
+    5) Performance testing with several concurrent iput/iget streams, e.g. 1, 2, 4 and 8 streams
+        python testIRODS.py -p -n 1,2,4,8 -r <irods resource> [-s <csv file>]
+    6) Performance testing with many small files, transferred one by one and with iput/iget -r
+        Creates its own test data in $TMPDIR/testdata-small (or $HOME/testdata-small)
+        python testIRODS.py -p -m [--count <files per size>] [--sizes 1K,64K,1M] -r <irods resource> [-s <csv file>]
+    7) Performance testing like 3), but every file and direction is repeated until the 95% confidence 
+        interval of the throughput is narrower than +-precision (default 0.05), at least --min (3) and 
+        at most --max (30) times, within a time budget in seconds
+        python testIRODS.py -p -a [--min <n>] [--max <n>] [--precision <p>] [--budget <seconds>] -r <irods resource> [-s <csv file>]
+    8) Sweep over the transfer settings: every file and folder is transferred with each combination of 
+        parallel threads (-N), bulk upload (-b) and checksums (-K), the best settings per size are printed.
+        A json file can replace the default grid (see iRODStestFunctions.SWEEP_GRID), e.g.
+        {"threads": [1, 4, 16], "bulk": [true], "checksum": [true, false]}
+        python testIRODS.py -p -w [--grid <json file>] [--max <n>] -r <irods resource> [-s <csv file>]
+    9) Network only performance testing: the files are staged in /dev/shm (or another memory backed 
+        folder, without room they are read from the page cache) and downloaded to a checksumming null sink 
+        (iget <object> -), the local disk takes no part. The result file starts with the disk baseline 10).
+        python testIRODS.py -p -x [--staging <folder>] -r <irods resource> [-s <csv file>]
+    10) Local disk baseline: writes and reads files of the test data sizes in the test data folder with 
+        an empty page cache, rows with the operations "disk write" and "disk read" of the resource "local"
+        python testIRODS.py -p -l [-s <csv file>]
+    11) Creating the test data in $TMPDIR/testdata (or $HOME/testdata)
+        The same seed creates the same files on every node, a json file can replace 
+        the default size matrix (see iRODStestFunctions.TESTDATA_MATRIX)
+                python testIRODS.py -g [--seed <seed>] [--matrix <json file>]
+
+    The tests 3) - 10) write every result as soon as it is measured to the csv file and to a json lines 
+    file next to it (<csv file without .csv>.jsonl). Completed steps are recorded in <csv file>.checkpoint, 
+    the same command continues an interrupted run instead of starting over.
+    --db <sqlite file> stores the results in a database as well (see results.ResultStore), 
+    existing csv files are imported with: python results.py <sqlite file> <csv file> ...
+    --samples <json lines file> records the bytes moved every --interval seconds (default 0.1) during each
+    transfer (see sampler.py), the result rows get the columns ramp up, steady bandwidth and tail time.
+    --profile <seconds> samples the CPU, disk and network use of the node during each transfer (see 
+    profiling.py), the result rows get the utilisations and the bottleneck: disk, network, cpu or server,
+    unknown if the network interface does not report its link speed (virtual interfaces), --link sets it.
+
+    The tests 2) - 9) use the icommands by default, -b prc transfers with python-irodsclient 
+    in the test process, reusing its connections. --threads sets the number of parallel transfer 
+    threads (not with -b sim), --buffer the read/write buffer in bytes (prc only).
+                python testIRODS.py -p -b prc [--threads <n>] [--buffer <bytes>] ...
+    -b sim runs the tests against a zone simulated on the local file system, --config passes a json 
+    file with the settings of the backend (see backends.SimulatedBackend), e.g.
+    {"root": "/tmp/simzone", "resources": {"pocCompound": {"bandwidth": 100000000, "latency": 0.01}}}
+                python testIRODS.py -p -b sim [--config <json file>] ...
+    The icommands backend takes timeouts per icommand and a limit of icommands running at the same time 
+    (see backends.IcommandsBackend), e.g. {"timeouts": {"iput": 7200, "iget": 7200, "ils": 300}, "limit": 8}.
+    A command that exceeds its timeout is killed with all processes it started, it fails like an icommand 
+    with an error. When the test is terminated (SIGTERM, e.g. at the walltime of a batch job) or interrupted, 
+    the running icommands are killed as well.
 
 """
 
 from iRODStestFunctions import createTestData, createEnvJSON, performanceSingleFiles, connectivity, cleanUp
-from iRODStestFunctions import performanceCollections
+from iRODStestFunctions import performanceCollections, performanceConcurrent, getTestDataDir, TESTDATA_MATRIX
+from iRODStestFunctions import setBackend, performanceSmallFiles, performanceAdaptive, performanceSweep
+from iRODStestFunctions import bestSettings, setSampling, setMonitoring, SWEEP_GRID
+from iRODStestFunctions import performanceNetwork, diskBaseline, STAGING
+from backends import createBackend
+from results import ResultSink, Checkpoint, ResultStore
 import csv
+import json
+import icommands
 import getopt
+import signal
 import sys
 import os
 
@@ -27,7 +93,36 @@ GREEN   = "\033[92m"
 BLUE    = "\033[34m"
 DEFAULT = "\033[0m"
 
-def testConnectivity(iresource):
+def openResults(resFile, database=None):
+    """
+    Opens <resFile> and <resFile>.checkpoint. If the checkpoint of an interrupted run exists, 
+    the run continues where it stopped and the results are appended, the rows of the step that was
+    interrupted are replaced, otherwise the result files are created anew. With a database file, the results are stored in the results.ResultStore as well.
+    Returns (results.ResultSink, results.Checkpoint)
+    """
+    if not os.path.isdir(os.path.dirname(os.path.abspath(resFile))):
+        raise Exception("Path does not exist: " + os.path.dirname(resFile))
+
+    checkpoint = Checkpoint(resFile+".checkpoint")
+    if checkpoint.exists():
+        print "%sResuming interrupted run:%s" %(BLUE, DEFAULT), checkpoint.path
+    store = None
+    if database is not None:
+        store = ResultStore(database)
+    sink = ResultSink(resFile, fresh=not checkpoint.exists(), store=store, position=checkpoint.position)
+    checkpoint.attach(sink)
+    return sink, checkpoint
+
+def closeResults(sink, checkpoint):
+    """
+    Closes the result files of a completed run and removes its checkpoint.
+    """
+    sink.close()
+    if sink.store is not None:
+        sink.store.close()
+    checkpoint.remove()
+
+def testConnectivity(iresource, testdata):
     #create test data
     #createTestData()
     #setup iRODS environment
@@ -42,10 +137,10 @@ def testConnectivity(iresource):
 
     createEnvJSON(uname, host, zone)
     #test connectivity: "irodsRescScaleout" or "irodsResc"
-    result = connectivity(iresource)
+    result = connectivity(iresource, testdata+"/sample100M.txt_0")
     print result
 
-def testPerformance(iresource, resFile):
+def testPerformance(iresource, resFile, database=None, keep=None, pipelined=False):
     #create test data
     #createTestData()
     #setup iRODS environment
@@ -58,19 +153,12 @@ def testPerformance(iresource, resFile):
     zone    = "pocZone"
     createEnvJSON(uname, host, zone)
 
-    if not os.path.isdir(os.path.dirname(resFile)):
-        raise Exception("Path does not exist: " + os.path.dirname(resFile))
-
     #test performance: "irodsRescScaleout" or "irodsResc"
-    result = performanceSingleFiles(iresource)
-    with open(resFile,"wb") as out:
-        csv_out=csv.writer(out)
-        #(date, resource, client, iput/iget, size, real time, user time, system time)
-        csv_out.writerow(["date","iresource", "client", "iget/iput", "size", "real time", "user time", "system time"])
-        for row in result:
-            csv_out.writerow(row)
+    sink, checkpoint = openResults(resFile, database)
+    performanceSingleFiles(iresource, sink=sink, checkpoint=checkpoint, keep=keep, pipelined=pipelined)
+    closeResults(sink, checkpoint)
     
-def testPerformanceDir(iresource, resFile):
+def testPerformanceDir(iresource, resFile, database=None, keep=None):
     #createTestData()
     #setup iRODS environment
     #uname   = "c.staiger"
@@ -83,14 +171,79 @@ def testPerformanceDir(iresource, resFile):
 
     createEnvJSON(uname, host, zone)
 
-    result = performanceCollections(iresource)
-    with open(resFile,"wb") as out:
-        csv_out=csv.writer(out)
-        #(date, resource, client, iput/iget, size, real time, user time, system time)
-        csv_out.writerow(["date","iresource", "client", "iget/iput", "size", "real time", "user time", "system time"])
-        for row in result:
-            csv_out.writerow(row)
+    sink, checkpoint = openResults(resFile, database)
+    performanceCollections(iresource, sink=sink, checkpoint=checkpoint, keep=keep)
+    closeResults(sink, checkpoint)
+
+def testPerformanceConcurrent(iresource, resFile, levels, database=None):
+    uname   = "christine"
+    host    = "pocicat.astron.nl"
+    zone    = "pocZone"
+
+    createEnvJSON(uname, host, zone)
+
+    sink, checkpoint = openResults(resFile, database)
+    performanceConcurrent(iresource, levels, sink=sink, checkpoint=checkpoint)
+    closeResults(sink, checkpoint)
+
+def testPerformanceSmallFiles(iresource, resFile, sizes, count, seed, database=None):
+    uname   = "christine"
+    host    = "pocicat.astron.nl"
+    zone    = "pocZone"
+
+    createEnvJSON(uname, host, zone)
+
+    sink, checkpoint = openResults(resFile, database)
+    performanceSmallFiles(iresource, sizes, count, seed=seed, sink=sink, checkpoint=checkpoint)
+    closeResults(sink, checkpoint)
+
+def testPerformanceAdaptive(iresource, resFile, minTimes, maxTimes, precision, budget, database=None):
+    uname   = "christine"
+    host    = "pocicat.astron.nl"
+    zone    = "pocZone"
+
+    createEnvJSON(uname, host, zone)
+
+    sink, checkpoint = openResults(resFile, database)
+    performanceAdaptive(iresource, minTimes, maxTimes, precision, budget, sink=sink, checkpoint=checkpoint)
+    closeResults(sink, checkpoint)
+
+def testPerformanceSweep(iresource, resFile, grid, maxTimes, database=None):
+    uname   = "christine"
+    host    = "pocicat.astron.nl"
+    zone    = "pocZone"
+
+    createEnvJSON(uname, host, zone)
+
+    sink, checkpoint = openResults(resFile, database)
+    performanceSweep(iresource, grid, maxTimes, sink=sink, checkpoint=checkpoint)
+    closeResults(sink, checkpoint)
+
+    # all rows of the run, including those of an interrupted session
+    with open(resFile) as f:
+        best = bestSettings(list(csv.DictReader(f)))
+    print "%sBest settings:%s" %(GREEN, DEFAULT)
+    for row in best:
+        default = "" if row["default MB/s"] is None else ", -b -K: %.1f MB/s" %row["default MB/s"]
+        print "%s %s %s: %s, %.1f MB/s (%d runs)%s" %(row["iresource"], row["size"], row["iget/iput"], 
+            row["settings"] or "no flags", row["median MB/s"], row["runs"], default)
+
+def testPerformanceNetwork(iresource, resFile, staging, database=None):
+    uname   = "christine"
+    host    = "pocicat.astron.nl"
+    zone    = "pocZone"
+
+    createEnvJSON(uname, host, zone)
+
+    sink, checkpoint = openResults(resFile, database)
+    diskBaseline(sink=sink, checkpoint=checkpoint)
+    performanceNetwork(iresource, staging=staging, sink=sink, checkpoint=checkpoint)
+    closeResults(sink, checkpoint)
 
+def testDiskBaseline(resFile, database=None):
+    sink, checkpoint = openResults(resFile, database)
+    diskBaseline(sink=sink, checkpoint=checkpoint)
+    closeResults(sink, checkpoint)
 
 def main():
     """
@@ -103,14 +256,38 @@ def main():
     3) Performnace testing (takes a long time --> use screen or tmux)
         Uses by default the iRODS defaultResc as destination resource
         Writes results to /home/<user>/results.csv
-                python testIRODS.py -p [-r <irods resource>] [-s <csv file>]
+                python testIRODS.py -p [-r <irods resource>] [-s <csv file>] [--keep <n>] [--pipeline]
     4) Performance testing trasnfers of a folder with 100x10MB files
-        python testIRODS.py -p -d -r irodsRescScaleout [-s <csv file>]
+        python testIRODS.py -p -d -r irodsRescScaleout [-s <csv file>] [--keep <n>]
+    5) Performance testing with several concurrent iput/iget streams, e.g. 1, 2, 4 and 8 streams
+        python testIRODS.py -p -n 1,2,4,8 -r <irods resource> [-s <csv file>]
+    6) Performance testing with many small files
+        python testIRODS.py -p -m [--count <files per size>] [--sizes 1K,64K,1M] -r <irods resource> [-s <csv file>]
+    7) Adaptive performance testing, repeats transfers until the throughput is known to +-precision
+        python testIRODS.py -p -a [--min <n>] [--max <n>] [--precision <p>] [--budget <seconds>] -r <irods resource> [-s <csv file>]
+    8) Sweep over the transfer settings threads (-N), bulk upload (-b) and checksums (-K)
+        python testIRODS.py -p -w [--grid <json file>] [--max <n>] -r <irods resource> [-s <csv file>]
+    9) Network only performance testing, data staged in memory and downloaded to a null sink
+        python testIRODS.py -p -x [--staging <folder>] -r <irods resource> [-s <csv file>]
+    10) Local disk baseline
+        python testIRODS.py -p -l [-s <csv file>]
+    11) Creating the test data in $TMPDIR/testdata (or $HOME/testdata)
+                python testIRODS.py -g [--seed <seed>] [--matrix <json file>]
+    The tests 2) - 9) use the icommands by default, for python-irodsclient:
+                python testIRODS.py -p -b prc [--threads <n>] [--buffer <bytes>] ...
+    Simulated zone on the local file system:
+                python testIRODS.py -p -b sim [--config <json file>] ...
+    Storing the results of 3) - 10) in a database as well:
+                python testIRODS.py -p --db <sqlite file> ...
+    Sampling the progress of the transfers:
+                python testIRODS.py -p --samples <json lines file> [--interval <seconds>] ...
+    Profiling the CPU, disk and network use of the client during the transfers:
+                python testIRODS.py -p --profile <seconds> [--link <Gbit/s>] ...
 
     """
     # parse command line options
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hr:s:cpod", ["help"])
+        opts, args = getopt.getopt(sys.argv[1:], "hr:s:cpodgn:b:mawxl", ["help", "seed=", "matrix=", "threads=", "buffer=", "config=", "count=", "sizes=", "db=", "min=", "max=", "precision=", "budget=", "grid=", "samples=", "interval=", "profile=", "link=", "staging=", "keep=", "pipeline"])
     except getopt.error, msg:
         print msg
         print "for help use --help"
@@ -126,6 +303,32 @@ def main():
     resource    = "defaultResc"
     out         = os.environ["HOME"]+"/results.csv"
     coll        = False
+    levels      = None
+    small       = False
+    count       = 1000
+    sizes       = ["1K", "64K", "1M"]
+    generate    = False
+    seed        = None
+    matrix      = TESTDATA_MATRIX
+    backend     = "icommands"
+    options     = {}
+    database    = None
+    adaptive    = False
+    minTimes    = 3
+    maxTimes    = None
+    precision   = 0.05
+    budget      = None
+    sweep       = False
+    grid        = SWEEP_GRID
+    samples     = None
+    interval    = 0.1
+    profile     = None
+    link        = None
+    network     = False
+    disk        = False
+    staging     = STAGING
+    keep        = None
+    pipelined   = False
 
     for o, a in opts:
         print o, a
@@ -145,18 +348,121 @@ def main():
             out = a
         elif o == "-d":
             coll = True
+        elif o == "-n":
+            levels = [int(n) for n in a.split(",")]
+        elif o == "-b":
+            backend = a
+        elif o == "--threads":
+            options["threads"] = int(a)
+        elif o == "--buffer":
+            options["bufferSize"] = int(a)
+        elif o == "--config":
+            with open(a) as f:
+                options.update(json.load(f))
+        elif o == "-m":
+            small = True
+        elif o == "--count":
+            count = int(a)
+        elif o == "--sizes":
+            sizes = a.split(",")
+        elif o == "-g":
+            generate = True
+        elif o == "--seed":
+            seed = a
+        elif o == "-a":
+            adaptive = True
+        elif o == "--min":
+            minTimes = int(a)
+        elif o == "--max":
+            maxTimes = int(a)
+        elif o == "--precision":
+            precision = float(a)
+        elif o == "--budget":
+            budget = float(a)
+        elif o == "-w":
+            sweep = True
+        elif o == "--grid":
+            with open(a) as f:
+                grid = json.load(f)
+        elif o == "--samples":
+            samples = a
+        elif o == "--interval":
+            interval = float(a)
+        elif o == "-x":
+            network = True
+        elif o == "-l":
+            disk = True
+        elif o == "--staging":
+            staging = a
+        elif o == "--keep":
+            keep = int(a)
+        elif o == "--pipeline":
+            pipelined = True
+        elif o == "--profile":
+            profile = float(a)
+        elif o == "--link":
+            # Gbit/s --> bytes per second
+            link = float(a) * 1e9 / 8
+        elif o == "--db":
+            database = a
+        elif o == "--matrix":
+            with open(a) as f:
+                matrix = json.load(f)
         else:
             print "option unknown"
             sys.exit(2)
 
+    if count < 1:
+        print "%s--count must be at least 1%s" %(RED, DEFAULT)
+        sys.exit(2)
+    if keep is not None and keep < 1:
+        print "%s--keep must be at least 1, the latest copy is the source of the next transfer%s" %(RED, DEFAULT)
+        sys.exit(2)
+    if "threads" in options and backend not in ("icommands", "prc"):
+        print "%s--threads is only supported by the backends icommands and prc%s" %(RED, DEFAULT)
+        sys.exit(2)
+    if "bufferSize" in options and backend != "prc":
+        print "%s--buffer is only supported by the backend prc (-b prc)%s" %(RED, DEFAULT)
+        sys.exit(2)
+
+    signal.signal(signal.SIGTERM, icommands.terminate)
+    setBackend(createBackend(backend, **options))
+    setSampling(samples, interval)
+    setMonitoring(profile, link)
+
+    if generate:
+        print "Creating test data in", getTestDataDir()
+        createTestData(matrix=matrix, seed=seed)
+        if not clean and not perform and not connect:
+            sys.exit(0)
+
     if clean and not perform and not connect:
         print "Cleaning"
-        colls = ["PERFORMANCE"+str(i) for i in range(10)]
-        colls.extend(["PERFORMANCEC"+str(i) for i in range(10)])
-        colls.append("PERFORMANCEC0")
-        colls.extend(["CONNECTIVITY"+str(i) for i in range(10)])
-        print colls
-        cleanUp(collections = colls, folders = [os.environ["TMPDIR"]+"/testdata"])
+        cleanUp(folders = [getTestDataDir(), getTestDataDir()+"-small"])
+    elif network and perform and not clean and not connect:
+        print "[NETWORK] Performance testing on resource", resource, "with the data staged in", staging
+        print "Writing results to", out
+        testPerformanceNetwork(resource, out, staging, database)
+    elif disk and perform and not clean and not connect:
+        print "[DISK] Local disk baseline in", getTestDataDir()
+        print "Writing results to", out
+        testDiskBaseline(out, database)
+    elif sweep and perform and not clean and not connect:
+        print "[SWEEP] Performance testing on resource", resource, "with the settings", grid
+        print "Writing results to", out
+        testPerformanceSweep(resource, out, grid, maxTimes or 4, database)
+    elif adaptive and perform and not clean and not connect:
+        print "[ADAPTIVE] Performance testing on resource", resource, "to +-%g%%" %(100 * precision)
+        print "Writing results to", out
+        testPerformanceAdaptive(resource, out, minTimes, maxTimes or 30, precision, budget, database)
+    elif small and perform and not clean and not connect:
+        print "[SMALL FILES] Performance testing on resource", resource, "with", count, "files of", sizes
+        print "Writing results to", out
+        testPerformanceSmallFiles(resource, out, sizes, count, seed, database)
+    elif levels and perform and not clean and not connect:
+        print "[CONCURRENT] Performance testing on resource", resource, "with", levels, "streams"
+        print "Writing results to", out
+        testPerformanceConcurrent(resource, out, levels, database)
     elif coll and perform and not clean and not connect:
         print "[COLL] Performance testing on resource", resource
         if "TMPDIR" not in os.environ:
@@ -164,7 +470,7 @@ def main():
         else:
             testdata = os.environ["TMPDIR"]+"/testdata"
         print "Writing results to",
-        testPerformanceDir(resource, out)
+        testPerformanceDir(resource, out, database, keep)
     elif perform and not clean and not connect:
         print "[SINGLE FILES] Performance testing on resource", resource
         if "TMPDIR" not in os.environ:
@@ -172,7 +478,7 @@ def main():
         else:
             testdata = os.environ["TMPDIR"]+"/testdata"
         print "Writing results to", 
-        testPerformance(resource, out)
+        testPerformance(resource, out, database, keep, pipelined)
     elif connect and not clean and not perform:
         print "Connection test on resource", resource
         if "TMPDIR" not in os.environ:
@@ -0,0 +1,93 @@
+"""
+Tests of the parsers of ils -L and iquest output, see catalog.py. Python 2 like the icommands module.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from catalog import parseIlsLong, parseIquest, IQUEST_SEP
+
+ILS_RECURSIVE = "\n".join([
+    "/pocZone/home/rods/PERFORMANCE1:",
+    "  rods              0 pocCompound;cache        104857600 2017-03-01.10:00 & sample100M.txt_1",
+    "    sha2:47DEQpj8HBSa+/TImW+5JCeuQeRkm5NMpJWZG3hSuFU=    generic    /vault/cache/home/rods/PERFORMANCE1/sample100M.txt_1",
+    "  rods              1 pocCompound;archive      104857600 2017-03-01.10:01 & sample100M.txt_1",
+    "    sha2:47DEQpj8HBSa+/TImW+5JCeuQeRkm5NMpJWZG3hSuFU=    generic    /vault/archive/home/rods/PERFORMANCE1/sample100M.txt_1",
+    "  rods              0 demoResc                    12 2017-03-01.10:02   my file 2.txt",
+    "        generic    /vault/demo/home/rods/PERFORMANCE1/my file 2.txt",
+    "  C- /pocZone/home/rods/PERFORMANCE1/Coll10MB_1",
+    "/pocZone/home/rods/PERFORMANCE1/Coll10MB_1:",
+    "  rods              0 demoResc              10485760 2017-03-01.10:03 & sample10MB_0.txt",
+    "    sha2:abc=    generic    /vault/demo/home/rods/PERFORMANCE1/Coll10MB_1/sample10MB_0.txt",
+    "",
+])
+
+class ParseIlsLongTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = parseIlsLong(ILS_RECURSIVE, "PERFORMANCE1")
+
+    def testReplicas(self):
+        path = "/pocZone/home/rods/PERFORMANCE1/sample100M.txt_1"
+        replicas = self.index.replicas(path)
+        self.assertEqual([r.replica for r in replicas], [0, 1])
+        self.assertEqual([r.resource for r in replicas], ["pocCompound;cache", "pocCompound;archive"])
+        self.assertEqual(replicas[1].physical, "/vault/archive/home/rods/PERFORMANCE1/sample100M.txt_1")
+        self.assertEqual(self.index.size(path), 104857600)
+        self.assertEqual(self.index.checksum(path), "sha2:47DEQpj8HBSa+/TImW+5JCeuQeRkm5NMpJWZG3hSuFU=")
+
+    def testNameWithSpacesStaleWithoutChecksum(self):
+        path = "/pocZone/home/rods/PERFORMANCE1/my file 2.txt"
+        replica = self.index.replicas(path)[0]
+        self.assertFalse(replica.good)
+        self.assertEqual(replica.size, 12)
+        self.assertEqual(replica.physical, "/vault/demo/home/rods/PERFORMANCE1/my file 2.txt")
+        self.assertEqual(self.index.checksum(path), None)
+
+    def testCollections(self):
+        self.assertEqual(self.index.root, "/pocZone/home/rods/PERFORMANCE1")
+        self.assertTrue("/pocZone/home/rods/PERFORMANCE1/Coll10MB_1" in self.index.collections)
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.totalSize(), 2 * 104857600 + 12 + 10485760)
+
+    def testRelativePaths(self):
+        # paths relative to the query resolve with the root of the listing
+        self.assertTrue("PERFORMANCE1/Coll10MB_1/sample10MB_0.txt" in self.index)
+        self.assertEqual(sorted(self.index.relativePaths("PERFORMANCE1/Coll10MB_1").keys()), ["sample10MB_0.txt"])
+        self.assertEqual(self.index.replicas("PERFORMANCE1/missing"), [])
+
+    def testSingleDataObject(self):
+        # ils -L <data object> prints no collection header
+        out = "\n".join(ILS_RECURSIVE.split("\n")[1:5])
+        index = parseIlsLong(out, "PERFORMANCE1/sample100M.txt_1")
+        self.assertEqual(index.paths(), ["PERFORMANCE1/sample100M.txt_1"])
+        self.assertEqual(len(index.replicas("PERFORMANCE1/sample100M.txt_1")), 2)
+
+    def testEmpty(self):
+        index = parseIlsLong("", "PERFORMANCE1")
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.totalSize(), 0)
+
+class ParseIquestTest(unittest.TestCase):
+
+    def testRows(self):
+        rows = [
+            ["/pocZone/home/rods/C1", "a b.txt", "0", "5", "sha2:x=", "pocCompound;cache", "1", "/vault/c/a b.txt"],
+            ["/pocZone/home/rods/C1", "a b.txt", "1", "5", "", "pocCompound;archive", "0", "/vault/a/a b.txt"],
+            ["/pocZone/home/rods/C1/sub", "c", "0", "7", "sha2:y=", "demoResc", "1", "/vault/d/c"],
+        ]
+        out = "\n".join([IQUEST_SEP.join(row) for row in rows] + ["", "CAT_NO_ROWS_FOUND: Nothing was found"])
+        index = parseIquest(out, "C1", "/pocZone/home/rods/C1")
+        self.assertEqual(len(index), 2)
+        replicas = index.replicas("C1/a b.txt")
+        self.assertEqual([(r.replica, r.good) for r in replicas], [(0, True), (1, False)])
+        self.assertEqual(index.checksum("/pocZone/home/rods/C1/a b.txt"), "sha2:x=")
+        self.assertEqual(index.size("C1/sub/c"), 7)
+        self.assertEqual(sorted(index.collections), ["/pocZone/home/rods/C1", "/pocZone/home/rods/C1/sub"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+"""
+Tests of the statistics of the regression check, see regression.py. Needs numpy and pandas
+(python 3 like the plots).
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import pandas as pd
+from regression import ranks, mannWhitneyU, cliffsDelta, compare
+
+def results(resource, operation, throughputs, iteration=None):
+    return pd.DataFrame({"iresource": resource, "client": "tcn1", "iget/iput": operation, "size": "1G",
+        "date": "2017-03-01 10:00:00", "iteration": iteration or list(range(1, len(throughputs) + 1)),
+        "integrity": "ok", "real time Gbit/s": throughputs})
+
+class StatisticsTest(unittest.TestCase):
+
+    def testRanks(self):
+        self.assertEqual(ranks([3, 1, 2]), [3.0, 1.0, 2.0])
+        # ties get the mean of their ranks
+        self.assertEqual(ranks([2, 1, 2, 3, 2]), [3.0, 1.0, 3.0, 5.0, 3.0])
+        self.assertEqual(ranks([]), [])
+
+    def testSeparated(self):
+        # scipy.stats.mannwhitneyu(x, y, method="asymptotic") gives U 0 and p 0.01219
+        u, p = mannWhitneyU([1, 2, 3, 4, 5], [6, 7, 8, 9, 10])
+        self.assertEqual(u, 0)
+        self.assertAlmostEqual(p, 0.012186, places=5)
+        self.assertEqual(cliffsDelta(u, 5, 5), -1)
+        u, p2 = mannWhitneyU([6, 7, 8, 9, 10], [1, 2, 3, 4, 5])
+        self.assertEqual(u, 25)
+        self.assertAlmostEqual(p, p2)
+        self.assertEqual(cliffsDelta(u, 5, 5), 1)
+
+    def testTies(self):
+        # U counts ties one half: 0 + 0.5 + 0.5 + 2; the tie correction lowers the variance
+        # from 12 to 16/12 * (9 - 48/56), p = erfc((|3 - 8| - 0.5) / sqrt(10.857) / sqrt(2))
+        u, p = mannWhitneyU([1, 2, 2, 3], [2, 3, 3, 4])
+        self.assertEqual(u, 3)
+        self.assertAlmostEqual(p, 0.172034, places=5)
+        self.assertAlmostEqual(cliffsDelta(u, 4, 4), -0.625)
+
+    def testAllEqual(self):
+        u, p = mannWhitneyU([1.5] * 4, [1.5] * 3)
+        self.assertEqual(u, 6)
+        self.assertEqual(p, 1.0)
+        self.assertEqual(cliffsDelta(u, 4, 3), 0)
+
+class CompareTest(unittest.TestCase):
+
+    def testStatus(self):
+        baseline = pd.concat([results("pocCompound", "iput", [1.0, 1.1, 1.05, 0.95, 1.02, 0.98]),
+            results("pocCompound", "iget", [2.0, 2.1, 1.9, 2.05, 1.95, 2.0]),
+            results("archive", "iput", [0.5, 0.6, 0.55])])
+        new = pd.concat([results("pocCompound", "iput", [0.7, 0.72, 0.68, 0.75, 0.71, 0.69]),
+            results("pocCompound", "iget", [2.02, 1.98, 2.1, 1.92, 2.0, 2.04]),
+            results("replica", "iget", [1.0, 1.1])])
+        report = compare(baseline, new)
+        status = dict([((r["iresource"], r["iget/iput"]), r["status"]) for _, r in report.iterrows()])
+        self.assertEqual(status, {("pocCompound", "iput"): "regression", ("pocCompound", "iget"): "unchanged",
+            ("archive", "iput"): "missing", ("replica", "iget"): "new"})
+        # regressions first
+        self.assertEqual(report["status"].iloc[0], "regression")
+        regression = report.iloc[0]
+        self.assertAlmostEqual(regression["change"], 0.705 / 1.01 - 1)
+        self.assertEqual(regression["delta"], -1)
+
+    def testWarmupAndFailedTransfers(self):
+        baseline = results("pocCompound", "iput", [1.0] * 6)
+        new = results("pocCompound", "iput", [0.1, 1.0, 1.0, 1.0, 1.0, 1.0, 0.2])
+        new.loc[6, "integrity"] = "checksum mismatch"
+        report = compare(baseline, new, warmup=1)
+        self.assertEqual(report["new n"].iloc[0], 5)
+        self.assertEqual(report["baseline n"].iloc[0], 5)
+        self.assertEqual(report["status"].iloc[0], "unchanged")
+
+if __name__ == "__main__":
+    unittest.main()
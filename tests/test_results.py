@@ -0,0 +1,144 @@
+"""
+Tests of the result sink, its checkpoint and resume, see results.py.
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import csv
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from results import ResultSink, Checkpoint, ResultStore, _openCsv
+
+def row(size, iteration, operation="iput"):
+    return {"date": "2017-03-01 10:00:00", "iresource": "pocCompound", "iget/iput": operation, "size": size,
+        "real time": 1.5, "iteration": iteration}
+
+class ResultsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = self.folder+"/results.csv"
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def readCsv(self):
+        with _openCsv(self.path, "r") as f:
+            return list(csv.DictReader(f))
+
+    def readJson(self):
+        with open(self.folder+"/results.jsonl") as f:
+            return [json.loads(line) for line in f]
+
+    def openRun(self, store=None):
+        # like testIRODS.openResults
+        checkpoint = Checkpoint(self.path+".checkpoint")
+        sink = ResultSink(self.path, fresh=not checkpoint.exists(), store=store, position=checkpoint.position)
+        checkpoint.attach(sink)
+        return sink, checkpoint
+
+class CheckpointTest(ResultsTest):
+
+    def testStepsAndValues(self):
+        checkpoint = Checkpoint(self.path+".checkpoint")
+        self.assertFalse(checkpoint.exists())
+        checkpoint.set("collection PERFORMANCE", "PERFORMANCE3")
+        checkpoint.mark("sample100M.txt", 1, "iput")
+        resumed = Checkpoint(self.path+".checkpoint")
+        self.assertTrue(resumed.done("sample100M.txt", 1, "iput"))
+        self.assertFalse(resumed.done("sample100M.txt", 1, "iget"))
+        self.assertEqual(resumed.get("collection PERFORMANCE"), "PERFORMANCE3")
+        self.assertEqual(resumed.get("unknown", 4), 4)
+        resumed.remove()
+        self.assertFalse(resumed.exists())
+
+    def testTornLastLine(self):
+        checkpoint = Checkpoint(self.path+".checkpoint")
+        checkpoint.mark("sample1G.txt", 1, "iput")
+        with open(checkpoint.path, "a") as f:
+            f.write('{"step": ["sample1G.txt", 1, "ig')
+        resumed = Checkpoint(checkpoint.path)
+        self.assertEqual(resumed.steps, set([("sample1G.txt", 1, "iput")]))
+
+class ResumeTest(ResultsTest):
+
+    def testResumeAppends(self):
+        sink, checkpoint = self.openRun()
+        sink.append(row("100M", 1))
+        checkpoint.mark("100M", 1)
+        sink.close()
+        sink, checkpoint = self.openRun()
+        self.assertTrue(checkpoint.done("100M", 1))
+        sink.append(row("100M", 2))
+        checkpoint.mark("100M", 2)
+        sink.close()
+        self.assertEqual([r["iteration"] for r in self.readCsv()], ["1", "2"])
+        self.assertEqual([r["iteration"] for r in self.readJson()], [1, 2])
+
+    def testInterruptedStepIsRemoved(self):
+        store = ResultStore(self.folder+"/results.db")
+        sink, checkpoint = self.openRun(store)
+        sink.append(row("100M", 1))
+        checkpoint.mark("100M", 1)
+        # killed after the rows of step 2 were written, before it was marked
+        sink.append(row("100M", 2))
+        sink.append(row("100M", 2, "iget"))
+        sink.close()
+
+        sink, checkpoint = self.openRun(store)
+        self.assertFalse(checkpoint.done("100M", 2))
+        self.assertEqual(len(self.readCsv()), 1)
+        self.assertEqual(len(self.readJson()), 1)
+        self.assertEqual(len(store.query()), 1)
+        sink.append(row("100M", 2))
+        checkpoint.mark("100M", 2)
+        sink.close()
+        self.assertEqual([r["iteration"] for r in self.readCsv()], ["1", "2"])
+        self.assertEqual([r["iteration"] for r in store.query(["iteration"])], [1, 2])
+        store.close()
+
+    def testInterruptedBeforeTheFirstStep(self):
+        sink, checkpoint = self.openRun()
+        sink.append(row("100M", 1))
+        sink.close()
+        sink, checkpoint = self.openRun()
+        sink.close()
+        self.assertEqual(self.readCsv(), [])
+        self.assertEqual(self.readJson(), [])
+
+    def testRemoveKeepsOtherSources(self):
+        store = ResultStore(self.folder+"/results.db")
+        store.append(row("1G", 1), "other.csv")
+        lastId = store.lastId()
+        store.append(row("1G", 2), "mine.csv")
+        store.append(row("1G", 3), "other.csv")
+        store.removeAfter(lastId, "mine.csv")
+        self.assertEqual([(r["iteration"], r["source"]) for r in store.query(["iteration", "source"])],
+            [(1, "other.csv"), (3, "other.csv")])
+        store.close()
+
+class ResultStoreTest(ResultsTest):
+
+    def testImportReplacesChangedFile(self):
+        sink = ResultSink(self.path)
+        sink.append(row("100M", 1))
+        sink.close()
+        store = ResultStore(self.folder+"/results.db")
+        self.assertEqual(store.importCsv(self.path), 1)
+        self.assertEqual(store.importCsv(self.path), 0)
+        sink = ResultSink(self.path, fresh=False)
+        sink.append(row("100M", 2))
+        sink.close()
+        # the size changed, the file is imported again
+        self.assertEqual(store.importCsv(self.path), 2)
+        self.assertEqual([r["real time"] for r in store.query(["real time"], size="100M")], [1.5, 1.5])
+        store.close()
+
+if __name__ == "__main__":
+    unittest.main()